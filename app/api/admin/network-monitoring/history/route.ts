@@ -1,6 +1,7 @@
 import { NextRequest, NextResponse } from 'next/server';
 import { auth } from '@/lib/auth';
 import { prisma } from '@/lib/prisma';
+import { getPingBuckets, summarizePingBuckets } from '@/lib/monitoring/ping-rollups';
 
 export async function GET(request: NextRequest) {
   try {
@@ -61,100 +62,36 @@ export async function GET(request: NextRequest) {
       }
     });
 
-    // Calculate statistics
+    // Statistics and hourly trends come from the rollups, not the raw rows above
+    const buckets = await getPingBuckets(endpointType, endpointId, since, 60);
+    const summary = summarizePingBuckets(buckets);
+
     const stats = {
-      totalPings: pingHistory.length,
-      successfulPings: pingHistory.filter(p => p.status === 'ONLINE').length,
-      failedPings: pingHistory.filter(p => ['OFFLINE', 'TIMEOUT', 'ERROR'].includes(p.status)).length,
-      averageResponseTime: 0,
-      maxResponseTime: 0,
-      minResponseTime: 0,
-      averagePacketLoss: 0,
+      totalPings: summary.samples,
+      successfulPings: summary.online,
+      failedPings: summary.offline + summary.timeout + summary.error,
+      averageResponseTime: summary.avgRtt !== null ? Math.round(summary.avgRtt) : 0,
+      maxResponseTime: summary.maxRtt !== null ? Math.round(summary.maxRtt) : 0,
+      minResponseTime: summary.minRtt !== null ? Math.round(summary.minRtt) : 0,
+      averagePacketLoss: summary.avgPacketLoss !== null ? parseFloat(summary.avgPacketLoss.toFixed(2)) : 0,
       statusChanges: statusHistory.length,
       uptimePercentage: 100
     };
 
-    const validResponseTimes = pingHistory
-      .filter(p => p.responseTimeMs && p.responseTimeMs > 0)
-      .map(p => p.responseTimeMs!);
-
-    if (validResponseTimes.length > 0) {
-      stats.averageResponseTime = Math.round(
-        validResponseTimes.reduce((sum, time) => sum + time, 0) / validResponseTimes.length
-      );
-      stats.maxResponseTime = Math.max(...validResponseTimes);
-      stats.minResponseTime = Math.min(...validResponseTimes);
-    }
-
-    const validPacketLoss = pingHistory
-      .filter(p => p.packetLoss !== null && p.packetLoss !== undefined)
-      .map(p => p.packetLoss!);
-
-    if (validPacketLoss.length > 0) {
-      stats.averagePacketLoss = parseFloat(
-        (validPacketLoss.reduce((sum, loss) => sum + loss, 0) / validPacketLoss.length).toFixed(2)
-      );
-    }
-
     if (stats.totalPings > 0) {
       stats.uptimePercentage = Math.round((stats.successfulPings / stats.totalPings) * 100);
     }
 
-    // Group ping results by hour for trend analysis
-    const hourlyData: Record<string, any> = {};
-    pingHistory.forEach(ping => {
-      const hour = new Date(ping.checkedAt).toISOString().slice(0, 13) + ':00:00.000Z';
-      if (!hourlyData[hour]) {
-        hourlyData[hour] = {
-          hour,
-          total: 0,
-          online: 0,
-          offline: 0,
-          slow: 0,
-          error: 0,
-          avgResponseTime: 0,
-          responseTimeSum: 0,
-          responseTimeCount: 0
-        };
-      }
-      
-      const data = hourlyData[hour];
-      data.total++;
-      
-      switch (ping.status) {
-        case 'ONLINE':
-          data.online++;
-          break;
-        case 'OFFLINE':
-          data.offline++;
-          break;
-        case 'SLOW':
-          data.slow++;
-          break;
-        case 'TIMEOUT':
-        case 'ERROR':
-          data.error++;
-          break;
-      }
-      
-      if (ping.responseTimeMs && ping.responseTimeMs > 0) {
-        data.responseTimeSum += ping.responseTimeMs;
-        data.responseTimeCount++;
-      }
-    });
-
-    // Calculate average response times for each hour
-    Object.values(hourlyData).forEach((data: any) => {
-      if (data.responseTimeCount > 0) {
-        data.avgResponseTime = Math.round(data.responseTimeSum / data.responseTimeCount);
-      }
-      delete data.responseTimeSum;
-      delete data.responseTimeCount;
-    });
-
-    const trends = Object.values(hourlyData).sort((a: any, b: any) => 
-      new Date(a.hour).getTime() - new Date(b.hour).getTime()
-    );
+    const trends = buckets.map(bucket => ({
+      hour: bucket.bucketStart.toISOString(),
+      total: bucket.sampleCount,
+      online: bucket.onlineCount,
+      offline: bucket.offlineCount,
+      slow: bucket.slowCount,
+      error: bucket.timeoutCount + bucket.errorCount,
+      avgResponseTime: bucket.avgRtt !== null ? Math.round(bucket.avgRtt) : 0,
+      p95ResponseTime: bucket.p95Rtt !== null ? Math.round(bucket.p95Rtt) : 0
+    }));
 
     return NextResponse.json({
       success: true,
@@ -0,0 +1,50 @@
+import { NextRequest } from 'next/server';
+import { authenticateApiKey, checkApiPermission, createApiErrorResponse, createApiSuccessResponse } from '@/lib/auth-api';
+import { acknowledgeAgentCommands } from '@/lib/monitoring/agent-commands';
+import { z } from 'zod';
+
+const ackSchema = z.object({
+  agent_id: z.string(),
+  acks: z.array(z.object({
+    id: z.string(),
+    status: z.enum(['COMPLETED', 'FAILED']),
+    result: z.record(z.any()).optional(),
+  })),
+});
+
+/**
+ * POST /api/monitoring/agent/commands/ack
+ * Report the outcome of commands executed by a monitoring agent
+ */
+export async function POST(request: NextRequest) {
+  try {
+    // Authenticate API key
+    const authResult = await authenticateApiKey(request);
+    if (!authResult.authenticated || !authResult.apiKey) {
+      return createApiErrorResponse(authResult.error || 'Unauthorized', 401);
+    }
+
+    // Check permission
+    if (!checkApiPermission(authResult.apiKey, 'monitoring:write')) {
+      return createApiErrorResponse('Insufficient permissions. Required: monitoring:write', 403);
+    }
+
+    const body = await request.json();
+    const parsed = ackSchema.safeParse(body);
+
+    if (!parsed.success) {
+      return createApiErrorResponse('Invalid request format', 400, parsed.error.errors);
+    }
+
+    const acknowledged = await acknowledgeAgentCommands(parsed.data.agent_id, parsed.data.acks);
+
+    return createApiSuccessResponse({
+      agent_id: parsed.data.agent_id,
+      acknowledged
+    });
+
+  } catch (error) {
+    console.error('Monitoring agent command ack error:', error);
+    return createApiErrorResponse('Failed to acknowledge commands', 500);
+  }
+}
@@ -0,0 +1,119 @@
+import { NextRequest, NextResponse } from 'next/server';
+import { auth } from '@/lib/auth';
+import { authenticateApiKey, checkApiPermission, createApiErrorResponse, createApiSuccessResponse } from '@/lib/auth-api';
+import { AGENT_COMMAND_TYPES, claimAgentCommands, enqueueAgentCommand } from '@/lib/monitoring/agent-commands';
+import { z } from 'zod';
+
+// Upper bound for how long a poll is held open, kept below common proxy timeouts
+const MAX_WAIT_SECONDS = 30;
+const POLL_INTERVAL_MS = 1000;
+
+const enqueueSchema = z.object({
+  type: z.enum(AGENT_COMMAND_TYPES),
+  agent_id: z.string().optional(),
+  entity_type: z.enum(['BRANCH', 'ATM']).optional(),
+  entity_id: z.string().optional(),
+  payload: z.record(z.any()).optional(),
+}).refine(
+  data => data.type === 'REFRESH_ENTITIES' || (data.entity_type && data.entity_id),
+  { message: 'entity_type and entity_id are required for entity commands' }
+);
+
+/**
+ * GET /api/monitoring/agent/commands?agent_id=...&wait=25
+ * Long-poll for commands queued for a monitoring agent
+ */
+export async function GET(request: NextRequest) {
+  try {
+    // Authenticate API key
+    const authResult = await authenticateApiKey(request);
+    if (!authResult.authenticated || !authResult.apiKey) {
+      return createApiErrorResponse(authResult.error || 'Unauthorized', 401);
+    }
+
+    // Check permission
+    if (!checkApiPermission(authResult.apiKey, 'monitoring:read')) {
+      return createApiErrorResponse('Insufficient permissions. Required: monitoring:read', 403);
+    }
+
+    const { searchParams } = new URL(request.url);
+    const agentId = searchParams.get('agent_id');
+    if (!agentId) {
+      return createApiErrorResponse('agent_id is required', 400);
+    }
+
+    const wait = Math.min(Math.max(parseInt(searchParams.get('wait') || '25', 10) || 0, 0), MAX_WAIT_SECONDS);
+    const deadline = Date.now() + wait * 1000;
+
+    let commands = await claimAgentCommands(agentId);
+    while (commands.length === 0 && Date.now() < deadline && !request.signal.aborted) {
+      await new Promise(resolve => setTimeout(resolve, POLL_INTERVAL_MS));
+      commands = await claimAgentCommands(agentId);
+    }
+
+    return createApiSuccessResponse({
+      agent_id: agentId,
+      commands: commands.map(c => ({
+        id: c.id,
+        type: c.type,
+        entity_type: c.entityType,
+        entity_id: c.entityId,
+        payload: c.payload,
+        created_at: c.createdAt.toISOString()
+      }))
+    });
+
+  } catch (error) {
+    console.error('Monitoring agent commands error:', error);
+    return createApiErrorResponse('Failed to fetch commands', 500);
+  }
+}
+
+/**
+ * POST /api/monitoring/agent/commands
+ * Queue a command (re-probe, refresh entities, pause entity) for monitoring agents
+ */
+export async function POST(request: NextRequest) {
+  try {
+    const session = await auth();
+
+    if (!session || !['ADMIN', 'SUPER_ADMIN', 'MANAGER_IT', 'TECHNICIAN'].includes(session.user.role)) {
+      return NextResponse.json(
+        { error: 'Unauthorized' },
+        { status: 401 }
+      );
+    }
+
+    const body = await request.json();
+    const parsed = enqueueSchema.safeParse(body);
+
+    if (!parsed.success) {
+      return NextResponse.json(
+        { error: 'Invalid request format', details: parsed.error.errors },
+        { status: 400 }
+      );
+    }
+
+    const command = await enqueueAgentCommand({
+      type: parsed.data.type,
+      agentId: parsed.data.agent_id,
+      entityType: parsed.data.entity_type,
+      entityId: parsed.data.entity_id,
+      payload: parsed.data.payload,
+      createdById: session.user.id
+    });
+
+    return NextResponse.json({
+      success: true,
+      command_id: command.id,
+      status: command.status
+    }, { status: 201 });
+
+  } catch (error) {
+    console.error('Error queueing monitoring agent command:', error);
+    return NextResponse.json(
+      { error: 'Failed to queue command' },
+      { status: 500 }
+    );
+  }
+}
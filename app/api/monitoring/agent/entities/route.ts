@@ -1,10 +1,17 @@
-import { NextRequest } from 'next/server';
+import { NextRequest, NextResponse } from 'next/server';
 import { prisma } from '@/lib/prisma';
 import { authenticateApiKey, checkApiPermission, createApiErrorResponse, createApiSuccessResponse } from '@/lib/auth-api';
+import { parseEntityCursor, streamAgentEntities } from '@/lib/monitoring/entity-feed';
+
+const MAX_FEED_LIMIT = 10000;
 
 /**
  * GET /api/monitoring/agent/entities
  * Return list of entities (branches and ATMs) for monitoring agent to ping
+ *
+ * With ?format=ndjson (or Accept: application/x-ndjson) the entities are
+ * streamed one per line, branches first, followed by an END line. `cursor`
+ * resumes after a given entity and `limit` caps the entities per response.
  */
 export async function GET(request: NextRequest) {
   try {
@@ -19,6 +26,30 @@ export async function GET(request: NextRequest) {
       return createApiErrorResponse('Insufficient permissions. Required: monitoring:read', 403);
     }
 
+    const { searchParams } = new URL(request.url);
+    const wantsNdjson = searchParams.get('format') === 'ndjson' ||
+      (request.headers.get('accept') || '').includes('application/x-ndjson');
+
+    if (wantsNdjson) {
+      const cursor = searchParams.get('cursor');
+      const limitParam = searchParams.get('limit');
+      const limit = limitParam ? parseInt(limitParam, 10) : null;
+
+      if (cursor && !parseEntityCursor(cursor)) {
+        return createApiErrorResponse('Invalid cursor', 400);
+      }
+      if (limit !== null && (isNaN(limit) || limit < 1 || limit > MAX_FEED_LIMIT)) {
+        return createApiErrorResponse(`limit must be between 1 and ${MAX_FEED_LIMIT}`, 400);
+      }
+
+      return new NextResponse(streamAgentEntities(cursor, limit), {
+        headers: {
+          'Content-Type': 'application/x-ndjson; charset=utf-8',
+          'Cache-Control': 'no-store'
+        }
+      });
+    }
+
     // Fetch branches with IP address (monitoring enabled OR has IP)
     const branches = await prisma.branch.findMany({
       where: {
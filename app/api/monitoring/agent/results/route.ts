@@ -1,11 +1,42 @@
 import { NextRequest, NextResponse } from 'next/server';
-import { prisma } from '@/lib/prisma';
+import { randomUUID } from 'crypto';
 import { authenticateApiKey, checkApiPermission, createApiErrorResponse, createApiSuccessResponse } from '@/lib/auth-api';
-import { updateDeviceState } from '@/lib/monitoring/device-state-machine';
-import { createOrUpdateIncident, resolveIncident } from '@/lib/monitoring/incident-correlation';
-import { NetworkStatus } from '@prisma/client';
+import { processAgentBatch } from '@/lib/monitoring/result-ingestion';
+import {
+  claimAgentBatch,
+  completeAgentBatch,
+  failAgentBatch,
+  enqueueAgentBatch,
+  countQueuedAgentBatches,
+  checkBatchSequence,
+  SequenceCheck
+} from '@/lib/monitoring/agent-batches';
+import { kickIngestWorker, MAX_QUEUED_BATCHES } from '@/lib/monitoring/ingest-worker';
+import {
+  HARD_MAX_BATCH_SIZE,
+  acquireIngestSlot,
+  releaseIngestSlot,
+  currentIngestLimits,
+  ingestLimitHeaders
+} from '@/lib/monitoring/ingest-pressure';
 import { z } from 'zod';
 
+// Branch router load the agent polled over SNMP
+const snmpSampleSchema = z.object({
+  sampled_at: z.string(),
+  cpu_percent: z.number().nullable(),
+  max_utilization: z.number().nullable(),
+  interfaces: z.array(z.object({
+    if_index: z.number(),
+    name: z.string().nullable(),
+    speed_mbps: z.number(),
+    in_bps: z.number(),
+    out_bps: z.number(),
+    in_utilization: z.number(),
+    out_utilization: z.number(),
+  })),
+});
+
 const pingResultSchema = z.object({
   entity_type: z.enum(['BRANCH', 'ATM']),
   entity_id: z.string(),
@@ -16,19 +47,55 @@ const pingResultSchema = z.object({
   min_rtt: z.number().nullable().optional(),
   max_rtt: z.number().nullable().optional(),
   avg_rtt: z.number().nullable().optional(),
+  error_message: z.string().nullable().optional(),
+  parent_unreachable: z.boolean().optional(),
+  path: z.record(z.any()).optional(),
+  snmp: snmpSampleSchema.optional(),
+  timestamp: z.string().optional(),
+});
+
+// Correlated vendor/media outage collapsed by the agent into one event
+const groupEventSchema = z.object({
+  group_type: z.enum(['VENDOR', 'MEDIA']),
+  group_key: z.string(),
+  status: z.enum(['OFFLINE', 'RECOVERED']),
+  branch_ids: z.array(z.string()),
+  atm_ids: z.array(z.string()),
+  since: z.string().optional(),
   timestamp: z.string().optional(),
 });
 
 const requestSchema = z.object({
   agent_id: z.string(),
   results: z.array(pingResultSchema),
+  group_events: z.array(groupEventSchema).optional(),
+  batch_id: z.string().max(200).optional(),
+  sequence: z.number().int().nonnegative().optional(),
+  boot_id: z.string().max(64).optional(),
 });
 
 /**
  * POST /api/monitoring/agent/results
  * Receive ping results from remote monitoring agent
+ *
+ * Batches carrying an Idempotency-Key header (or batch_id) are applied at most
+ * once: a repeated batch gets the original response back with duplicate: true
+ *
+ * Every response advertises X-Max-Batch-Size and X-Ingest-Credits; when this
+ * process is saturated the batch is refused with 429 and Retry-After so agents
+ * spool and back off instead of piling on
+ *
+ * With "Prefer: respond-async" the batch is validated, durably queued and
+ * answered with 202 and its batch_id; the ingest worker applies it and the
+ * agent can poll /api/monitoring/agent/results/status for the outcome
+ *
+ * Sequences are checked per agent run (boot_id): a gap or an out-of-order
+ * batch is logged and reported back as sequence_check, but still applied
  */
 export async function POST(request: NextRequest) {
+  let ledgerBatchId: string | null = null;
+  let slotAcquiredAt: number | null = null;
+
   try {
     // Authenticate API key
     const authResult = await authenticateApiKey(request);
@@ -49,173 +116,152 @@ export async function POST(request: NextRequest) {
       return createApiErrorResponse('Invalid request format', 400, parsed.error.errors);
     }
 
-    const { agent_id, results } = parsed.data;
-
-    // Process each ping result
-    const processedResults = [];
-    const errors = [];
-
-    for (const result of results) {
-      try {
-        // Validate entity exists
-        let entity = null;
-        let entityName = 'Unknown';
-
-        if (result.entity_type === 'BRANCH') {
-          entity = await prisma.branch.findUnique({
-            where: { id: result.entity_id },
-            select: { id: true, name: true }
-          });
-          entityName = entity?.name || 'Unknown Branch';
-        } else if (result.entity_type === 'ATM') {
-          entity = await prisma.aTM.findUnique({
-            where: { id: result.entity_id },
-            select: { id: true, name: true, branchId: true }
-          });
-          entityName = entity?.name || 'Unknown ATM';
-        }
-
-        if (!entity) {
-          errors.push({ entity_id: result.entity_id, error: 'Entity not found' });
-          continue;
-        }
-
-        const status = result.status as NetworkStatus;
-
-        // Get previous log
-        const previousLog = await prisma.networkMonitoringLog.findUnique({
-          where: {
-            entityType_entityId: {
-              entityType: result.entity_type,
-              entityId: result.entity_id
-            }
-          }
-        });
-
-        // Calculate uptime/downtime
-        let uptimeSeconds = previousLog?.uptimeSeconds || 0;
-        let downtimeSeconds = previousLog?.downtimeSeconds || 0;
-        const timeSinceLastCheck = previousLog
-          ? Math.floor((Date.now() - previousLog.checkedAt.getTime()) / 1000)
-          : 0;
-
-        if (status === 'ONLINE' || status === 'SLOW') {
-          uptimeSeconds += timeSinceLastCheck;
-        } else {
-          downtimeSeconds += timeSinceLastCheck;
-        }
-
-        // Update or create monitoring log
-        await prisma.networkMonitoringLog.upsert({
-          where: {
-            entityType_entityId: {
-              entityType: result.entity_type,
-              entityId: result.entity_id
-            }
-          },
-          create: {
-            entityType: result.entity_type,
-            entityId: result.entity_id,
-            ipAddress: result.ip_address,
-            status,
-            responseTimeMs: result.response_time_ms || null,
-            packetLoss: result.packet_loss || null,
-            uptimeSeconds,
-            downtimeSeconds,
-            previousStatus: null,
-            statusChangedAt: status !== previousLog?.status ? new Date() : previousLog?.statusChangedAt || null,
-            downSince: status === 'OFFLINE' && previousLog?.status !== 'OFFLINE' ? new Date() : previousLog?.downSince || null
-          },
-          update: {
-            status,
-            responseTimeMs: result.response_time_ms || null,
-            packetLoss: result.packet_loss || null,
-            checkedAt: new Date(),
-            uptimeSeconds,
-            downtimeSeconds,
-            previousStatus: previousLog?.status || null,
-            statusChangedAt: status !== previousLog?.status ? new Date() : previousLog?.statusChangedAt || null,
-            downSince: status === 'OFFLINE' && previousLog?.status !== 'OFFLINE' ? new Date() :
-                      status !== 'OFFLINE' ? null : previousLog?.downSince || null
-          }
-        });
-
-        // Store detailed ping result
-        await prisma.networkPingResult.create({
-          data: {
-            entityType: result.entity_type,
-            entityId: result.entity_id,
-            branchId: result.entity_type === 'BRANCH' ? result.entity_id : (entity as any).branchId,
-            atmId: result.entity_type === 'ATM' ? result.entity_id : null,
-            ipAddress: result.ip_address,
-            status,
-            responseTimeMs: result.response_time_ms || null,
-            packetLoss: result.packet_loss || 0,
-            minRtt: result.min_rtt || null,
-            maxRtt: result.max_rtt || null,
-            avgRtt: result.avg_rtt || null,
-            checkedAt: result.timestamp ? new Date(result.timestamp) : new Date()
-          }
-        });
-
-        // Process state machine (hysteresis)
-        const stateResult = await updateDeviceState(
-          result.entity_type as 'BRANCH' | 'ATM',
-          result.entity_id,
-          status
-        );
-
-        // Handle incident creation/resolution based on state machine
-        if (stateResult.shouldCreateIncident) {
-          const incidentResult = await createOrUpdateIncident({
-            entityType: result.entity_type as 'BRANCH' | 'ATM',
-            entityId: result.entity_id,
-            entityName
-          });
-
-          processedResults.push({
-            entity_id: result.entity_id,
-            status: result.status,
-            state: stateResult.newState,
-            incident: incidentResult.created ? 'created' : (incidentResult.suppressed ? 'suppressed' : 'deduplicated'),
-            incident_id: incidentResult.incidentId
-          });
-        } else if (stateResult.shouldResolveIncident) {
-          await resolveIncident(result.entity_type as 'BRANCH' | 'ATM', result.entity_id);
-
-          processedResults.push({
-            entity_id: result.entity_id,
-            status: result.status,
-            state: stateResult.newState,
-            incident: 'resolved'
-          });
-        } else {
-          processedResults.push({
-            entity_id: result.entity_id,
-            status: result.status,
-            state: stateResult.newState
-          });
-        }
-
-      } catch (err) {
-        console.error(`Error processing result for ${result.entity_id}:`, err);
-        errors.push({
-          entity_id: result.entity_id,
-          error: err instanceof Error ? err.message : 'Processing error'
-        });
+    const { agent_id, results, group_events = [], batch_id, sequence, boot_id } = parsed.data;
+
+    if (results.length > HARD_MAX_BATCH_SIZE) {
+      const response = createApiErrorResponse(
+        `Batch too large: ${results.length} results (max ${HARD_MAX_BATCH_SIZE})`,
+        413
+      );
+      for (const [key, value] of Object.entries(ingestLimitHeaders(currentIngestLimits()))) {
+        response.headers.set(key, value);
+      }
+      return response;
+    }
+
+    // Async mode: queue the batch for the ingest worker instead of applying it inline
+    if ((request.headers.get('prefer') || '').includes('respond-async')) {
+      if (await countQueuedAgentBatches() >= MAX_QUEUED_BATCHES) {
+        const response = createApiErrorResponse('Result queue is full, retry later', 429);
+        response.headers.set('Retry-After', '30');
+        return response;
+      }
+
+      const key = request.headers.get('idempotency-key') || batch_id || randomUUID();
+      const enqueued = await enqueueAgentBatch({
+        agentId: agent_id,
+        idempotencyKey: key,
+        sequence,
+        bootId: boot_id,
+        resultCount: results.length,
+        payload: { agent_id, results, group_events, batch_id: key, sequence, boot_id }
+      });
+
+      if (enqueued.status === 'COMPLETED') {
+        return createApiSuccessResponse({ ...enqueued.response, duplicate: true });
+      }
+      kickIngestWorker();
+      const sequenceCheck = await checkSequence(agent_id, boot_id, sequence, key);
+
+      const statusUrl = `/api/monitoring/agent/results/status?agent_id=${encodeURIComponent(agent_id)}` +
+        `&batch_ids=${encodeURIComponent(key)}`;
+      const response = createApiSuccessResponse({
+        agent_id,
+        batch_id: key,
+        sequence,
+        status: enqueued.status,
+        status_url: statusUrl,
+        sequence_check: sequenceCheck ?? undefined
+      }, 202);
+      response.headers.set('Location', statusUrl);
+      for (const [header, value] of Object.entries(ingestLimitHeaders(currentIngestLimits()))) {
+        response.headers.set(header, value);
+      }
+      return response;
+    }
+
+    const slot = acquireIngestSlot();
+    if (!slot.acquired) {
+      const response = createApiErrorResponse('Result ingestion is saturated, retry later', 429);
+      for (const [key, value] of Object.entries(ingestLimitHeaders(slot.limits))) {
+        response.headers.set(key, value);
       }
+      return response;
     }
+    slotAcquiredAt = Date.now();
+
+    // Skip batches that were already applied (agent retry after a timeout, parallel upload)
+    const idempotencyKey = request.headers.get('idempotency-key') || batch_id;
+    if (idempotencyKey) {
+      const claim = await claimAgentBatch({
+        agentId: agent_id,
+        idempotencyKey,
+        sequence,
+        bootId: boot_id,
+        resultCount: results.length
+      });
 
-    return createApiSuccessResponse({
+      if (claim.status === 'completed') {
+        return createApiSuccessResponse({ ...claim.response, duplicate: true });
+      }
+      if (claim.status === 'in_progress') {
+        const response = createApiErrorResponse('Batch is already being processed', 409);
+        response.headers.set('Retry-After', '5');
+        return response;
+      }
+      ledgerBatchId = claim.batchId;
+    }
+    const sequenceCheck = idempotencyKey
+      ? await checkSequence(agent_id, boot_id, sequence, idempotencyKey)
+      : null;
+
+    // Apply all ping results in bulk; only state changes reach incident correlation.
+    // The ledger row is marked applied in the same transaction as the results
+    const responseData = await processAgentBatch({
       agent_id,
-      processed: processedResults.length,
-      errors: errors.length,
-      results: processedResults,
-      error_details: errors.length > 0 ? errors : undefined
+      results,
+      group_events,
+      batch_id: idempotencyKey || undefined,
+      sequence,
+      boot_id
+    }, ledgerBatchId);
+
+    if (ledgerBatchId) {
+      await completeAgentBatch(ledgerBatchId, JSON.parse(JSON.stringify(responseData)));
+    }
+
+    const limits = currentIngestLimits();
+    const response = createApiSuccessResponse({
+      ...responseData,
+      sequence_check: sequenceCheck ?? undefined,
+      limits
     });
+    for (const [key, value] of Object.entries(ingestLimitHeaders(limits))) {
+      response.headers.set(key, value);
+    }
+    return response;
 
   } catch (error) {
     console.error('Monitoring agent results error:', error);
+    if (ledgerBatchId) {
+      await failAgentBatch(
+        ledgerBatchId,
+        error instanceof Error ? error.message : 'Processing error'
+      ).catch((err) => console.error('Failed to mark agent batch as failed:', err));
+    }
     return createApiErrorResponse('Failed to process monitoring results', 500);
+  } finally {
+    if (slotAcquiredAt !== null) {
+      releaseIngestSlot(Date.now() - slotAcquiredAt);
+    }
+  }
+}
+
+/**
+ * Check the batch against the agent run's sequence and log gaps or reordering
+ */
+async function checkSequence(
+  agentId: string,
+  bootId: string | undefined,
+  sequence: number | undefined,
+  idempotencyKey: string
+): Promise<SequenceCheck | null> {
+  const check = await checkBatchSequence({ agentId, bootId, sequence, idempotencyKey });
+  if (check?.status === 'gap') {
+    console.warn(`Agent ${agentId} batch ${idempotencyKey}: sequence ${sequence} skips ` +
+      `${check.missing} batch(es) after ${check.expected - 1}`);
+  } else if (check?.status === 'out_of_order') {
+    console.warn(`Agent ${agentId} batch ${idempotencyKey}: sequence ${sequence} arrived after ${check.latest}`);
   }
+  return check;
 }
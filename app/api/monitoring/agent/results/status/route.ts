@@ -0,0 +1,69 @@
+import { NextRequest } from 'next/server';
+import { authenticateApiKey, checkApiPermission, createApiErrorResponse, createApiSuccessResponse } from '@/lib/auth-api';
+import { getAgentBatchStatuses } from '@/lib/monitoring/agent-batches';
+
+const MAX_BATCH_IDS = 100;
+
+/**
+ * GET /api/monitoring/agent/results/status?agent_id=...&batch_ids=a,b,c
+ * Outcome of result batches an agent uploaded (queued batches in particular)
+ */
+export async function GET(request: NextRequest) {
+  try {
+    // Authenticate API key
+    const authResult = await authenticateApiKey(request);
+    if (!authResult.authenticated || !authResult.apiKey) {
+      return createApiErrorResponse(authResult.error || 'Unauthorized', 401);
+    }
+
+    // Check permission
+    if (!checkApiPermission(authResult.apiKey, 'monitoring:write')) {
+      return createApiErrorResponse('Insufficient permissions. Required: monitoring:write', 403);
+    }
+
+    const { searchParams } = new URL(request.url);
+    const agentId = searchParams.get('agent_id');
+    const batchIds = (searchParams.get('batch_ids') || '').split(',').map(id => id.trim()).filter(Boolean);
+
+    if (!agentId || batchIds.length === 0) {
+      return createApiErrorResponse('agent_id and batch_ids are required', 400);
+    }
+    if (batchIds.length > MAX_BATCH_IDS) {
+      return createApiErrorResponse(`At most ${MAX_BATCH_IDS} batch_ids per request`, 400);
+    }
+
+    const found = await getAgentBatchStatuses(agentId, batchIds);
+    const byKey = new Map(found.map(batch => [batch.idempotencyKey, batch]));
+
+    return createApiSuccessResponse({
+      agent_id: agentId,
+      batches: batchIds.map(batchId => {
+        const batch = byKey.get(batchId);
+        if (!batch) {
+          return { batch_id: batchId, status: 'UNKNOWN' };
+        }
+        const completed = batch.status === 'COMPLETED' ? (batch.response as Record<string, any> | null) : null;
+        return {
+          batch_id: batchId,
+          sequence: batch.sequence,
+          mode: batch.mode,
+          status: batch.status,
+          result_count: batch.resultCount,
+          attempts: batch.attempts,
+          received_at: batch.receivedAt,
+          completed_at: batch.completedAt,
+          error: batch.error || undefined,
+          // Summary only; the per-row results stay in the ledger
+          processed: completed?.processed,
+          groups_processed: completed?.groups_processed,
+          errors: completed?.errors,
+          error_details: completed?.error_details
+        };
+      })
+    });
+
+  } catch (error) {
+    console.error('Monitoring agent batch status error:', error);
+    return createApiErrorResponse('Failed to fetch batch status', 500);
+  }
+}
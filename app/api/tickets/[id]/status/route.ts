@@ -7,6 +7,7 @@ import { createTicketNotifications, createNotification } from '@/lib/notificatio
 import { authenticateApiKey, checkApiPermission, createApiErrorResponse, createApiSuccessResponse } from '@/lib/auth-api';
 import { sendTicketNotification } from '@/lib/services/email.service';
 import { syncStatusToOmniIfApplicable } from '@/lib/services/omni.service';
+import { enqueueReprobeForTicket } from '@/lib/monitoring/agent-commands';
 
 // Validation schema for status updates
 const statusUpdateSchema = z.object({
@@ -280,6 +281,12 @@ export async function PUT(
       });
     }
 
+    // Ask monitoring agents to re-check entities of linked network incidents (non-blocking)
+    if (['RESOLVED', 'CLOSED'].includes(validatedData.status)) {
+      enqueueReprobeForTicket(id, session.user.id)
+        .catch(err => console.error('Failed to queue monitoring re-probe:', err));
+    }
+
     return NextResponse.json({
       success: true,
       ticket: updatedTicket,
@@ -428,6 +435,12 @@ export async function PATCH(
       });
     }
 
+    // Ask monitoring agents to re-check entities of linked network incidents (non-blocking)
+    if (['RESOLVED', 'CLOSED'].includes(validatedData.status)) {
+      enqueueReprobeForTicket(id)
+        .catch(err => console.error('Failed to queue monitoring re-probe via API:', err));
+    }
+
     return createApiSuccessResponse({
       ticket: updatedTicket,
       previousStatus: existingTicket.status,
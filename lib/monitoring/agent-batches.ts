@@ -0,0 +1,337 @@
+/**
+ * Monitoring Agent Batch Ledger
+ * Records every result batch an agent uploads under its idempotency key so
+ * retried or duplicated uploads are answered from the ledger instead of
+ * inserting ping results and advancing the state machine a second time.
+ * Batches uploaded in async mode are also queued here, with their body, for
+ * the ingest worker.
+ */
+
+import { prisma } from '@/lib/prisma';
+import { Prisma } from '@prisma/client';
+
+// A batch still PROCESSING after this long is assumed abandoned and may be claimed again
+export const BATCH_STALE_SECONDS = 300;
+
+// Ledger entries are kept long enough to cover any agent retry or spool replay
+export const BATCH_RETENTION_DAYS = 7;
+
+// A queued batch failing this many times is marked FAILED for the agent to resend
+export const MAX_QUEUED_ATTEMPTS = 3;
+
+const PRUNE_INTERVAL_MS = 60 * 60 * 1000;
+let lastPrunedAt = 0;
+
+export interface ClaimBatchParams {
+  agentId: string;
+  idempotencyKey: string;
+  sequence?: number | null;
+  bootId?: string | null;
+  resultCount: number;
+}
+
+export type ClaimBatchResult =
+  | { status: 'claimed'; batchId: string }
+  | { status: 'completed'; response: any }
+  | { status: 'in_progress' };
+
+/**
+ * Claim a batch for processing
+ * Returns 'completed' with the stored response if the batch was already
+ * applied, and 'in_progress' while another request is still applying it
+ */
+export async function claimAgentBatch(params: ClaimBatchParams): Promise<ClaimBatchResult> {
+  try {
+    const batch = await prisma.monitoringAgentBatch.create({
+      data: {
+        agentId: params.agentId,
+        idempotencyKey: params.idempotencyKey,
+        sequence: params.sequence ?? null,
+        bootId: params.bootId ?? null,
+        resultCount: params.resultCount,
+        startedAt: new Date()
+      }
+    });
+    return { status: 'claimed', batchId: batch.id };
+  } catch (error: any) {
+    if (error?.code !== 'P2002') {
+      throw error;
+    }
+  }
+
+  const existing = await prisma.monitoringAgentBatch.findUnique({
+    where: {
+      agentId_idempotencyKey: {
+        agentId: params.agentId,
+        idempotencyKey: params.idempotencyKey
+      }
+    }
+  });
+
+  if (!existing) {
+    return { status: 'in_progress' };
+  }
+  if (existing.status === 'COMPLETED') {
+    return { status: 'completed', response: existing.response };
+  }
+
+  // Queued batches are left to the ingest worker
+  const staleBefore = new Date(Date.now() - BATCH_STALE_SECONDS * 1000);
+  if (existing.status === 'QUEUED' ||
+      (existing.status === 'PROCESSING' && (existing.startedAt ?? existing.receivedAt) > staleBefore)) {
+    return { status: 'in_progress' };
+  }
+
+  // Failed or abandoned: take it over with a conditional update so only one retry wins
+  const { count } = await prisma.monitoringAgentBatch.updateMany({
+    where: { id: existing.id, status: existing.status, startedAt: existing.startedAt },
+    data: { status: 'PROCESSING', mode: 'SYNC', startedAt: new Date(), error: null, attempts: { increment: 1 } }
+  });
+
+  return count === 1 ? { status: 'claimed', batchId: existing.id } : { status: 'in_progress' };
+}
+
+/**
+ * Mark a batch as applied from inside the transaction that wrote its results
+ * The full response is stored by completeAgentBatch afterwards; if the process
+ * dies in between, a retry is answered with this provisional one instead of
+ * the batch being applied again once it goes stale
+ */
+export async function markAgentBatchApplied(tx: Prisma.TransactionClient, batchId: string) {
+  await tx.monitoringAgentBatch.update({
+    where: { id: batchId },
+    data: { status: 'COMPLETED', response: { applied: true }, payload: Prisma.DbNull, completedAt: new Date() }
+  });
+}
+
+/**
+ * Mark a batch as applied and store the response replayed to duplicates
+ */
+export async function completeAgentBatch(batchId: string, response: Record<string, any>) {
+  await prisma.monitoringAgentBatch.update({
+    where: { id: batchId },
+    data: { status: 'COMPLETED', response, payload: Prisma.DbNull, completedAt: new Date() }
+  });
+  await pruneAgentBatches();
+}
+
+/**
+ * Mark a batch as failed so the agent's retry is allowed to apply it
+ * A batch whose results were already committed stays COMPLETED
+ */
+export async function failAgentBatch(batchId: string, error: string) {
+  await prisma.monitoringAgentBatch.updateMany({
+    where: { id: batchId, status: { not: 'COMPLETED' } },
+    data: { status: 'FAILED', error, completedAt: new Date() }
+  });
+}
+
+export type SequenceCheck =
+  | { status: 'first' | 'in_order' }
+  | { status: 'gap'; expected: number; missing: number }
+  | { status: 'out_of_order'; latest: number };
+
+/**
+ * Compare a batch's sequence with the highest one seen from the same agent run
+ * Sequences restart with every agent run, so they are only compared within
+ * one boot id; batches without both are not checked
+ */
+export async function checkBatchSequence(params: {
+  agentId: string;
+  bootId?: string | null;
+  sequence?: number | null;
+  idempotencyKey: string;
+}): Promise<SequenceCheck | null> {
+  if (!params.bootId || params.sequence == null) {
+    return null;
+  }
+
+  const previous = await prisma.monitoringAgentBatch.findFirst({
+    where: {
+      agentId: params.agentId,
+      bootId: params.bootId,
+      sequence: { not: null },
+      idempotencyKey: { not: params.idempotencyKey }
+    },
+    orderBy: { sequence: 'desc' },
+    select: { sequence: true }
+  });
+
+  if (!previous || previous.sequence === null) {
+    return { status: 'first' };
+  }
+  if (params.sequence <= previous.sequence) {
+    return { status: 'out_of_order', latest: previous.sequence };
+  }
+  if (params.sequence > previous.sequence + 1) {
+    return { status: 'gap', expected: previous.sequence + 1, missing: params.sequence - previous.sequence - 1 };
+  }
+  return { status: 'in_order' };
+}
+
+export interface EnqueueBatchParams extends ClaimBatchParams {
+  payload: Record<string, any>;
+}
+
+export type EnqueueBatchResult =
+  | { status: 'QUEUED' | 'PROCESSING' }
+  | { status: 'COMPLETED'; response: any };
+
+/**
+ * Durably queue a batch for the ingest worker
+ * A batch that is already queued, being applied or applied is not queued
+ * again; a failed one is queued again with the new body
+ */
+export async function enqueueAgentBatch(params: EnqueueBatchParams): Promise<EnqueueBatchResult> {
+  try {
+    await prisma.monitoringAgentBatch.create({
+      data: {
+        agentId: params.agentId,
+        idempotencyKey: params.idempotencyKey,
+        sequence: params.sequence ?? null,
+        bootId: params.bootId ?? null,
+        resultCount: params.resultCount,
+        mode: 'ASYNC',
+        status: 'QUEUED',
+        payload: params.payload
+      }
+    });
+    return { status: 'QUEUED' };
+  } catch (error: any) {
+    if (error?.code !== 'P2002') {
+      throw error;
+    }
+  }
+
+  const existing = await prisma.monitoringAgentBatch.findUnique({
+    where: {
+      agentId_idempotencyKey: {
+        agentId: params.agentId,
+        idempotencyKey: params.idempotencyKey
+      }
+    }
+  });
+
+  if (!existing || existing.status === 'QUEUED' || existing.status === 'PROCESSING') {
+    return { status: existing?.status === 'PROCESSING' ? 'PROCESSING' : 'QUEUED' };
+  }
+  if (existing.status === 'COMPLETED') {
+    return { status: 'COMPLETED', response: existing.response };
+  }
+
+  await prisma.monitoringAgentBatch.updateMany({
+    where: { id: existing.id, status: 'FAILED' },
+    data: {
+      mode: 'ASYNC',
+      status: 'QUEUED',
+      payload: params.payload,
+      error: null,
+      attempts: 0,
+      receivedAt: new Date(),
+      startedAt: null,
+      completedAt: null
+    }
+  });
+  return { status: 'QUEUED' };
+}
+
+/**
+ * Number of batches waiting for the ingest worker
+ */
+export async function countQueuedAgentBatches(): Promise<number> {
+  return prisma.monitoringAgentBatch.count({ where: { status: 'QUEUED', mode: 'ASYNC' } });
+}
+
+/**
+ * Claim queued batches for the ingest worker, oldest first
+ * At most one batch per agent is applied at a time so an agent's batches are
+ * applied in the order they arrived; abandoned batches are picked up again
+ */
+export async function claimQueuedAgentBatches(limit: number) {
+  const staleBefore = new Date(Date.now() - BATCH_STALE_SECONDS * 1000);
+
+  const busy = await prisma.monitoringAgentBatch.findMany({
+    where: { status: 'PROCESSING', startedAt: { gt: staleBefore } },
+    select: { agentId: true },
+    distinct: ['agentId']
+  });
+  const busyAgents = new Set(busy.map(b => b.agentId));
+
+  const candidates = await prisma.monitoringAgentBatch.findMany({
+    where: {
+      mode: 'ASYNC',
+      OR: [
+        { status: 'QUEUED' },
+        { status: 'PROCESSING', startedAt: { lte: staleBefore } }
+      ]
+    },
+    orderBy: { receivedAt: 'asc' },
+    take: limit * 20
+  });
+
+  const claimed = [];
+  for (const batch of candidates) {
+    if (claimed.length >= limit) break;
+    if (busyAgents.has(batch.agentId)) continue;
+    busyAgents.add(batch.agentId);
+
+    const { count } = await prisma.monitoringAgentBatch.updateMany({
+      where: { id: batch.id, status: batch.status, startedAt: batch.startedAt },
+      data: { status: 'PROCESSING', startedAt: new Date(), attempts: { increment: 1 } }
+    });
+    if (count === 1) {
+      claimed.push({ ...batch, attempts: batch.attempts + 1 });
+    }
+  }
+
+  return claimed;
+}
+
+/**
+ * Put a queued batch back after a failed attempt, or mark it FAILED for good
+ */
+export async function retryQueuedAgentBatch(batchId: string, attempts: number, error: string) {
+  await prisma.monitoringAgentBatch.updateMany({
+    where: { id: batchId, status: { not: 'COMPLETED' } },
+    data: attempts >= MAX_QUEUED_ATTEMPTS
+      ? { status: 'FAILED', error, completedAt: new Date() }
+      : { status: 'QUEUED', error, startedAt: null }
+  });
+}
+
+/**
+ * Status of an agent's batches by idempotency key, for agent polling
+ */
+export async function getAgentBatchStatuses(agentId: string, idempotencyKeys: string[]) {
+  return prisma.monitoringAgentBatch.findMany({
+    where: { agentId, idempotencyKey: { in: idempotencyKeys } },
+    select: {
+      idempotencyKey: true,
+      sequence: true,
+      bootId: true,
+      mode: true,
+      status: true,
+      resultCount: true,
+      response: true,
+      error: true,
+      attempts: true,
+      receivedAt: true,
+      completedAt: true
+    }
+  });
+}
+
+/**
+ * Drop ledger entries past the retention window (at most once an hour per process)
+ */
+export async function pruneAgentBatches(force: boolean = false): Promise<number> {
+  if (!force && Date.now() - lastPrunedAt < PRUNE_INTERVAL_MS) {
+    return 0;
+  }
+  lastPrunedAt = Date.now();
+
+  const { count } = await prisma.monitoringAgentBatch.deleteMany({
+    where: { receivedAt: { lt: new Date(Date.now() - BATCH_RETENTION_DAYS * 24 * 60 * 60 * 1000) } }
+  });
+  return count;
+}
@@ -0,0 +1,142 @@
+/**
+ * Monitoring Agent Command Queue
+ * Lets the helpdesk push re-probe, refresh and pause commands to remote agents
+ * which pick them up over a long-poll channel
+ */
+
+import { prisma } from '@/lib/prisma';
+
+export const AGENT_COMMAND_TYPES = ['REPROBE', 'REFRESH_ENTITIES', 'PAUSE_ENTITY'] as const;
+export type AgentCommandType = typeof AGENT_COMMAND_TYPES[number];
+
+// Delivered commands not acknowledged within this window are handed out again.
+// Well above an agent's worst case for a re-probe: the probe, a confirmed
+// upload (up to 120s by default, plus retries) and a 30s acknowledgement.
+export const REDELIVERY_TIMEOUT_SECONDS = 600;
+
+export interface EnqueueCommandParams {
+  type: AgentCommandType;
+  agentId?: string | null;
+  entityType?: 'BRANCH' | 'ATM';
+  entityId?: string;
+  payload?: Record<string, any>;
+  createdById?: string;
+}
+
+export interface AgentCommandAck {
+  id: string;
+  status: 'COMPLETED' | 'FAILED';
+  result?: Record<string, any>;
+}
+
+/**
+ * Queue a command for a monitoring agent
+ */
+export async function enqueueAgentCommand(params: EnqueueCommandParams) {
+  return prisma.monitoringAgentCommand.create({
+    data: {
+      type: params.type,
+      agentId: params.agentId || null,
+      entityType: params.entityType || null,
+      entityId: params.entityId || null,
+      payload: params.payload || undefined,
+      createdById: params.createdById || null
+    }
+  });
+}
+
+/**
+ * Claim pending commands for an agent (including untargeted ones)
+ * Each command is claimed by a conditional update so concurrent polls never
+ * hand the same command to two agents
+ */
+export async function claimAgentCommands(agentId: string, limit: number = 50) {
+  const redeliverBefore = new Date(Date.now() - REDELIVERY_TIMEOUT_SECONDS * 1000);
+
+  const candidates = await prisma.monitoringAgentCommand.findMany({
+    where: {
+      OR: [{ agentId }, { agentId: null }],
+      AND: [
+        {
+          OR: [
+            { status: 'PENDING' },
+            { status: 'DELIVERED', deliveredAt: { lt: redeliverBefore } }
+          ]
+        }
+      ]
+    },
+    orderBy: { createdAt: 'asc' },
+    take: limit
+  });
+
+  const claimed = [];
+  for (const command of candidates) {
+    const { count } = await prisma.monitoringAgentCommand.updateMany({
+      where: { id: command.id, status: command.status, deliveredAt: command.deliveredAt },
+      data: { status: 'DELIVERED', deliveredAt: new Date(), agentId }
+    });
+    if (count === 1) {
+      claimed.push(command);
+    }
+  }
+
+  return claimed;
+}
+
+/**
+ * Record the outcome of commands reported back by an agent
+ */
+export async function acknowledgeAgentCommands(agentId: string, acks: AgentCommandAck[]): Promise<number> {
+  let acknowledged = 0;
+
+  for (const ack of acks) {
+    const { count } = await prisma.monitoringAgentCommand.updateMany({
+      where: { id: ack.id, agentId, status: 'DELIVERED' },
+      data: {
+        status: ack.status,
+        result: ack.result || undefined,
+        completedAt: new Date()
+      }
+    });
+    acknowledged += count;
+  }
+
+  return acknowledged;
+}
+
+/**
+ * Ask agents to re-probe the entities of network incidents linked to a ticket
+ * Used when a technician resolves or closes a monitoring ticket so the
+ * entity status is refreshed right away instead of on the next cycle
+ */
+export async function enqueueReprobeForTicket(ticketId: string, createdById?: string): Promise<number> {
+  const incidents = await prisma.networkIncident.findMany({
+    where: { ticketId },
+    select: { branchId: true, atmId: true }
+  });
+
+  let queued = 0;
+  for (const incident of incidents) {
+    const entityType = incident.atmId ? 'ATM' : 'BRANCH';
+    const entityId = incident.atmId || incident.branchId;
+    if (!entityId) continue;
+
+    // Only the agent monitoring the entity can re-probe it; others would fail it as unknown
+    const log = await prisma.networkMonitoringLog.findUnique({
+      where: { entityType_entityId: { entityType, entityId } },
+      select: { agentId: true }
+    });
+
+    await enqueueAgentCommand({
+      type: 'REPROBE',
+      agentId: log?.agentId,
+      entityType,
+      entityId,
+      payload: { reason: 'ticket_status_changed', ticketId },
+      createdById
+    });
+    queued++;
+  }
+
+  return queued;
+}
@@ -0,0 +1,201 @@
+/**
+ * Monitoring Agent Entity Feed
+ * Pages through monitored branches and ATMs with keyset pagination so the
+ * entity list can be streamed to agents as NDJSON without building it in
+ * memory. Branches come first so agents know every parent before its ATMs.
+ *
+ * Cursors are "<TYPE>:<id>" of the last entity delivered; resuming from a
+ * cursor continues right after that entity.
+ */
+
+import { prisma } from '@/lib/prisma';
+
+// Rows fetched from the database per query
+export const ENTITY_FEED_PAGE_SIZE = 500;
+
+export interface AgentEntity {
+  type: 'BRANCH' | 'ATM';
+  id: string;
+  code: string;
+  name: string;
+  ip_address: string;
+  backup_ip_address?: string | null;
+  network_media: string | null;
+  network_vendor: string | null;
+  branch_id?: string;
+  branch_code?: string;
+  branch_name?: string;
+}
+
+export function entityCursor(entity: Pick<AgentEntity, 'type' | 'id'>): string {
+  return `${entity.type}:${entity.id}`;
+}
+
+/**
+ * Parse a cursor, returning null for malformed values
+ */
+export function parseEntityCursor(cursor: string | null): { type: 'BRANCH' | 'ATM'; id: string } | null {
+  if (!cursor) return null;
+  const separator = cursor.indexOf(':');
+  const type = cursor.slice(0, separator);
+  const id = cursor.slice(separator + 1);
+  if (separator < 0 || !id || (type !== 'BRANCH' && type !== 'ATM')) return null;
+  return { type, id };
+}
+
+/**
+ * Yield pages of entities starting after the cursor
+ */
+export async function* iterateAgentEntities(
+  after: { type: 'BRANCH' | 'ATM'; id: string } | null = null,
+  pageSize: number = ENTITY_FEED_PAGE_SIZE
+): AsyncGenerator<AgentEntity[]> {
+  if (!after || after.type === 'BRANCH') {
+    let afterId = after?.id;
+    while (true) {
+      const branches = await prisma.branch.findMany({
+        where: {
+          isActive: true,
+          ipAddress: { not: null },
+          ...(afterId ? { id: { gt: afterId } } : {})
+        },
+        select: {
+          id: true,
+          code: true,
+          name: true,
+          ipAddress: true,
+          backupIpAddress: true,
+          networkMedia: true,
+          networkVendor: true
+        },
+        orderBy: { id: 'asc' },
+        take: pageSize
+      });
+      if (branches.length === 0) break;
+
+      yield branches.map(b => ({
+        type: 'BRANCH' as const,
+        id: b.id,
+        code: b.code,
+        name: b.name,
+        ip_address: b.ipAddress!,
+        backup_ip_address: b.backupIpAddress,
+        network_media: b.networkMedia,
+        network_vendor: b.networkVendor
+      }));
+
+      if (branches.length < pageSize) break;
+      afterId = branches[branches.length - 1].id;
+    }
+  }
+
+  let afterId = after?.type === 'ATM' ? after.id : undefined;
+  while (true) {
+    const atms = await prisma.aTM.findMany({
+      where: {
+        isActive: true,
+        ipAddress: { not: null },
+        ...(afterId ? { id: { gt: afterId } } : {})
+      },
+      select: {
+        id: true,
+        code: true,
+        name: true,
+        ipAddress: true,
+        networkMedia: true,
+        networkVendor: true,
+        branchId: true,
+        branch: {
+          select: {
+            code: true,
+            name: true
+          }
+        }
+      },
+      orderBy: { id: 'asc' },
+      take: pageSize
+    });
+    if (atms.length === 0) break;
+
+    yield atms.map(a => ({
+      type: 'ATM' as const,
+      id: a.id,
+      code: a.code,
+      name: a.name,
+      ip_address: a.ipAddress!,
+      network_media: a.networkMedia,
+      network_vendor: a.networkVendor,
+      branch_id: a.branchId,
+      branch_code: a.branch?.code,
+      branch_name: a.branch?.name
+    }));
+
+    if (atms.length < pageSize) break;
+    afterId = atms[atms.length - 1].id;
+  }
+}
+
+/**
+ * NDJSON stream of entities: one entity per line, then a final
+ * {"type":"END",...} line with counts and, when `limit` cut the feed short,
+ * the cursor to continue from. A missing END line means the feed broke off.
+ */
+export function streamAgentEntities(cursor: string | null, limit: number | null): ReadableStream<Uint8Array> {
+  const encoder = new TextEncoder();
+  const after = parseEntityCursor(cursor);
+  const pages = iterateAgentEntities(after);
+  let branchesCount = 0;
+  let atmsCount = 0;
+  let lastCursor: string | null = cursor;
+  let finished = false;
+
+  const endLine = (nextCursor: string | null) => encoder.encode(JSON.stringify({
+    type: 'END',
+    total: branchesCount + atmsCount,
+    branches_count: branchesCount,
+    atms_count: atmsCount,
+    next_cursor: nextCursor,
+    generated_at: new Date().toISOString()
+  }) + '\n');
+
+  return new ReadableStream<Uint8Array>({
+    async pull(controller) {
+      if (finished) return;
+      try {
+        const { value: page, done } = await pages.next();
+        if (done) {
+          finished = true;
+          controller.enqueue(endLine(null));
+          controller.close();
+          return;
+        }
+
+        const remaining = limit !== null ? limit - branchesCount - atmsCount : page.length;
+        const entities = page.slice(0, remaining);
+        for (const entity of entities) {
+          if (entity.type === 'BRANCH') branchesCount++;
+          else atmsCount++;
+        }
+        if (entities.length > 0) {
+          lastCursor = entityCursor(entities[entities.length - 1]);
+          controller.enqueue(encoder.encode(entities.map(e => JSON.stringify(e)).join('\n') + '\n'));
+        }
+
+        if (limit !== null && branchesCount + atmsCount >= limit) {
+          finished = true;
+          controller.enqueue(endLine(lastCursor));
+          controller.close();
+          await pages.return(undefined);
+        }
+      } catch (error) {
+        console.error('Monitoring agent entity stream error:', error);
+        finished = true;
+        controller.error(error);
+      }
+    },
+    async cancel() {
+      finished = true;
+      await pages.return(undefined);
+    }
+  });
+}
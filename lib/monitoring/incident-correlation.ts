@@ -323,3 +323,136 @@ async function recheckChildATMs(branchId: string): Promise<void> {
     console.log(`🚨 Created individual incident for ATM ${atm.name} after branch recovery`);
   }
 }
+
+export interface GroupIncidentParams {
+  groupType: 'VENDOR' | 'MEDIA';
+  groupKey: string;
+  branchIds: string[];
+  atmIds: string[];
+}
+
+/**
+ * Find the open incident tracking a vendor/media outage group
+ */
+async function findOpenGroupIncident(groupType: string, groupKey: string) {
+  return prisma.networkIncident.findFirst({
+    where: {
+      status: { in: ['OPEN', 'IN_PROGRESS'] },
+      AND: [
+        { metrics: { path: ['groupType'], equals: groupType } },
+        { metrics: { path: ['groupKey'], equals: groupKey } }
+      ]
+    },
+    select: { id: true, metrics: true }
+  });
+}
+
+/**
+ * Create or update a single incident for a correlated vendor/media outage
+ * reported by an agent as one group event instead of per-entity failures
+ */
+export async function createOrUpdateGroupIncident(params: GroupIncidentParams): Promise<{
+  created: boolean;
+  incidentId: string;
+}> {
+  const { groupType, groupKey, branchIds, atmIds } = params;
+  const memberCount = branchIds.length + atmIds.length;
+
+  const existing = await findOpenGroupIncident(groupType, groupKey);
+  if (existing) {
+    const metrics = (existing.metrics as any) || {};
+    const affectedBranchIds = Array.from(new Set([...(metrics.branchIds || []), ...branchIds]));
+    const affectedAtmIds = Array.from(new Set([...(metrics.atmIds || []), ...atmIds]));
+
+    await prisma.networkIncident.update({
+      where: { id: existing.id },
+      data: {
+        occurrenceCount: { increment: 1 },
+        lastOccurrence: new Date(),
+        metrics: {
+          ...metrics,
+          branchIds: affectedBranchIds,
+          atmIds: affectedAtmIds,
+          affectedChildrenCount: affectedBranchIds.length + affectedAtmIds.length
+        }
+      }
+    });
+
+    return { created: false, incidentId: existing.id };
+  }
+
+  const incident = await prisma.networkIncident.create({
+    data: {
+      type: 'COMMUNICATION_OFFLINE',
+      severity: 'CRITICAL',
+      description: `Network outage on ${groupType.toLowerCase()} ${groupKey} affecting ${memberCount} entities`,
+      status: 'OPEN',
+      detectedAt: new Date(),
+      occurrenceCount: 1,
+      lastOccurrence: new Date(),
+      metrics: {
+        groupType,
+        groupKey,
+        branchIds,
+        atmIds,
+        affectedChildrenCount: memberCount
+      }
+    }
+  });
+
+  return { created: true, incidentId: incident.id };
+}
+
+/**
+ * Resolve the incident of a vendor/media outage group once it recovers
+ */
+export async function resolveGroupIncident(groupType: string, groupKey: string): Promise<string | null> {
+  const incident = await findOpenGroupIncident(groupType, groupKey);
+  if (!incident) return null;
+
+  await prisma.networkIncident.update({
+    where: { id: incident.id },
+    data: {
+      status: 'RESOLVED',
+      resolvedAt: new Date()
+    }
+  });
+
+  return incident.id;
+}
+
+/**
+ * Attach an agent's path diagnostics (traceroute-style hop list) to the
+ * entity's open incident so the NOC sees the last responding hop
+ */
+export async function attachPathDiagnostics(
+  entityType: 'BRANCH' | 'ATM',
+  entityId: string,
+  path: Record<string, any>
+): Promise<string | null> {
+  const incident = await prisma.networkIncident.findFirst({
+    where: {
+      branchId: entityType === 'BRANCH' ? entityId : undefined,
+      atmId: entityType === 'ATM' ? entityId : undefined,
+      status: { in: ['OPEN', 'IN_PROGRESS'] }
+    },
+    orderBy: { createdAt: 'desc' },
+    select: { id: true, metrics: true }
+  });
+
+  if (!incident) return null;
+
+  const metrics = (incident.metrics as any) || {};
+  await prisma.networkIncident.update({
+    where: { id: incident.id },
+    data: {
+      metrics: {
+        ...metrics,
+        pathDiagnostics: path,
+        lastRespondingHop: path.last_responding_hop?.ip_address || null
+      }
+    }
+  });
+
+  return incident.id;
+}
@@ -0,0 +1,83 @@
+/**
+ * Monitoring Ingest Backpressure
+ * Tracks result batches being applied by this process (inline uploads and
+ * the queued ingest worker) and turns that into limits advertised to agents:
+ * the largest batch to send, how many more batches may be in flight (credits)
+ * and, when saturated, how long to wait
+ */
+
+// Batches applied concurrently by one server process before agents are told to back off
+export const MAX_INFLIGHT_BATCHES = 8;
+
+// Largest batch accepted at all; anything bigger is rejected with 413
+export const HARD_MAX_BATCH_SIZE = 2000;
+
+// Batch size advertised while ingestion is healthy
+export const DEFAULT_MAX_BATCH_SIZE = 500;
+
+// Advertised batch size shrinks when a batch takes longer than this to apply
+export const TARGET_LATENCY_MS = 2000;
+
+const MIN_ADVERTISED_BATCH_SIZE = 50;
+const LATENCY_ALPHA = 0.2;
+
+let inflight = 0;
+let latencyMs = 0;
+
+export interface IngestLimits {
+  max_batch_size: number;
+  credits: number;
+  latency_ms: number;
+  retry_after_seconds?: number;
+}
+
+/**
+ * Current limits, scaling the advertised batch size down as latency climbs
+ */
+export function currentIngestLimits(): IngestLimits {
+  const scale = latencyMs > TARGET_LATENCY_MS ? TARGET_LATENCY_MS / latencyMs : 1;
+  return {
+    max_batch_size: Math.max(MIN_ADVERTISED_BATCH_SIZE, Math.floor(DEFAULT_MAX_BATCH_SIZE * scale)),
+    credits: Math.max(0, MAX_INFLIGHT_BATCHES - inflight),
+    latency_ms: Math.round(latencyMs)
+  };
+}
+
+/**
+ * Reserve a slot for a batch, or return the limits with a Retry-After when saturated
+ */
+export function acquireIngestSlot(): { acquired: true } | { acquired: false; limits: IngestLimits } {
+  if (inflight >= MAX_INFLIGHT_BATCHES) {
+    // Expect a slot to free up within about one batch latency
+    const retryAfter = Math.min(60, Math.max(1, Math.ceil((latencyMs || TARGET_LATENCY_MS) / 1000)));
+    return { acquired: false, limits: { ...currentIngestLimits(), retry_after_seconds: retryAfter } };
+  }
+  inflight++;
+  return { acquired: true };
+}
+
+/**
+ * Release a slot and fold the batch's processing time into the latency average
+ * (a slot released unused passes no time)
+ */
+export function releaseIngestSlot(elapsedMs?: number) {
+  inflight = Math.max(0, inflight - 1);
+  if (elapsedMs !== undefined) {
+    latencyMs = latencyMs === 0 ? elapsedMs : LATENCY_ALPHA * elapsedMs + (1 - LATENCY_ALPHA) * latencyMs;
+  }
+}
+
+/**
+ * Response headers carrying the limits
+ */
+export function ingestLimitHeaders(limits: IngestLimits): Record<string, string> {
+  const headers: Record<string, string> = {
+    'X-Max-Batch-Size': String(limits.max_batch_size),
+    'X-Ingest-Credits': String(limits.credits),
+    'X-Ingest-Latency-Ms': String(limits.latency_ms)
+  };
+  if (limits.retry_after_seconds !== undefined) {
+    headers['Retry-After'] = String(limits.retry_after_seconds);
+  }
+  return headers;
+}
@@ -0,0 +1,100 @@
+/**
+ * Monitoring Ingest Worker
+ * Applies result batches queued by agents in async mode. Runs in the server
+ * process with a fixed concurrency; the results route kicks it after each
+ * enqueue and a periodic sweep picks up anything queued before a restart or
+ * left behind by a crashed attempt.
+ */
+
+import {
+  claimQueuedAgentBatches,
+  completeAgentBatch,
+  retryQueuedAgentBatch
+} from './agent-batches';
+import { acquireIngestSlot, releaseIngestSlot } from './ingest-pressure';
+import { processAgentBatch, AgentBatchPayload } from './result-ingestion';
+
+// Batches applied at the same time by the worker
+export const INGEST_WORKER_CONCURRENCY = 2;
+
+// Beyond this many queued batches new async uploads are refused with 429
+export const MAX_QUEUED_BATCHES = 500;
+
+const SWEEP_INTERVAL_MS = 10000;
+
+// Kept on globalThis so dev reloads and duplicate module instances share one
+// sweep timer and one drain loop instead of each starting their own
+const globalForIngestWorker = globalThis as unknown as {
+  ingestWorkerSweep: ReturnType<typeof setInterval> | undefined;
+  ingestWorkerDraining: boolean | undefined;
+};
+
+async function runQueuedBatch(batch: Awaited<ReturnType<typeof claimQueuedAgentBatches>>[number]) {
+  const startedAt = Date.now();
+  try {
+    const response = await processAgentBatch(batch.payload as unknown as AgentBatchPayload, batch.id);
+    await completeAgentBatch(batch.id, JSON.parse(JSON.stringify(response)));
+  } catch (error) {
+    console.error(`Ingest worker failed batch ${batch.idempotencyKey} from ${batch.agentId}:`, error);
+    await retryQueuedAgentBatch(
+      batch.id,
+      batch.attempts,
+      error instanceof Error ? error.message : 'Processing error'
+    ).catch((err) => console.error('Failed to requeue agent batch:', err));
+  } finally {
+    releaseIngestSlot(Date.now() - startedAt);
+  }
+}
+
+async function drain() {
+  while (true) {
+    // Share the process-wide ingest slots with inline uploads so both together stay bounded
+    let slots = 0;
+    while (slots < INGEST_WORKER_CONCURRENCY && acquireIngestSlot().acquired) {
+      slots++;
+    }
+    if (slots === 0) {
+      return;
+    }
+
+    const batches = await claimQueuedAgentBatches(slots).catch((error) => {
+      console.error('Ingest worker failed to claim batches:', error);
+      return [];
+    });
+    for (let unused = slots - batches.length; unused > 0; unused--) {
+      releaseIngestSlot();
+    }
+    if (batches.length === 0) {
+      return;
+    }
+
+    await Promise.all(batches.map(runQueuedBatch));
+  }
+}
+
+/**
+ * Start draining the queue unless the worker is already running
+ */
+export function kickIngestWorker() {
+  if (globalForIngestWorker.ingestWorkerDraining) {
+    return;
+  }
+  globalForIngestWorker.ingestWorkerDraining = true;
+  drain()
+    .catch((error) => console.error('Ingest worker error:', error))
+    .finally(() => {
+      globalForIngestWorker.ingestWorkerDraining = false;
+    });
+}
+
+/**
+ * Start the periodic sweep once per process
+ */
+export function startIngestSweep() {
+  if (globalForIngestWorker.ingestWorkerSweep) {
+    return;
+  }
+  globalForIngestWorker.ingestWorkerSweep = setInterval(kickIngestWorker, SWEEP_INTERVAL_MS);
+}
+
+startIngestSweep();
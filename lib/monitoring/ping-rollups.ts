@@ -0,0 +1,193 @@
+/**
+ * Network Ping Rollups
+ * Raw ping results are kept for a short window and compacted into 5-minute
+ * and hourly buckets by scripts/rollup-network-pings.py. History and uptime
+ * queries read the rollups and fill the stretch not compacted yet from the
+ * raw results, aggregated the same way.
+ */
+
+import { prisma } from '@/lib/prisma';
+import { Prisma } from '@prisma/client';
+
+export type RollupResolution = 5 | 60;
+
+// Retention defaults, mirrored by scripts/rollup-network-pings.py
+export const RAW_RETENTION_DAYS = 7;
+export const FIVE_MINUTE_RETENTION_DAYS = 90;
+export const HOURLY_RETENTION_DAYS = 730;
+
+export interface PingBucket {
+  bucketStart: Date;
+  sampleCount: number;
+  onlineCount: number;
+  slowCount: number;
+  offlineCount: number;
+  timeoutCount: number;
+  errorCount: number;
+  rttCount: number;
+  minRtt: number | null;
+  avgRtt: number | null;
+  maxRtt: number | null;
+  p95Rtt: number | null;
+  avgPacketLoss: number | null;
+}
+
+export interface PingSummary {
+  samples: number;
+  online: number;
+  slow: number;
+  offline: number;
+  timeout: number;
+  error: number;
+  minRtt: number | null;
+  avgRtt: number | null;
+  maxRtt: number | null;
+  avgPacketLoss: number | null;
+}
+
+/**
+ * Resolution to read for a lookback window: 5-minute buckets for the last
+ * day, hourly beyond that
+ */
+export function resolutionFor(hours: number): RollupResolution {
+  return hours > 24 ? 60 : 5;
+}
+
+function floorToBucket(date: Date, bucketMinutes: RollupResolution): Date {
+  const size = bucketMinutes * 60 * 1000;
+  return new Date(Math.floor(date.getTime() / size) * size);
+}
+
+function sqlTimestamp(date: Date): Prisma.Sql {
+  return Prisma.sql`(to_timestamp(${date.getTime()}::double precision / 1000) AT TIME ZONE 'UTC')`;
+}
+
+/**
+ * Aggregate raw results from `from` onwards into buckets, matching the rollup columns
+ */
+async function rawBuckets(
+  entityType: string,
+  entityId: string,
+  from: Date,
+  bucketMinutes: RollupResolution
+): Promise<PingBucket[]> {
+  const minutes = Prisma.raw(String(bucketMinutes));
+  return prisma.$queryRaw<PingBucket[]>`
+    SELECT
+      date_trunc('hour', "checkedAt")
+        + (floor(extract(minute FROM "checkedAt") / ${minutes}) * ${minutes})::integer * interval '1 minute' AS "bucketStart",
+      count(*)::integer AS "sampleCount",
+      (count(*) FILTER (WHERE "status" = 'ONLINE'))::integer AS "onlineCount",
+      (count(*) FILTER (WHERE "status" = 'SLOW'))::integer AS "slowCount",
+      (count(*) FILTER (WHERE "status" = 'OFFLINE'))::integer AS "offlineCount",
+      (count(*) FILTER (WHERE "status" = 'TIMEOUT'))::integer AS "timeoutCount",
+      (count(*) FILTER (WHERE "status" = 'ERROR'))::integer AS "errorCount",
+      (count(*) FILTER (WHERE "responseTimeMs" > 0))::integer AS "rttCount",
+      (min(COALESCE("minRtt", "responseTimeMs")) FILTER (WHERE "responseTimeMs" > 0))::double precision AS "minRtt",
+      (avg("responseTimeMs") FILTER (WHERE "responseTimeMs" > 0))::double precision AS "avgRtt",
+      (max(COALESCE("maxRtt", "responseTimeMs")) FILTER (WHERE "responseTimeMs" > 0))::double precision AS "maxRtt",
+      (percentile_cont(0.95) WITHIN GROUP (ORDER BY "responseTimeMs") FILTER (WHERE "responseTimeMs" > 0))::double precision AS "p95Rtt",
+      avg("packetLoss")::double precision AS "avgPacketLoss"
+    FROM network_ping_results
+    WHERE "entityType" = ${entityType}
+      AND "entityId" = ${entityId}
+      AND "checkedAt" >= ${sqlTimestamp(from)}
+    GROUP BY 1
+    ORDER BY 1
+  `;
+}
+
+/**
+ * Ping history of one entity since `since` in buckets of the given size,
+ * oldest first
+ */
+export async function getPingBuckets(
+  entityType: string,
+  entityId: string,
+  since: Date,
+  bucketMinutes: RollupResolution
+): Promise<PingBucket[]> {
+  const rollups = await prisma.networkPingRollup.findMany({
+    where: {
+      entityType,
+      entityId,
+      bucketMinutes,
+      bucketStart: { gte: floorToBucket(since, bucketMinutes) }
+    },
+    orderBy: { bucketStart: 'asc' }
+  });
+
+  // Whatever the compaction has not reached yet comes from the raw results
+  const rolledUpUntil = rollups.length > 0
+    ? new Date(rollups[rollups.length - 1].bucketStart.getTime() + bucketMinutes * 60 * 1000)
+    : since;
+  const tail = await rawBuckets(entityType, entityId, rolledUpUntil > since ? rolledUpUntil : since, bucketMinutes);
+
+  return [
+    ...rollups.map(r => ({
+      bucketStart: r.bucketStart,
+      sampleCount: r.sampleCount,
+      onlineCount: r.onlineCount,
+      slowCount: r.slowCount,
+      offlineCount: r.offlineCount,
+      timeoutCount: r.timeoutCount,
+      errorCount: r.errorCount,
+      rttCount: r.rttCount,
+      minRtt: r.minRtt,
+      avgRtt: r.avgRtt,
+      maxRtt: r.maxRtt,
+      p95Rtt: r.p95Rtt,
+      avgPacketLoss: r.avgPacketLoss
+    })),
+    ...tail
+  ];
+}
+
+/**
+ * Combine buckets into totals, weighting averages by their sample counts
+ */
+export function summarizePingBuckets(buckets: PingBucket[]): PingSummary {
+  const summary: PingSummary = {
+    samples: 0,
+    online: 0,
+    slow: 0,
+    offline: 0,
+    timeout: 0,
+    error: 0,
+    minRtt: null,
+    avgRtt: null,
+    maxRtt: null,
+    avgPacketLoss: null
+  };
+  let rttCount = 0;
+  let rttSum = 0;
+  let lossSamples = 0;
+  let lossSum = 0;
+
+  for (const bucket of buckets) {
+    summary.samples += bucket.sampleCount;
+    summary.online += bucket.onlineCount;
+    summary.slow += bucket.slowCount;
+    summary.offline += bucket.offlineCount;
+    summary.timeout += bucket.timeoutCount;
+    summary.error += bucket.errorCount;
+    if (bucket.rttCount > 0 && bucket.avgRtt !== null) {
+      rttCount += bucket.rttCount;
+      rttSum += bucket.avgRtt * bucket.rttCount;
+    }
+    if (bucket.minRtt !== null) {
+      summary.minRtt = summary.minRtt === null ? bucket.minRtt : Math.min(summary.minRtt, bucket.minRtt);
+    }
+    if (bucket.maxRtt !== null) {
+      summary.maxRtt = summary.maxRtt === null ? bucket.maxRtt : Math.max(summary.maxRtt, bucket.maxRtt);
+    }
+    if (bucket.avgPacketLoss !== null) {
+      lossSamples += bucket.sampleCount;
+      lossSum += bucket.avgPacketLoss * bucket.sampleCount;
+    }
+  }
+
+  summary.avgRtt = rttCount > 0 ? rttSum / rttCount : null;
+  summary.avgPacketLoss = lossSamples > 0 ? lossSum / lossSamples : null;
+  return summary;
+}
@@ -0,0 +1,574 @@
+/**
+ * Bulk Ingestion of Monitoring Agent Results
+ * Applies a whole batch of ping results with a handful of queries: entities
+ * and monitoring logs are prefetched with IN queries, the hysteresis state
+ * machine runs in memory in per-entity row order, and all writes go out in
+ * one transaction. Only rows that change state reach incident correlation.
+ * Used inline by the results route and by the queued ingestion worker.
+ */
+
+import { randomUUID } from 'crypto';
+import { prisma } from '@/lib/prisma';
+import { Prisma, NetworkStatus, DeviceState } from '@prisma/client';
+import { processStateTransition, StateTransitionResult } from './device-state-machine';
+import {
+  createOrUpdateIncident,
+  resolveIncident,
+  attachPathDiagnostics,
+  createOrUpdateGroupIncident,
+  resolveGroupIncident
+} from './incident-correlation';
+import { markAgentBatchApplied } from './agent-batches';
+
+// Rows per multi-row INSERT ... ON CONFLICT statement
+const LOG_UPSERT_CHUNK_SIZE = 500;
+
+export interface AgentPingResult {
+  entity_type: 'BRANCH' | 'ATM';
+  entity_id: string;
+  ip_address: string;
+  status: 'ONLINE' | 'OFFLINE' | 'SLOW' | 'TIMEOUT' | 'ERROR';
+  response_time_ms?: number | null;
+  packet_loss?: number | null;
+  min_rtt?: number | null;
+  max_rtt?: number | null;
+  avg_rtt?: number | null;
+  error_message?: string | null;
+  parent_unreachable?: boolean;
+  path?: Record<string, any>;
+  snmp?: AgentSnmpSample;
+  timestamp?: string;
+}
+
+// Branch router load polled by the agent over SNMP, attached to the branch's row
+export interface AgentSnmpSample {
+  sampled_at: string;
+  cpu_percent: number | null;
+  max_utilization: number | null;
+  interfaces: {
+    if_index: number;
+    name: string | null;
+    speed_mbps: number;
+    in_bps: number;
+    out_bps: number;
+    in_utilization: number;
+    out_utilization: number;
+  }[];
+}
+
+// Correlated vendor/media outage collapsed by the agent into one event
+export interface AgentGroupEvent {
+  group_type: 'VENDOR' | 'MEDIA';
+  group_key: string;
+  status: 'OFFLINE' | 'RECOVERED';
+  branch_ids: string[];
+  atm_ids: string[];
+  since?: string;
+  timestamp?: string;
+}
+
+export interface AgentBatchPayload {
+  agent_id: string;
+  results: AgentPingResult[];
+  group_events?: AgentGroupEvent[];
+  batch_id?: string;
+  sequence?: number;
+  boot_id?: string;
+}
+
+export interface IngestedResult {
+  entity_id: string;
+  status: string;
+  state: DeviceState;
+  incident?: string;
+  incident_id?: string;
+}
+
+export interface IngestError {
+  entity_id: string;
+  error: string;
+}
+
+export interface IngestedGroup {
+  group_type: string;
+  group_key: string;
+  status: string;
+  incident?: string;
+  incident_id?: string;
+}
+
+interface LogState {
+  exists: boolean;
+  ipAddress: string;
+  status: NetworkStatus | null;
+  responseTimeMs: number | null;
+  packetLoss: number | null;
+  errorMessage: string | null;
+  checkedAt: Date;
+  previousStatus: NetworkStatus | null;
+  statusChangedAt: Date | null;
+  downSince: Date | null;
+  uptimeSeconds: number;
+  downtimeSeconds: number;
+  deviceState: DeviceState;
+  consecutiveFailures: number;
+  consecutiveSuccesses: number;
+  lastStateChange: Date | null;
+}
+
+interface StateChange {
+  row: number;
+  result: AgentPingResult;
+  entityName: string;
+  transition: StateTransitionResult;
+}
+
+const entityKey = (entityType: string, entityId: string) => `${entityType}:${entityId}`;
+
+// Prisma stores DateTime as UTC in timestamp columns; build it from epoch so the session time zone never matters
+function sqlTimestamp(date: Date | null): Prisma.Sql {
+  return date
+    ? Prisma.sql`(to_timestamp(${date.getTime()}::double precision / 1000) AT TIME ZONE 'UTC')`
+    : Prisma.sql`NULL::timestamp`;
+}
+
+// When the agent took a sample; confirmation re-probes put several in one batch
+function sampleTime(result: AgentPingResult, fallback: Date): Date {
+  const checkedAt = result.timestamp ? new Date(result.timestamp) : fallback;
+  return isNaN(checkedAt.getTime()) ? fallback : checkedAt;
+}
+
+/**
+ * Apply one ping result to an entity's in-memory monitoring log
+ * Mirrors the per-result upsert and updateDeviceState sequence
+ */
+function applyResult(log: LogState, result: AgentPingResult, checkedAt: Date): StateTransitionResult {
+  const status = result.status as NetworkStatus;
+  const previousStatus = log.exists ? log.status : null;
+
+  // Samples can arrive out of order across batches; never count negative time
+  const timeSinceLastCheck = log.exists
+    ? Math.max(0, Math.floor((checkedAt.getTime() - log.checkedAt.getTime()) / 1000))
+    : 0;
+  if (status === 'ONLINE' || status === 'SLOW') {
+    log.uptimeSeconds += timeSinceLastCheck;
+  } else {
+    log.downtimeSeconds += timeSinceLastCheck;
+  }
+
+  if (status !== previousStatus) {
+    log.statusChangedAt = checkedAt;
+  }
+  if (status === 'OFFLINE' && previousStatus !== 'OFFLINE') {
+    log.downSince = checkedAt;
+  } else if (status !== 'OFFLINE' && log.exists) {
+    log.downSince = null;
+  }
+
+  log.previousStatus = previousStatus;
+  log.status = status;
+  log.responseTimeMs = result.response_time_ms || null;
+  log.packetLoss = result.packet_loss || null;
+  log.errorMessage = result.error_message || null;
+  log.checkedAt = checkedAt;
+  log.exists = true;
+
+  const transition = processStateTransition(
+    log.deviceState,
+    log.consecutiveFailures,
+    log.consecutiveSuccesses,
+    status
+  );
+  log.deviceState = transition.newState;
+  log.consecutiveFailures = transition.consecutiveFailures;
+  log.consecutiveSuccesses = transition.consecutiveSuccesses;
+  if (transition.stateChanged) {
+    log.lastStateChange = checkedAt;
+  }
+
+  return transition;
+}
+
+/**
+ * Upsert monitoring logs in chunks of multi-row INSERT ... ON CONFLICT
+ */
+async function upsertLogs(tx: Prisma.TransactionClient, logs: Array<[string, string, LogState]>, agentId: string | null) {
+  for (let i = 0; i < logs.length; i += LOG_UPSERT_CHUNK_SIZE) {
+    const rows = logs.slice(i, i + LOG_UPSERT_CHUNK_SIZE).map(([entityType, entityId, log]) => Prisma.sql`(
+      ${randomUUID()}, ${entityType}, ${entityId}, ${log.ipAddress},
+      ${log.status}::"NetworkStatus", ${log.responseTimeMs}::integer, ${log.packetLoss}::double precision,
+      ${log.errorMessage}::text, ${sqlTimestamp(log.checkedAt)}, ${log.previousStatus}::"NetworkStatus",
+      ${sqlTimestamp(log.statusChangedAt)}, ${sqlTimestamp(log.downSince)},
+      ${log.uptimeSeconds}::integer, ${log.downtimeSeconds}::integer,
+      ${log.deviceState}::"DeviceState", ${log.consecutiveFailures}::integer, ${log.consecutiveSuccesses}::integer,
+      ${sqlTimestamp(log.lastStateChange)}, ${agentId}::text
+    )`);
+
+    await tx.$executeRaw`
+      INSERT INTO network_monitoring_logs (
+        "id", "entityType", "entityId", "ipAddress", "status", "responseTimeMs", "packetLoss",
+        "errorMessage", "checkedAt", "previousStatus", "statusChangedAt", "downSince",
+        "uptimeSeconds", "downtimeSeconds", "deviceState", "consecutiveFailures",
+        "consecutiveSuccesses", "lastStateChange", "agentId"
+      )
+      VALUES ${Prisma.join(rows)}
+      ON CONFLICT ("entityType", "entityId") DO UPDATE SET
+        "status" = EXCLUDED."status",
+        "responseTimeMs" = EXCLUDED."responseTimeMs",
+        "packetLoss" = EXCLUDED."packetLoss",
+        "errorMessage" = EXCLUDED."errorMessage",
+        "checkedAt" = EXCLUDED."checkedAt",
+        "previousStatus" = EXCLUDED."previousStatus",
+        "statusChangedAt" = EXCLUDED."statusChangedAt",
+        "downSince" = EXCLUDED."downSince",
+        "uptimeSeconds" = EXCLUDED."uptimeSeconds",
+        "downtimeSeconds" = EXCLUDED."downtimeSeconds",
+        "deviceState" = EXCLUDED."deviceState",
+        "consecutiveFailures" = EXCLUDED."consecutiveFailures",
+        "consecutiveSuccesses" = EXCLUDED."consecutiveSuccesses",
+        "lastStateChange" = EXCLUDED."lastStateChange",
+        "agentId" = COALESCE(EXCLUDED."agentId", network_monitoring_logs."agentId")
+    `;
+  }
+}
+
+/**
+ * Ingest a batch of agent ping results
+ * Rows of the same entity are applied in the order they appear in the batch.
+ * With a ledger batch id the ledger row is marked applied in the same
+ * transaction, so a crash before the caller completes it cannot apply it twice
+ */
+export async function ingestAgentResults(
+  results: AgentPingResult[],
+  agentId: string | null = null,
+  ledgerBatchId: string | null = null
+): Promise<{
+  processed: IngestedResult[];
+  errors: IngestError[];
+}> {
+  const outcomes: Array<IngestedResult | undefined> = new Array(results.length);
+  const errors: IngestError[] = [];
+  if (results.length === 0) {
+    return { processed: [], errors };
+  }
+
+  const branchIds = Array.from(new Set(results.filter(r => r.entity_type === 'BRANCH').map(r => r.entity_id)));
+  const atmIds = Array.from(new Set(results.filter(r => r.entity_type === 'ATM').map(r => r.entity_id)));
+
+  // Prefetch entities and their monitoring logs
+  const [branches, atms, existingLogs] = await Promise.all([
+    branchIds.length > 0
+      ? prisma.branch.findMany({ where: { id: { in: branchIds } }, select: { id: true, name: true } })
+      : [],
+    atmIds.length > 0
+      ? prisma.aTM.findMany({ where: { id: { in: atmIds } }, select: { id: true, name: true, branchId: true } })
+      : [],
+    prisma.networkMonitoringLog.findMany({
+      where: {
+        OR: [
+          { entityType: 'BRANCH', entityId: { in: branchIds } },
+          { entityType: 'ATM', entityId: { in: atmIds } }
+        ]
+      }
+    })
+  ]);
+
+  const entities = new Map<string, { name: string; branchId: string | null }>();
+  for (const branch of branches) {
+    entities.set(entityKey('BRANCH', branch.id), { name: branch.name, branchId: branch.id });
+  }
+  for (const atm of atms) {
+    entities.set(entityKey('ATM', atm.id), { name: atm.name, branchId: atm.branchId });
+  }
+
+  const logs = new Map<string, LogState>();
+  for (const log of existingLogs) {
+    logs.set(entityKey(log.entityType, log.entityId), {
+      exists: true,
+      ipAddress: log.ipAddress,
+      status: log.status,
+      responseTimeMs: log.responseTimeMs,
+      packetLoss: log.packetLoss,
+      errorMessage: log.errorMessage,
+      checkedAt: log.checkedAt,
+      previousStatus: log.previousStatus,
+      statusChangedAt: log.statusChangedAt,
+      downSince: log.downSince,
+      uptimeSeconds: log.uptimeSeconds || 0,
+      downtimeSeconds: log.downtimeSeconds || 0,
+      deviceState: log.deviceState,
+      consecutiveFailures: log.consecutiveFailures,
+      consecutiveSuccesses: log.consecutiveSuccesses,
+      lastStateChange: log.lastStateChange
+    });
+  }
+
+  // Apply every row in memory
+  const now = new Date();
+  const pingRows: Prisma.NetworkPingResultCreateManyInput[] = [];
+  const touched = new Map<string, [string, string, LogState]>();
+  const changes: StateChange[] = [];
+  const pathRows: AgentPingResult[] = [];
+  const snmpRows: Prisma.NetworkSnmpSampleCreateManyInput[] = [];
+
+  results.forEach((result, row) => {
+    const key = entityKey(result.entity_type, result.entity_id);
+    const entity = entities.get(key);
+    if (!entity) {
+      errors.push({ entity_id: result.entity_id, error: 'Entity not found' });
+      return;
+    }
+
+    const checkedAt = sampleTime(result, now);
+    pingRows.push({
+      entityType: result.entity_type,
+      entityId: result.entity_id,
+      branchId: result.entity_type === 'BRANCH' ? result.entity_id : entity.branchId,
+      atmId: result.entity_type === 'ATM' ? result.entity_id : null,
+      ipAddress: result.ip_address,
+      status: result.status as NetworkStatus,
+      // Int column; the agent reports fractional milliseconds
+      responseTimeMs: result.response_time_ms ? Math.round(result.response_time_ms) : null,
+      packetLoss: result.packet_loss || 0,
+      minRtt: result.min_rtt || null,
+      maxRtt: result.max_rtt || null,
+      avgRtt: result.avg_rtt || null,
+      errorMessage: result.error_message || null,
+      parentUnreachable: result.parent_unreachable || false,
+      checkedAt
+    });
+
+    // The agent attaches a finished trace to the next row of its entity, which
+    // may be a parent-unreachable one
+    if (result.path) {
+      pathRows.push(result);
+    }
+
+    // The agent did not probe this entity because its parent branch is down:
+    // keep the row for the record, but leave the state machine and incidents
+    // to the parent
+    if (result.parent_unreachable) {
+      const current = logs.get(key);
+      outcomes[row] = {
+        entity_id: result.entity_id,
+        status: result.status,
+        state: current ? current.deviceState : 'UP',
+        incident: 'deferred'
+      };
+      return;
+    }
+
+    let log = logs.get(key);
+    if (!log) {
+      log = {
+        exists: false,
+        ipAddress: result.ip_address,
+        status: null,
+        responseTimeMs: null,
+        packetLoss: null,
+        errorMessage: null,
+        checkedAt: now,
+        previousStatus: null,
+        statusChangedAt: null,
+        downSince: null,
+        uptimeSeconds: 0,
+        downtimeSeconds: 0,
+        deviceState: 'UP',
+        consecutiveFailures: 0,
+        consecutiveSuccesses: 0,
+        lastStateChange: null
+      };
+      logs.set(key, log);
+    }
+
+    const transition = applyResult(log, result, checkedAt);
+    touched.set(key, [result.entity_type, result.entity_id, log]);
+
+    if (result.snmp && result.entity_type === 'BRANCH') {
+      snmpRows.push({
+        branchId: result.entity_id,
+        cpuPercent: result.snmp.cpu_percent ?? null,
+        maxUtilization: result.snmp.max_utilization ?? null,
+        interfaces: result.snmp.interfaces || [],
+        sampledAt: result.snmp.sampled_at ? new Date(result.snmp.sampled_at) : now
+      });
+    }
+
+    if (transition.shouldCreateIncident || transition.shouldResolveIncident) {
+      changes.push({ row, result, entityName: entity.name, transition });
+    } else {
+      outcomes[row] = { entity_id: result.entity_id, status: result.status, state: transition.newState };
+    }
+  });
+
+  // Write ping results, SNMP samples and logs together
+  await prisma.$transaction(async (tx) => {
+    if (pingRows.length > 0) {
+      await tx.networkPingResult.createMany({ data: pingRows });
+    }
+    if (snmpRows.length > 0) {
+      await tx.networkSnmpSample.createMany({ data: snmpRows });
+    }
+    await upsertLogs(tx, Array.from(touched.values()), agentId);
+    if (ledgerBatchId) {
+      await markAgentBatchApplied(tx, ledgerBatchId);
+    }
+  }, { timeout: 60000 });
+
+  // Keep the agent's path diagnostics with the open incident
+  for (const result of pathRows) {
+    try {
+      await attachPathDiagnostics(result.entity_type, result.entity_id, result.path!);
+    } catch (err) {
+      console.error(`Error attaching path diagnostics for ${result.entity_id}:`, err);
+    }
+  }
+
+  // Incident correlation only for rows that changed state, in batch order
+  for (const { row, result, entityName, transition } of changes) {
+    try {
+      if (transition.shouldCreateIncident) {
+        const incidentResult = await createOrUpdateIncident({
+          entityType: result.entity_type,
+          entityId: result.entity_id,
+          entityName
+        });
+
+        outcomes[row] = {
+          entity_id: result.entity_id,
+          status: result.status,
+          state: transition.newState,
+          incident: incidentResult.created ? 'created' : (incidentResult.suppressed ? 'suppressed' : 'deduplicated'),
+          incident_id: incidentResult.incidentId
+        };
+      } else {
+        await resolveIncident(result.entity_type, result.entity_id);
+
+        outcomes[row] = {
+          entity_id: result.entity_id,
+          status: result.status,
+          state: transition.newState,
+          incident: 'resolved'
+        };
+      }
+    } catch (err) {
+      console.error(`Error correlating incident for ${result.entity_id}:`, err);
+      errors.push({
+        entity_id: result.entity_id,
+        error: err instanceof Error ? err.message : 'Processing error'
+      });
+    }
+  }
+
+  return { processed: outcomes.filter((o): o is IngestedResult => o !== undefined), errors };
+}
+
+/**
+ * Apply outage group events with bulk log updates and a single incident per group
+ */
+export async function ingestGroupEvents(events: AgentGroupEvent[], errors: IngestError[]): Promise<IngestedGroup[]> {
+  const processedGroups: IngestedGroup[] = [];
+
+  for (const event of events) {
+    try {
+      const members: Array<{ entityType: 'BRANCH' | 'ATM'; entityIds: string[] }> = [
+        { entityType: 'BRANCH', entityIds: event.branch_ids },
+        { entityType: 'ATM', entityIds: event.atm_ids }
+      ];
+
+      if (event.status === 'OFFLINE') {
+        const checkedAt = event.timestamp ? new Date(event.timestamp) : new Date();
+        const errorMessage = `${event.group_type} ${event.group_key} outage`;
+
+        // Members are DOWN under the group incident, without per-entity incidents
+        for (const { entityType, entityIds } of members) {
+          if (entityIds.length === 0) continue;
+          await prisma.networkMonitoringLog.updateMany({
+            where: { entityType, entityId: { in: entityIds }, status: { not: 'OFFLINE' } },
+            data: { statusChangedAt: checkedAt, downSince: checkedAt }
+          });
+          await prisma.networkMonitoringLog.updateMany({
+            where: { entityType, entityId: { in: entityIds }, deviceState: { not: 'DOWN' } },
+            data: { lastStateChange: checkedAt }
+          });
+          await prisma.networkMonitoringLog.updateMany({
+            where: { entityType, entityId: { in: entityIds } },
+            data: {
+              status: 'OFFLINE',
+              checkedAt,
+              errorMessage,
+              deviceState: 'DOWN',
+              consecutiveFailures: { increment: 1 },
+              consecutiveSuccesses: 0
+            }
+          });
+        }
+
+        const incidentResult = await createOrUpdateGroupIncident({
+          groupType: event.group_type,
+          groupKey: event.group_key,
+          branchIds: event.branch_ids,
+          atmIds: event.atm_ids
+        });
+
+        processedGroups.push({
+          group_type: event.group_type,
+          group_key: event.group_key,
+          status: event.status,
+          incident: incidentResult.created ? 'created' : 'deduplicated',
+          incident_id: incidentResult.incidentId
+        });
+      } else {
+        const incidentId = await resolveGroupIncident(event.group_type, event.group_key);
+
+        // Hand members back to their own hysteresis: one still failing reaches
+        // DOWN again through its own rows and opens its own incident
+        const recoveredAt = event.timestamp ? new Date(event.timestamp) : new Date();
+        for (const { entityType, entityIds } of members) {
+          if (entityIds.length === 0) continue;
+          await prisma.networkMonitoringLog.updateMany({
+            where: { entityType, entityId: { in: entityIds }, deviceState: 'DOWN' },
+            data: { deviceState: 'UP', consecutiveFailures: 0, consecutiveSuccesses: 0, lastStateChange: recoveredAt }
+          });
+        }
+
+        processedGroups.push({
+          group_type: event.group_type,
+          group_key: event.group_key,
+          status: event.status,
+          incident: incidentId ? 'resolved' : undefined,
+          incident_id: incidentId || undefined
+        });
+      }
+    } catch (err) {
+      console.error(`Error processing group event ${event.group_type} ${event.group_key}:`, err);
+      errors.push({
+        entity_id: `${event.group_type}:${event.group_key}`,
+        error: err instanceof Error ? err.message : 'Processing error'
+      });
+    }
+  }
+
+  return processedGroups;
+}
+
+/**
+ * Apply a complete agent batch (results, then group events) and build the
+ * response body returned to the agent and stored in the batch ledger
+ */
+export async function processAgentBatch(batch: AgentBatchPayload, ledgerBatchId: string | null = null) {
+  const { processed, errors } = await ingestAgentResults(batch.results, batch.agent_id, ledgerBatchId);
+  const groups = await ingestGroupEvents(batch.group_events || [], errors);
+
+  return {
+    agent_id: batch.agent_id,
+    batch_id: batch.batch_id,
+    sequence: batch.sequence,
+    processed: processed.length,
+    groups_processed: groups.length,
+    groups: groups.length > 0 ? groups : undefined,
+    errors: errors.length,
+    results: processed,
+    error_details: errors.length > 0 ? errors : undefined
+  };
+}
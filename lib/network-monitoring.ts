@@ -1,6 +1,7 @@
 import { spawn } from 'child_process';
 import { prisma } from '@/lib/prisma';
 import { NetworkStatus, NetworkMedia } from '@prisma/client';
+import { getPingBuckets, resolutionFor, summarizePingBuckets } from '@/lib/monitoring/ping-rollups';
 
 interface PingResult {
   success: boolean;
@@ -358,7 +359,7 @@ export async function getNetworkHealth(entityType: 'BRANCH' | 'ATM', entityId: s
   const since = new Date();
   since.setHours(since.getHours() - hours);
 
-  const results = await prisma.networkPingResult.findMany({
+  const latest = await prisma.networkPingResult.findFirst({
     where: {
       entityType,
       entityId,
@@ -367,7 +368,7 @@ export async function getNetworkHealth(entityType: 'BRANCH' | 'ATM', entityId: s
     orderBy: { checkedAt: 'desc' }
   });
 
-  if (results.length === 0) {
+  if (!latest) {
     return {
       status: 'NO_DATA',
       uptime: 0,
@@ -377,18 +378,16 @@ export async function getNetworkHealth(entityType: 'BRANCH' | 'ATM', entityId: s
     };
   }
 
-  const onlineCount = results.filter(r => r.status === 'ONLINE').length;
-  const totalResponseTime = results.reduce((sum, r) => sum + (r.responseTimeMs || 0), 0);
-  const totalPacketLoss = results.reduce((sum, r) => sum + (r.packetLoss || 0), 0);
+  const summary = summarizePingBuckets(await getPingBuckets(entityType, entityId, since, resolutionFor(hours)));
 
   return {
-    status: results[0].status,
-    uptime: (onlineCount / results.length) * 100,
-    avgResponseTime: Math.round(totalResponseTime / results.length),
-    avgPacketLoss: totalPacketLoss / results.length,
-    lastCheck: results[0].checkedAt,
-    totalChecks: results.length,
-    networkMedia: results[0].networkMedia,
-    networkVendor: results[0].networkVendor
+    status: latest.status,
+    uptime: summary.samples > 0 ? (summary.online / summary.samples) * 100 : 0,
+    avgResponseTime: Math.round(summary.avgRtt ?? 0),
+    avgPacketLoss: summary.avgPacketLoss ?? 0,
+    lastCheck: latest.checkedAt,
+    totalChecks: summary.samples,
+    networkMedia: latest.networkMedia,
+    networkVendor: latest.networkVendor
   };
 }
\ No newline at end of file
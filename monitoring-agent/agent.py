@@ -9,14 +9,29 @@ import time
 import logging
 import os
 import sys
-import subprocess
-import platform
 import re
-from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List, Dict, Any, Optional
+import copy
+import signal
+import threading
+import uuid
+import itertools
+import argparse
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import List, Dict, Any, Optional, Callable
 import requests
 
+from control_api import ControlApiServer
+from command_channel import CommandChannel
+from path_diagnostics import PathDiagnostics
+from probing import PingResult, ping_host, TokenBucket, RateLimiter
+from history_store import HistoryStore
+from parquet_export import ParquetExporter, PYARROW_AVAILABLE
+from probe_capture import ProbeCapture, ProbeReplay, read_capture
+from snmp_collector import SnmpCollector
+from transport import UploadTransport, UploadBackpressure, TransportError, mount_keepalive
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -31,9 +46,121 @@ logger = logging.getLogger(__name__)
 
 class Config:
     """Configuration management"""
-    def __init__(self, config_path: str = 'config.json'):
+    def __init__(self, config_path: str = 'config.json', data: Optional[Dict] = None):
         self.config_path = config_path
-        self.data = self._load_config()
+        self.data = data if data is not None else self._load_config()
+
+    @classmethod
+    def reload(cls, config_path: str) -> 'Config':
+        """Read and validate the config file again, raising ValueError if it is unusable"""
+        try:
+            with open(config_path, 'r') as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            raise ValueError(f"Cannot read {config_path}: {e}")
+        if not isinstance(data, dict):
+            raise ValueError(f"{config_path} must contain a JSON object")
+        config = cls(config_path, data)
+        config.validate()
+        return config
+
+    def scaled(self, factor: float) -> 'Config':
+        """
+        A copy running `factor` times faster than real time: every duration
+        divided and every probe rate multiplied by it (soak tests, replays)
+        """
+        data = copy.deepcopy(self.data)
+        for key, prop in DURATION_SETTINGS.items():
+            data[key] = getattr(self, prop) / factor
+        limits = data.get('rate_limits') or {}
+        for dimension in ('network_media', 'network_vendor'):
+            limits[dimension] = {k: v * factor for k, v in (limits.get(dimension) or {}).items()}
+        if limits.get('branch'):
+            limits['branch'] *= factor
+        data['rate_limits'] = limits
+        return Config(self.config_path, data)
+
+    def validate(self):
+        """Raise ValueError describing every invalid setting"""
+        errors = []
+
+        def check(name, value, valid, expected):
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or not valid(value):
+                errors.append(f"{name} must be {expected} (got {value!r})")
+
+        if not self.helpdesk_url:
+            errors.append("helpdesk_url is required")
+        check('ping_interval_seconds', self.ping_interval, lambda v: v > 0, 'a positive number')
+        check('ping_timeout_ms', self.ping_timeout, lambda v: v > 0, 'a positive number')
+        check('ping_count', self.ping_count, lambda v: int(v) == v and v >= 1, 'an integer >= 1')
+        check('max_concurrent_pings', self.max_concurrent, lambda v: int(v) == v and v >= 1, 'an integer >= 1')
+        check('entity_refresh_interval_seconds', self.entity_refresh_interval, lambda v: v > 0, 'a positive number')
+        check('entity_page_size', self.entity_page_size, lambda v: int(v) == v and 1 <= v <= 10000,
+              'an integer between 1 and 10000')
+        check('cycle_deadline_seconds', self.cycle_deadline, lambda v: v > 0, 'a positive number')
+        # A cycle allowed to run past its slot would delay the next one
+        if (isinstance(self.ping_interval, (int, float)) and isinstance(self.cycle_deadline, (int, float))
+                and self.cycle_deadline > self.ping_interval):
+            errors.append(f"cycle_deadline_seconds must not exceed ping_interval_seconds "
+                          f"({self.cycle_deadline!r} > {self.ping_interval!r})")
+        check('slow_baseline_alpha', self.slow_baseline_alpha, lambda v: 0 < v <= 1, 'in (0, 1]')
+        check('slow_enter_factor', self.slow_enter_factor, lambda v: v >= 1, '>= 1')
+        check('slow_exit_factor', self.slow_exit_factor, lambda v: 1 <= v <= self.slow_enter_factor,
+              'between 1 and slow_enter_factor')
+        check('group_outage_failure_ratio', self.group_outage_failure_ratio, lambda v: 0 < v <= 1, 'in (0, 1]')
+        check('group_outage_recovery_ratio', self.group_outage_recovery_ratio, lambda v: 0 < v <= 1, 'in (0, 1]')
+        check('confirm_probe_count', self.confirm_probe_count, lambda v: int(v) == v and v >= 0, 'an integer >= 0')
+        check('control_api_rate_per_second', self.control_api_rate, lambda v: v > 0, 'a positive number')
+        check('control_api_burst', self.control_api_burst, lambda v: v >= 1, '>= 1')
+        check('control_api_max_concurrent', self.control_api_max_concurrent,
+              lambda v: int(v) == v and v >= 1, 'an integer >= 1')
+        check('command_max_concurrent', self.command_max_concurrent,
+              lambda v: int(v) == v and v >= 1, 'an integer >= 1')
+        check('diagnostics_max_concurrent', self.diagnostics_max_concurrent,
+              lambda v: int(v) == v and v >= 1, 'an integer >= 1')
+        check('upload_pool_size', self.upload_pool_size, lambda v: int(v) == v and v >= 1, 'an integer >= 1')
+        check('upload_batch_size', self.upload_batch_size, lambda v: int(v) == v and v >= 1, 'an integer >= 1')
+        check('upload_pipeline_depth', self.upload_pipeline_depth,
+              lambda v: int(v) == v and 1 <= v <= self.upload_pool_size, 'an integer between 1 and upload_pool_size')
+        check('upload_timeout_seconds', self.upload_timeout, lambda v: v > 0, 'a positive number')
+        check('upload_min_batch_size', self.upload_min_batch_size, lambda v: int(v) == v and v >= 1, 'an integer >= 1')
+        check('upload_batch_increase', self.upload_batch_increase, lambda v: int(v) == v and v >= 1, 'an integer >= 1')
+        check('upload_target_latency_ms', self.upload_target_latency_ms, lambda v: v > 0, 'a positive number')
+        check('upload_max_wait_seconds', self.upload_max_wait, lambda v: v >= 0, 'a number >= 0')
+        check('upload_spool_max_results', self.upload_spool_max_results,
+              lambda v: int(v) == v and v >= 0, 'an integer >= 0')
+        check('upload_confirm_timeout_seconds', self.upload_confirm_timeout, lambda v: v > 0, 'a positive number')
+        check('upload_status_poll_interval_seconds', self.upload_status_poll_interval, lambda v: v > 0,
+              'a positive number')
+        check('history_retention_days', self.history_retention_days, lambda v: int(v) == v and v >= 1,
+              'an integer >= 1')
+        check('history_batch_size', self.history_batch_size, lambda v: int(v) == v and v >= 1, 'an integer >= 1')
+        check('history_flush_interval_seconds', self.history_flush_interval, lambda v: v > 0, 'a positive number')
+        check('export_batch_size', self.export_batch_size, lambda v: int(v) == v and v >= 1, 'an integer >= 1')
+        check('export_flush_interval_seconds', self.export_flush_interval, lambda v: v > 0, 'a positive number')
+        check('capture_max_mb', self.capture_max_mb, lambda v: v > 0, 'a positive number')
+        check('snmp_port', self.snmp_port, lambda v: int(v) == v and 1 <= v <= 65535, 'a port number')
+        check('snmp_interval_seconds', self.snmp_interval, lambda v: v > 0, 'a positive number')
+        check('snmp_timeout_ms', self.snmp_timeout, lambda v: v > 0, 'a positive number')
+        check('snmp_retries', self.snmp_retries, lambda v: int(v) == v and v >= 0, 'an integer >= 0')
+        check('snmp_max_concurrent', self.snmp_max_concurrent, lambda v: int(v) == v and v >= 1, 'an integer >= 1')
+        check('snmp_max_repetitions', self.snmp_max_repetitions, lambda v: int(v) == v and v >= 1,
+              'an integer >= 1')
+        if self.export_compression not in EXPORT_COMPRESSIONS:
+            errors.append(f"export_compression must be one of {', '.join(EXPORT_COMPRESSIONS)} "
+                          f"(got {self.export_compression!r})")
+
+        limits = self.rate_limits
+        if not isinstance(limits, dict):
+            errors.append("rate_limits must be an object")
+        else:
+            for dimension in ('network_media', 'network_vendor'):
+                for key, rate in (limits.get(dimension) or {}).items():
+                    check(f"rate_limits.{dimension}.{key}", rate, lambda v: v >= 0, 'a number >= 0')
+            check('rate_limits.branch', limits.get('branch') or 0, lambda v: v >= 0, 'a number >= 0')
+
+        if errors:
+            raise ValueError('; '.join(errors))
 
     def _load_config(self) -> Dict:
         if not os.path.exists(self.config_path):
@@ -55,9 +182,88 @@ class Config:
             "ping_count": 3,
             "max_concurrent_pings": 20,
             "entity_refresh_interval_seconds": 3600,
+            "entity_stream": True,
+            "entity_page_size": 5000,
             "retry_on_failure": True,
             "retry_delay_seconds": 30,
-            "verify_ssl": True
+            "verify_ssl": True,
+            "slow_baseline_alpha": 0.1,
+            "slow_baseline_warmup_samples": 5,
+            "slow_enter_factor": 2.0,
+            "slow_exit_factor": 1.5,
+            "slow_min_delta_ms": 50,
+            "slow_fallback_ms": 1000,
+            "parent_down_threshold": 2,
+            "parent_down_probe_interval_seconds": 300,
+            "group_outage_min_members": 10,
+            "group_outage_failure_ratio": 0.8,
+            "group_outage_sample_size": 3,
+            "group_outage_recovery_ratio": 0.5,
+            "cycle_deadline_seconds": 50,
+            "recent_failure_window_seconds": 900,
+            "confirm_probe_count": 4,
+            "confirm_probe_interval_seconds": 5,
+            "confirm_probe_max_entities": 100,
+            "config_watch_interval_seconds": 5,
+            "control_api_enabled": False,
+            "control_api_host": "127.0.0.1",
+            "control_api_port": 8765,
+            "control_api_token": "",
+            "control_api_rate_per_second": 2,
+            "control_api_burst": 10,
+            "control_api_cache_ttl_seconds": 30,
+            "control_api_max_concurrent": 4,
+            "control_api_max_batch": 50,
+            "command_channel_enabled": False,
+            "command_poll_wait_seconds": 25,
+            "command_retry_delay_seconds": 10,
+            "command_max_concurrent": 4,
+            "diagnostics_enabled": True,
+            "diagnostics_max_concurrent": 2,
+            "diagnostics_max_hops": 20,
+            "diagnostics_hop_timeout_ms": 1000,
+            "diagnostics_budget_seconds": 30,
+            "diagnostics_down_threshold": 3,
+            "upload_pool_size": 8,
+            "upload_keepalive": True,
+            "upload_http2": False,
+            "upload_timeout_seconds": 60,
+            "upload_batch_size": 500,
+            "upload_pipeline_depth": 4,
+            "upload_min_batch_size": 50,
+            "upload_batch_increase": 50,
+            "upload_target_latency_ms": 5000,
+            "upload_max_wait_seconds": 15,
+            "upload_spool_max_results": 20000,
+            "upload_async": False,
+            "upload_confirm_timeout_seconds": 120,
+            "upload_status_poll_interval_seconds": 2,
+            "history_enabled": False,
+            "history_path": "history.db",
+            "history_retention_days": 14,
+            "history_batch_size": 500,
+            "history_flush_interval_seconds": 2,
+            "export_enabled": False,
+            "export_path": "export",
+            "export_batch_size": 5000,
+            "export_flush_interval_seconds": 300,
+            "export_compression": "zstd",
+            "capture_enabled": False,
+            "capture_path": "captures",
+            "capture_max_mb": 500,
+            "snmp_enabled": False,
+            "snmp_community": "public",
+            "snmp_port": 161,
+            "snmp_interval_seconds": 60,
+            "snmp_timeout_ms": 2000,
+            "snmp_retries": 1,
+            "snmp_max_concurrent": 50,
+            "snmp_max_repetitions": 10,
+            "rate_limits": {
+                "network_media": {"VSAT": 30},
+                "network_vendor": {},
+                "branch": 0
+            }
         }
         with open(self.config_path, 'w') as f:
             json.dump(default, f, indent=2)
@@ -94,6 +300,14 @@ class Config:
     def entity_refresh_interval(self) -> int:
         return self.data.get('entity_refresh_interval_seconds', 3600)
 
+    @property
+    def entity_stream(self) -> bool:
+        return self.data.get('entity_stream', True)
+
+    @property
+    def entity_page_size(self) -> int:
+        return self.data.get('entity_page_size', 5000)
+
     @property
     def retry_on_failure(self) -> bool:
         return self.data.get('retry_on_failure', True)
@@ -106,93 +320,417 @@ class Config:
     def verify_ssl(self) -> bool:
         return self.data.get('verify_ssl', True)
 
+    @property
+    def slow_baseline_alpha(self) -> float:
+        return self.data.get('slow_baseline_alpha', 0.1)
 
-class PingResult:
-    """Ping result data class"""
-    def __init__(self, ip_address: str):
-        self.ip_address = ip_address
-        self.success = False
-        self.status = 'ERROR'
-        self.response_time_ms: Optional[float] = None
-        self.packet_loss: float = 100.0
-        self.min_rtt: Optional[float] = None
-        self.max_rtt: Optional[float] = None
-        self.avg_rtt: Optional[float] = None
-        self.error_message: Optional[str] = None
+    @property
+    def slow_baseline_warmup_samples(self) -> int:
+        return self.data.get('slow_baseline_warmup_samples', 5)
 
+    @property
+    def slow_enter_factor(self) -> float:
+        return self.data.get('slow_enter_factor', 2.0)
 
-def ping_host(ip_address: str, count: int = 3, timeout_ms: int = 3000) -> PingResult:
-    """
-    Ping a host and return detailed results
-    Works on Windows, Linux, and macOS
-    """
-    result = PingResult(ip_address)
-    system = platform.system().lower()
+    @property
+    def slow_exit_factor(self) -> float:
+        return self.data.get('slow_exit_factor', 1.5)
 
-    try:
-        timeout_sec = timeout_ms / 1000
-
-        if system == 'windows':
-            cmd = ['ping', '-n', str(count), '-w', str(timeout_ms), ip_address]
-        else:  # Linux/macOS
-            cmd = ['ping', '-c', str(count), '-W', str(int(timeout_sec)), ip_address]
-
-        process = subprocess.run(
-            cmd,
-            capture_output=True,
-            text=True,
-            timeout=timeout_sec * count + 5
-        )
+    @property
+    def slow_min_delta_ms(self) -> float:
+        return self.data.get('slow_min_delta_ms', 50)
 
-        output = process.stdout + process.stderr
+    @property
+    def slow_fallback_ms(self) -> float:
+        return self.data.get('slow_fallback_ms', 1000)
 
-        # Parse packet loss
-        if system == 'windows':
-            loss_match = re.search(r'\((\d+)% loss\)', output)
-        else:
-            loss_match = re.search(r'(\d+(?:\.\d+)?)\s*%\s*packet\s*loss', output, re.IGNORECASE)
-
-        if loss_match:
-            result.packet_loss = float(loss_match.group(1))
-
-        # Parse RTT statistics
-        if system == 'windows':
-            rtt_match = re.search(r'Minimum = (\d+)ms.*Maximum = (\d+)ms.*Average = (\d+)ms', output)
-            if rtt_match:
-                result.min_rtt = float(rtt_match.group(1))
-                result.max_rtt = float(rtt_match.group(2))
-                result.avg_rtt = float(rtt_match.group(3))
-                result.response_time_ms = result.avg_rtt
+    @property
+    def parent_down_threshold(self) -> int:
+        return self.data.get('parent_down_threshold', 2)
+
+    @property
+    def parent_down_probe_interval(self) -> int:
+        return self.data.get('parent_down_probe_interval_seconds', 300)
+
+    @property
+    def group_outage_min_members(self) -> int:
+        return self.data.get('group_outage_min_members', 10)
+
+    @property
+    def group_outage_failure_ratio(self) -> float:
+        return self.data.get('group_outage_failure_ratio', 0.8)
+
+    @property
+    def group_outage_sample_size(self) -> int:
+        return self.data.get('group_outage_sample_size', 3)
+
+    @property
+    def group_outage_recovery_ratio(self) -> float:
+        return self.data.get('group_outage_recovery_ratio', 0.5)
+
+    @property
+    def cycle_deadline(self) -> float:
+        return self.data.get('cycle_deadline_seconds') or self.ping_interval * 0.9
+
+    @property
+    def recent_failure_window(self) -> int:
+        return self.data.get('recent_failure_window_seconds', 900)
+
+    @property
+    def confirm_probe_count(self) -> int:
+        return self.data.get('confirm_probe_count', 4)
+
+    @property
+    def confirm_probe_interval(self) -> float:
+        return self.data.get('confirm_probe_interval_seconds', 5)
+
+    @property
+    def confirm_probe_max_entities(self) -> int:
+        return self.data.get('confirm_probe_max_entities', 100)
+
+    @property
+    def config_watch_interval(self) -> float:
+        return self.data.get('config_watch_interval_seconds', 5)
+
+    @property
+    def control_api_enabled(self) -> bool:
+        return self.data.get('control_api_enabled', False)
+
+    @property
+    def control_api_host(self) -> str:
+        return self.data.get('control_api_host', '127.0.0.1')
+
+    @property
+    def control_api_port(self) -> int:
+        return self.data.get('control_api_port', 8765)
+
+    @property
+    def control_api_token(self) -> str:
+        return self.data.get('control_api_token', '')
+
+    @property
+    def control_api_rate(self) -> float:
+        return self.data.get('control_api_rate_per_second', 2)
+
+    @property
+    def control_api_burst(self) -> float:
+        return self.data.get('control_api_burst', 10)
+
+    @property
+    def control_api_cache_ttl(self) -> float:
+        return self.data.get('control_api_cache_ttl_seconds', 30)
+
+    @property
+    def control_api_max_concurrent(self) -> int:
+        return self.data.get('control_api_max_concurrent', 4)
+
+    @property
+    def control_api_max_batch(self) -> int:
+        return self.data.get('control_api_max_batch', 50)
+
+    @property
+    def command_channel_enabled(self) -> bool:
+        return self.data.get('command_channel_enabled', False)
+
+    @property
+    def command_poll_wait(self) -> int:
+        return self.data.get('command_poll_wait_seconds', 25)
+
+    @property
+    def command_retry_delay(self) -> float:
+        return self.data.get('command_retry_delay_seconds', 10)
+
+    @property
+    def command_max_concurrent(self) -> int:
+        return self.data.get('command_max_concurrent', 4)
+
+    @property
+    def diagnostics_enabled(self) -> bool:
+        return self.data.get('diagnostics_enabled', True)
+
+    @property
+    def diagnostics_max_concurrent(self) -> int:
+        return self.data.get('diagnostics_max_concurrent', 2)
+
+    @property
+    def diagnostics_max_hops(self) -> int:
+        return self.data.get('diagnostics_max_hops', 20)
+
+    @property
+    def diagnostics_hop_timeout(self) -> int:
+        return self.data.get('diagnostics_hop_timeout_ms', 1000)
+
+    @property
+    def diagnostics_budget(self) -> float:
+        return self.data.get('diagnostics_budget_seconds', 30)
+
+    @property
+    def diagnostics_down_threshold(self) -> int:
+        return self.data.get('diagnostics_down_threshold', 3)
+
+    @property
+    def upload_pool_size(self) -> int:
+        return self.data.get('upload_pool_size', 8)
+
+    @property
+    def upload_keepalive(self) -> bool:
+        return self.data.get('upload_keepalive', True)
+
+    @property
+    def upload_http2(self) -> bool:
+        return self.data.get('upload_http2', False)
+
+    @property
+    def upload_timeout(self) -> float:
+        return self.data.get('upload_timeout_seconds', 60)
+
+    @property
+    def upload_batch_size(self) -> int:
+        return self.data.get('upload_batch_size', 500)
+
+    @property
+    def upload_pipeline_depth(self) -> int:
+        return self.data.get('upload_pipeline_depth', 4)
+
+    @property
+    def upload_min_batch_size(self) -> int:
+        return self.data.get('upload_min_batch_size', 50)
+
+    @property
+    def upload_batch_increase(self) -> int:
+        return self.data.get('upload_batch_increase', 50)
+
+    @property
+    def upload_target_latency_ms(self) -> float:
+        return self.data.get('upload_target_latency_ms', 5000)
+
+    @property
+    def upload_max_wait(self) -> float:
+        return self.data.get('upload_max_wait_seconds', 15)
+
+    @property
+    def upload_spool_max_results(self) -> int:
+        return self.data.get('upload_spool_max_results', 20000)
+
+    @property
+    def upload_async(self) -> bool:
+        return self.data.get('upload_async', False)
+
+    @property
+    def upload_confirm_timeout(self) -> float:
+        return self.data.get('upload_confirm_timeout_seconds', 120)
+
+    @property
+    def upload_status_poll_interval(self) -> float:
+        return self.data.get('upload_status_poll_interval_seconds', 2)
+
+    @property
+    def history_enabled(self) -> bool:
+        return self.data.get('history_enabled', False)
+
+    @property
+    def history_path(self) -> str:
+        return self.data.get('history_path', 'history.db')
+
+    @property
+    def history_retention_days(self) -> int:
+        return self.data.get('history_retention_days', 14)
+
+    @property
+    def history_batch_size(self) -> int:
+        return self.data.get('history_batch_size', 500)
+
+    @property
+    def history_flush_interval(self) -> float:
+        return self.data.get('history_flush_interval_seconds', 2)
+
+    @property
+    def export_enabled(self) -> bool:
+        return self.data.get('export_enabled', False)
+
+    @property
+    def export_path(self) -> str:
+        return self.data.get('export_path', 'export')
+
+    @property
+    def export_batch_size(self) -> int:
+        return self.data.get('export_batch_size', 5000)
+
+    @property
+    def export_flush_interval(self) -> float:
+        return self.data.get('export_flush_interval_seconds', 300)
+
+    @property
+    def export_compression(self) -> str:
+        return self.data.get('export_compression', 'zstd')
+
+    @property
+    def capture_enabled(self) -> bool:
+        return self.data.get('capture_enabled', False)
+
+    @property
+    def capture_path(self) -> str:
+        return self.data.get('capture_path', 'captures')
+
+    @property
+    def capture_max_mb(self) -> float:
+        return self.data.get('capture_max_mb', 500)
+
+    @property
+    def snmp_enabled(self) -> bool:
+        return self.data.get('snmp_enabled', False)
+
+    @property
+    def snmp_community(self) -> str:
+        return self.data.get('snmp_community', 'public')
+
+    @property
+    def snmp_port(self) -> int:
+        return self.data.get('snmp_port', 161)
+
+    @property
+    def snmp_interval(self) -> float:
+        return self.data.get('snmp_interval_seconds', 60)
+
+    @property
+    def snmp_timeout(self) -> float:
+        return self.data.get('snmp_timeout_ms', 2000)
+
+    @property
+    def snmp_retries(self) -> int:
+        return self.data.get('snmp_retries', 1)
+
+    @property
+    def snmp_max_concurrent(self) -> int:
+        return self.data.get('snmp_max_concurrent', 50)
+
+    @property
+    def snmp_max_repetitions(self) -> int:
+        return self.data.get('snmp_max_repetitions', 10)
+
+    @property
+    def rate_limits(self) -> Dict:
+        return self.data.get('rate_limits', {})
+
+
+class RttBaseline:
+    """
+    Streaming EWMA baseline of one target's round-trip time.
+    Keeps a sticky SLOW flag so the classification only flips when RTT
+    crosses the enter/exit bands (hysteresis).
+    """
+    def __init__(self, alpha: float):
+        self.alpha = alpha
+        self.mean: Optional[float] = None
+        self.samples = 0
+        self.slow = False
+
+    def update(self, rtt: float, alpha: Optional[float] = None):
+        alpha = self.alpha if alpha is None else alpha
+        if self.mean is None:
+            self.mean = rtt
         else:
-            rtt_match = re.search(r'([\d.]+)/([\d.]+)/([\d.]+)', output)
-            if rtt_match:
-                result.min_rtt = float(rtt_match.group(1))
-                result.avg_rtt = float(rtt_match.group(2))
-                result.max_rtt = float(rtt_match.group(3))
-                result.response_time_ms = result.avg_rtt
-
-        # Determine status
-        if result.packet_loss == 0 and result.response_time_ms:
-            result.success = True
-            if result.response_time_ms > 1000:
-                result.status = 'SLOW'
-            else:
-                result.status = 'ONLINE'
-        elif result.packet_loss < 100:
-            result.success = True
-            result.status = 'SLOW'
+            self.mean += alpha * (rtt - self.mean)
+        self.samples += 1
+
+    def classify(self, rtt: float, warmup_samples: int, enter_factor: float,
+                 exit_factor: float, min_delta_ms: float, fallback_ms: float, learn: bool = True) -> bool:
+        """
+        Return True if rtt is SLOW for this target and fold it into the baseline.
+        Until warmed up the fixed fallback threshold applies. Afterwards SLOW is
+        entered above max(mean * enter_factor, mean + min_delta_ms) and left
+        below max(mean * exit_factor, mean + min_delta_ms / 2).
+        With learn=False the sample is judged but neither the mean nor the
+        sticky flag changes.
+        """
+        if self.samples < warmup_samples or self.mean is None:
+            slow = rtt > fallback_ms
+            if learn:
+                self.slow = slow
+                self.update(rtt)
+            return slow
+
+        enter_threshold = max(self.mean * enter_factor, self.mean + min_delta_ms)
+        exit_threshold = max(self.mean * exit_factor, self.mean + min_delta_ms / 2)
+
+        if self.slow:
+            slow = rtt >= exit_threshold
         else:
-            result.success = False
-            result.status = 'OFFLINE'
+            slow = rtt > enter_threshold
+
+        if learn:
+            self.slow = slow
+            # Anomalous samples only nudge the baseline, so a sustained degradation
+            # stays flagged for a while but eventually becomes the new normal.
+            self.update(rtt, self.alpha * 0.1 if slow else None)
+        return slow
+
+
+FAILURE_STATUSES = ('OFFLINE', 'TIMEOUT', 'ERROR')
+
+# Parquet codecs accepted for export_compression
+EXPORT_COMPRESSIONS = ('zstd', 'snappy', 'gzip', 'none')
+
+# Entity attributes whose shared failure is collapsed into one group event
+OUTAGE_GROUP_FIELDS = {
+    'VENDOR': 'network_vendor',
+    'MEDIA': 'network_media',
+}
+
+# Times a broken-off entity feed page is resumed before the fetch fails
+ENTITY_FEED_MAX_RESUMES = 3
+
+# Settings holding durations (key: property), compressed by Config.scaled
+DURATION_SETTINGS = {
+    'ping_interval_seconds': 'ping_interval',
+    'ping_timeout_ms': 'ping_timeout',
+    'cycle_deadline_seconds': 'cycle_deadline',
+    'retry_delay_seconds': 'retry_delay',
+    'entity_refresh_interval_seconds': 'entity_refresh_interval',
+    'parent_down_probe_interval_seconds': 'parent_down_probe_interval',
+    'recent_failure_window_seconds': 'recent_failure_window',
+    'confirm_probe_interval_seconds': 'confirm_probe_interval',
+    'config_watch_interval_seconds': 'config_watch_interval',
+    'upload_timeout_seconds': 'upload_timeout',
+    'upload_max_wait_seconds': 'upload_max_wait',
+    'upload_target_latency_ms': 'upload_target_latency_ms',
+    'upload_confirm_timeout_seconds': 'upload_confirm_timeout',
+    'upload_status_poll_interval_seconds': 'upload_status_poll_interval',
+    'history_flush_interval_seconds': 'history_flush_interval',
+    'export_flush_interval_seconds': 'export_flush_interval',
+    'snmp_interval_seconds': 'snmp_interval',
+    'snmp_timeout_ms': 'snmp_timeout',
+}
+
+
+# Settings only read at startup; apply_config warns when a reload changes them
+RESTART_SETTINGS = (
+    'agent_id', 'control_api_enabled', 'control_api_host', 'control_api_port', 'command_channel_enabled',
+    'diagnostics_enabled', 'history_enabled', 'history_path', 'export_enabled', 'export_path',
+    'export_compression', 'capture_enabled', 'capture_path', 'capture_max_mb', 'snmp_enabled',
+)
 
-    except subprocess.TimeoutExpired:
-        result.status = 'TIMEOUT'
-        result.error_message = 'Ping timed out'
-    except Exception as e:
-        result.status = 'ERROR'
-        result.error_message = str(e)
 
-    return result
+class OutageGroup:
+    """An active vendor/media outage whose failed members are probed by sampling"""
+    def __init__(self, group_type: str, group_key: str, member_ids: List[str]):
+        self.group_type = group_type
+        self.group_key = group_key
+        self.member_ids = list(member_ids)
+        self.since = time.time()
+        self.cursor = 0
+        self.sampled_ids: List[str] = []
+
+    def next_sample(self, size: int) -> List[str]:
+        """Rotate through members so every one is re-checked over time"""
+        if not self.member_ids:
+            return []
+        size = min(size, len(self.member_ids))
+        start = self.cursor % len(self.member_ids)
+        sample = (self.member_ids + self.member_ids)[start:start + size]
+        self.cursor = start + size
+        self.sampled_ids = sample
+        return sample
 
 
 class MonitoringAgent:
@@ -202,79 +740,468 @@ class MonitoringAgent:
         self.config = config
         self.entities: List[Dict] = []
         self.last_entity_refresh = 0
+        self.baselines: Dict[str, RttBaseline] = {}
+        self.baselines_lock = threading.Lock()
+        self.branch_atms: Dict[str, List[Dict]] = {}
+        self.consecutive_failures: Dict[str, int] = {}
+        self.last_probed: Dict[str, float] = {}
+        self.outage_groups: Dict[tuple, OutageGroup] = {}
+        self.ip_index: Dict[str, List[str]] = {}
+        self.entities_by_id: Dict[str, Dict] = {}
+        self.cycle_probes: Dict[str, PingResult] = {}
+        self.rate_limiter = RateLimiter(config.rate_limits)
+        self.last_unhealthy: Dict[str, float] = {}
+        self.shed_ids: set = set()
+        self.cycle_shed_ids: set = set()
+        self.cycle_deadline: Optional[float] = None
+        self.cycle_shed_ips: set = set()
+        self.metrics: Dict[str, int] = {'cycles': 0, 'shed_probes': 0, 'spool_dropped_results': 0}
+        self.latest_results: Dict[str, tuple] = {}
+        self.control_api: Optional[ControlApiServer] = None
+        self.command_channel: Optional[CommandChannel] = None
+        self.paused_until: Dict[str, float] = {}
+        self.diagnosed_down: set = set()
+        self.history: Optional[HistoryStore] = None
+        self.exporter: Optional[ParquetExporter] = None
+        self.capture: Optional[ProbeCapture] = None
+        self.snmp: Optional[SnmpCollector] = None
+        # Set when replaying a capture: probes are answered from it instead of ping
+        self.replay: Optional[ProbeReplay] = None
+        self.path_diagnostics: Optional[PathDiagnostics] = None
+        if config.diagnostics_enabled:
+            self.path_diagnostics = PathDiagnostics(
+                max_concurrent=config.diagnostics_max_concurrent,
+                max_hops=config.diagnostics_max_hops,
+                hop_timeout_ms=config.diagnostics_hop_timeout,
+                budget_seconds=config.diagnostics_budget
+            )
+        self.reload_requested = threading.Event()
+        self.wakeup = threading.Event()
+        self.config_mtime = self.read_config_mtime()
         self.session = requests.Session()
+        mount_keepalive(self.session, 4, config.upload_keepalive)
+        self.configure_session()
+        self.transport = UploadTransport(config)
+        # Sequence numbers restart with every run; the boot id tells the
+        # Helpdesk which run they belong to so it can spot gaps and reordering
+        self.boot_id = uuid.uuid4().hex
+        self.batch_sequence = itertools.count(1)
+        self.batch_sequence_lock = threading.Lock()
+        self.backpressure = UploadBackpressure(config)
+        self.spool: deque = deque()
+        self.spool_lock = threading.Lock()
+        self.pending_batches: Dict[str, tuple] = {}
+        self.pending_lock = threading.Lock()
+
+    def configure_session(self):
         self.session.headers.update({
-            'Authorization': f'Bearer {config.api_key}',
+            'Authorization': f'Bearer {self.config.api_key}',
             'Content-Type': 'application/json',
-            'User-Agent': f'MonitoringAgent/{config.agent_id}'
+            'User-Agent': f'MonitoringAgent/{self.config.agent_id}'
         })
-        self.session.verify = config.verify_ssl
+        self.session.verify = self.config.verify_ssl
+
+    def read_config_mtime(self) -> Optional[float]:
+        try:
+            return os.path.getmtime(self.config.config_path)
+        except OSError:
+            return None
+
+    def handle_sighup(self, signum, frame):
+        """SIGHUP reloads config.json and the entity list without restarting"""
+        self.reload_requested.set()
+        self.wakeup.set()
+
+    def check_reload(self):
+        """Reload the configuration if SIGHUP was received or config.json changed on disk"""
+        mtime = self.read_config_mtime()
+        forced = self.reload_requested.is_set()
+        if not forced and mtime == self.config_mtime:
+            return
+        self.reload_requested.clear()
+        self.config_mtime = mtime
+
+        try:
+            new_config = Config.reload(self.config.config_path)
+        except ValueError as e:
+            logger.error(f"Rejected config reload, keeping current settings: {e}")
+            return
 
-    def fetch_entities(self) -> bool:
-        """Fetch list of entities to monitor from Helpdesk API"""
+        self.apply_config(new_config)
+        if forced:
+            # SIGHUP also refreshes the entity list on the next cycle
+            self.last_entity_refresh = 0
+
+    def apply_config(self, new_config: Config):
+        """
+        Switch to a new configuration in place, keeping entities, baselines,
+        failure streaks and schedule state. Worker pools pick up the new
+        max_concurrent_pings on the next batch of probes; the control API,
+        command channel and path diagnostics pools are resized in place.
+        """
+        changed = sorted(k for k in set(self.config.data) | set(new_config.data)
+                         if self.config.data.get(k) != new_config.data.get(k))
+        self.config = new_config
+        self.configure_session()
+        self.transport.configure(new_config)
+        self.backpressure.configure(new_config)
+        self.rate_limiter.configure(new_config.rate_limits)
+        if self.control_api:
+            self.control_api.configure(new_config)
+        if self.command_channel:
+            self.command_channel.configure(new_config)
+        if self.path_diagnostics:
+            self.path_diagnostics.configure(new_config)
+        if self.history:
+            self.history.retention_days = new_config.history_retention_days
+            self.history.batch_size = new_config.history_batch_size
+            self.history.flush_interval = new_config.history_flush_interval
+        if self.exporter:
+            self.exporter.batch_size = new_config.export_batch_size
+            self.exporter.flush_interval = new_config.export_flush_interval
+        if self.snmp:
+            self.snmp.community = new_config.snmp_community
+            self.snmp.port = new_config.snmp_port
+            self.snmp.interval = new_config.snmp_interval
+            self.snmp.timeout_ms = new_config.snmp_timeout
+            self.snmp.retries = new_config.snmp_retries
+            self.snmp.max_concurrent = new_config.snmp_max_concurrent
+            self.snmp.max_repetitions = new_config.snmp_max_repetitions
+        with self.baselines_lock:
+            for baseline in self.baselines.values():
+                baseline.alpha = new_config.slow_baseline_alpha
+
+        if changed:
+            logger.info(f"Configuration reloaded, changed: {', '.join(changed)}")
+        else:
+            logger.info("Configuration reloaded, no changes")
+        restart = [k for k in changed if k in RESTART_SETTINGS]
+        if restart:
+            logger.warning(f"Changes to {', '.join(restart)} take effect after a restart")
+
+    def wait_for_next_cycle(self, cycle_start: float):
+        """Sleep until the next cycle is due, applying config reloads meanwhile"""
+        while True:
+            self.check_reload()
+            remaining = cycle_start + self.config.ping_interval - time.monotonic()
+            if remaining <= 0:
+                return
+            self.wakeup.wait(min(remaining, self.config.config_watch_interval))
+            self.wakeup.clear()
+
+    def fetch_entities(self, on_page: Optional[Callable[[List[Dict]], None]] = None) -> bool:
+        """
+        Fetch list of entities to monitor from Helpdesk API
+        With entity_stream enabled the list is read page by page from the
+        NDJSON feed and on_page is called with the entities received so far
+        after each page; the current list is only replaced once it is complete.
+        """
         try:
             url = f"{self.config.helpdesk_url}/api/monitoring/agent/entities"
             logger.info(f"Fetching entities from: {url}")
-            response = self.session.get(url, timeout=30)
-
-            if response.status_code == 200:
-                data = response.json()
-                self.entities = data.get('entities', [])
-                self.last_entity_refresh = time.time()
-                logger.info(f"Fetched {len(self.entities)} entities to monitor")
-
-                # Log entity details
-                branches = [e for e in self.entities if e.get('type') == 'BRANCH']
-                atms = [e for e in self.entities if e.get('type') == 'ATM']
-                logger.info(f"  - Branches: {len(branches)}")
-                logger.info(f"  - ATMs: {len(atms)}")
-
-                # Show all entities with their IPs
-                for entity in self.entities:
-                    backup = entity.get('backup_ip_address')
-                    backup_str = f" (backup: {backup})" if backup else ""
-                    logger.info(f"  [{entity.get('type')}] {entity.get('name', 'Unknown')} - IP: {entity.get('ip_address', 'N/A')}{backup_str}")
-
-                return True
+            if self.config.entity_stream:
+                entities = self.stream_entities(url, on_page)
             else:
-                logger.error(f"Failed to fetch entities: {response.status_code} - {response.text}")
+                entities = self.download_entities(url)
+            if entities is None:
                 return False
 
+            self.entities = entities
+            self.last_entity_refresh = time.time()
+            self.build_topology()
+            logger.info(f"Fetched {len(self.entities)} entities to monitor")
+
+            # Log entity details
+            branches = sum(1 for e in self.entities if e.get('type') == 'BRANCH')
+            atms = sum(1 for e in self.entities if e.get('type') == 'ATM')
+            logger.info(f"  - Branches: {branches}")
+            logger.info(f"  - ATMs: {atms}")
+
+            # Show all entities with their IPs
+            for entity in self.entities:
+                backup = entity.get('backup_ip_address')
+                backup_str = f" (backup: {backup})" if backup else ""
+                logger.info(f"  [{entity.get('type')}] {entity.get('name', 'Unknown')} - IP: {entity.get('ip_address', 'N/A')}{backup_str}")
+
+            return True
+
         except requests.RequestException as e:
             logger.error(f"Error fetching entities: {e}")
             return False
 
-    def ping_entity(self, entity: Dict) -> Dict:
-        """Ping a single entity and return result. Tries backup IP if primary fails."""
-        primary_ip = entity.get('ip_address')
-        backup_ip = entity.get('backup_ip_address')
-
-        if not primary_ip:
+    def download_entities(self, url: str) -> Optional[List[Dict]]:
+        """Fetch the whole entity list as one JSON document"""
+        response = self.session.get(url, timeout=30)
+        if response.status_code != 200:
+            logger.error(f"Failed to fetch entities: {response.status_code} - {response.text}")
             return None
+        return response.json().get('entities', [])
+
+    def stream_entities(self, url: str,
+                        on_page: Optional[Callable[[List[Dict]], None]] = None) -> Optional[List[Dict]]:
+        """
+        Read the NDJSON entity feed one line at a time, entity_page_size
+        entities per request, following the cursor in each page's END line.
+        A page that breaks off before its END line is resumed after the last
+        entity received. A helpdesk without the feed answers with the plain
+        JSON list, which is used as is.
+        """
+        entities: List[Dict] = []
+        cursor = None
+        interruptions = 0
 
-        # Try primary IP first
+        while True:
+            params = {'format': 'ndjson', 'limit': self.config.entity_page_size}
+            if cursor:
+                params['cursor'] = cursor
+
+            end = None
+            try:
+                with self.session.get(url, params=params, headers={'Accept': 'application/x-ndjson'},
+                                      stream=True, timeout=30) as response:
+                    if response.status_code != 200:
+                        logger.error(f"Failed to fetch entities: {response.status_code} - {response.text}")
+                        return None
+                    if 'ndjson' not in response.headers.get('Content-Type', ''):
+                        return response.json().get('entities', [])
+
+                    for line in response.iter_lines():
+                        if not line:
+                            continue
+                        item = json.loads(line)
+                        if item.get('type') == 'END':
+                            end = item
+                            break
+                        entities.append(item)
+                        cursor = f"{item.get('type')}:{item.get('id')}"
+            except (requests.RequestException, ValueError) as e:
+                logger.warning(f"Entity feed error after {len(entities)} entities: {e}")
+
+            if end is None:
+                interruptions += 1
+                if interruptions > ENTITY_FEED_MAX_RESUMES:
+                    logger.error(f"Entity feed broke off {interruptions} times, giving up")
+                    return None
+                logger.warning(f"Entity feed interrupted, resuming after {len(entities)} entities")
+                continue
+
+            if on_page:
+                on_page(entities)
+            if not end.get('next_cursor'):
+                return entities
+            cursor = end['next_cursor']
+
+    def load_initial_entities(self) -> bool:
+        """
+        First entity fetch at startup. The list is downloaded in the
+        background and published after every page, so the first cycle starts
+        probing as soon as the first page is in while the rest downloads.
+        """
+        ready = threading.Event()
+        outcome: Dict[str, bool] = {}
+
+        def publish(entities: List[Dict]):
+            self.entities = list(entities)
+            self.last_entity_refresh = time.time()
+            self.build_topology()
+            logger.info(f"Received {len(entities)} entities so far")
+            ready.set()
+
+        def load():
+            outcome['ok'] = self.fetch_entities(on_page=publish)
+            if not outcome['ok'] and self.entities:
+                # Keep probing the partial list and fetch it again next cycle
+                self.last_entity_refresh = 0
+            ready.set()
+
+        threading.Thread(target=load, name='entity-feed', daemon=True).start()
+        ready.wait()
+        return outcome.get('ok', True)
+
+    def build_topology(self):
+        """
+        Index ATMs by their parent branch for parent-unreachable suppression
+        and entities by address so shared IPs are probed once per cycle
+        """
+        # Built aside and swapped in, the list may be published while a cycle runs
+        entities = self.entities
+        branch_atms: Dict[str, List[Dict]] = {}
+        ip_index: Dict[str, List[str]] = {}
+        for entity in entities:
+            if entity.get('type') == 'ATM' and entity.get('branch_id'):
+                branch_atms.setdefault(entity['branch_id'], []).append(entity)
+            for ip in (entity.get('ip_address'), entity.get('backup_ip_address')):
+                if ip:
+                    ip_index.setdefault(ip, []).append(entity.get('id'))
+        self.entities_by_id = {e.get('id'): e for e in entities}
+        self.branch_atms = branch_atms
+        self.ip_index = ip_index
+
+        shared = {ip: ids for ip, ids in ip_index.items() if len(ids) > 1}
+        if shared:
+            logger.info(f"  - Shared addresses: {len(shared)} IPs used by {sum(len(ids) for ids in shared.values())} entities")
+
+    def is_branch_down(self, branch_id: str) -> bool:
+        """A branch is confirmed down after parent_down_threshold consecutive failed cycles"""
+        return self.consecutive_failures.get(branch_id, 0) >= self.config.parent_down_threshold
+
+    def record_result(self, result: Dict):
+        """Track per-entity failure streaks and probe times from a result row"""
+        entity_id = result['entity_id']
+        if result['status'] in FAILURE_STATUSES:
+            self.consecutive_failures[entity_id] = self.consecutive_failures.get(entity_id, 0) + 1
+        else:
+            self.consecutive_failures[entity_id] = 0
+        if result['status'] != 'ONLINE':
+            self.last_unhealthy[entity_id] = time.time()
+        if not result.get('parent_unreachable'):
+            self.last_probed[entity_id] = time.time()
+        self.latest_results[entity_id] = (time.time(), result)
+        self.check_transition(result)
+
+    def check_transition(self, result: Dict):
+        """
+        Queue a background path trace when an entity goes DOWN (diagnostics_down_threshold
+        consecutive failures) or answers again after being DOWN
+        """
+        if not self.path_diagnostics or result.get('parent_unreachable'):
+            return
+        entity_id = result['entity_id']
+        failures = self.consecutive_failures.get(entity_id, 0)
+
+        # A trace refused because its target is already being traced is retried on the next row
+        if entity_id not in self.diagnosed_down and failures >= self.config.diagnostics_down_threshold:
+            if self.path_diagnostics.submit(entity_id, result['primary_ip'], 'UP_TO_DOWN'):
+                self.diagnosed_down.add(entity_id)
+        elif entity_id in self.diagnosed_down and failures == 0:
+            if self.path_diagnostics.submit(entity_id, result['ip_address'], 'DOWN_TO_UP'):
+                self.diagnosed_down.discard(entity_id)
+
+    def attach_diagnostics(self, results: List[Dict]):
+        """Attach finished path traces to the next result row of their entity"""
+        if not self.path_diagnostics:
+            return
+        for result in results:
+            trace = self.path_diagnostics.take(result['entity_id'])
+            if trace:
+                result['path'] = trace
+
+    def snmp_targets(self) -> List[tuple]:
+        """(entity id, router address) of every branch, for the SNMP collector"""
+        return [(e['id'], e['ip_address']) for e in list(self.entities)
+                if e.get('type') == 'BRANCH' and e.get('ip_address')]
+
+    def attach_snmp(self, results: List[Dict]):
+        """Attach each branch router's latest SNMP sample to the branch's next result row"""
+        if not self.snmp:
+            return
+        for result in results:
+            if result.get('entity_type') == 'BRANCH':
+                sample = self.snmp.take(result['entity_id'])
+                if sample:
+                    result['snmp'] = sample
+
+    def entity_priority(self, entity: Dict) -> int:
+        """
+        Probe priority when a cycle's deadline is at risk (lower goes first):
+        branches, then entities shed last cycle or recently not UP, then the healthy tail
+        """
+        if entity.get('type') == 'BRANCH':
+            return 0
+        entity_id = entity.get('id')
+        if (entity_id in self.shed_ids
+                or time.time() - self.last_unhealthy.get(entity_id, 0) < self.config.recent_failure_window):
+            return 1
+        return 2
+
+    def address_priority(self, ip_address: str) -> int:
+        """Priority of an address is the highest priority of the entities sharing it"""
+        return min(
+            (self.entity_priority(self.entities_by_id[i]) for i in self.ip_index.get(ip_address, []) if i in self.entities_by_id),
+            default=2
+        )
+
+    def parent_unreachable_result(self, entity: Dict) -> Dict:
+        """Result row for an ATM skipped because its parent branch is down"""
+        return {
+            'entity_type': entity.get('type'),
+            'entity_id': entity.get('id'),
+            'ip_address': entity.get('ip_address'),
+            'primary_ip': entity.get('ip_address'),
+            'backup_ip': entity.get('backup_ip_address'),
+            'used_backup': False,
+            'status': 'OFFLINE',
+            'response_time_ms': None,
+            'packet_loss': 100.0,
+            'min_rtt': None,
+            'max_rtt': None,
+            'avg_rtt': None,
+            'error_message': 'Parent branch unreachable',
+            'parent_unreachable': True,
+            'timestamp': datetime.utcnow().isoformat() + 'Z'
+        }
+
+    def classify_slow(self, entity_id: str, result: PingResult, learn: bool = True) -> PingResult:
+        """
+        Re-classify ONLINE/SLOW against the target's own RTT baseline.
+        Loss-based SLOW and failures are left as reported by ping_host.
+        On-demand probes pass learn=False so they never shift the cycle's baselines.
+        """
+        if result.packet_loss != 0 or not result.response_time_ms:
+            return result
+
+        key = f"{entity_id}:{result.ip_address}"
+        with self.baselines_lock:
+            baseline = self.baselines.get(key)
+            if baseline is None:
+                baseline = RttBaseline(self.config.slow_baseline_alpha)
+                if learn:
+                    self.baselines[key] = baseline
+
+            is_slow = baseline.classify(
+                result.response_time_ms,
+                warmup_samples=self.config.slow_baseline_warmup_samples,
+                enter_factor=self.config.slow_enter_factor,
+                exit_factor=self.config.slow_exit_factor,
+                min_delta_ms=self.config.slow_min_delta_ms,
+                fallback_ms=self.config.slow_fallback_ms,
+                learn=learn
+            )
+        result.status = 'SLOW' if is_slow else 'ONLINE'
+        return result
+
+    def probe(self, ip_address: str) -> PingResult:
+        """Ping one address with the configured count and timeout"""
+        if self.replay:
+            return self.replay.probe(ip_address)
+        started = time.time()
         result = ping_host(
-            primary_ip,
+            ip_address,
             count=self.config.ping_count,
             timeout_ms=self.config.ping_timeout
         )
+        if self.capture:
+            self.capture.record(ip_address, started, time.time() - started, result)
+        return result
+
+    def build_result(self, entity: Dict, result: PingResult,
+                     backup_result: Optional[PingResult] = None, learn: bool = True) -> Dict:
+        """Build the result row for an entity from its primary/backup probe results"""
+        primary_ip = entity.get('ip_address')
+        backup_ip = entity.get('backup_ip_address')
 
         used_ip = primary_ip
         used_backup = False
 
-        # If primary failed and backup exists, try backup IP
-        if result.status in ['OFFLINE', 'TIMEOUT', 'ERROR'] and backup_ip:
-            logger.info(f"  Primary IP failed for {entity.get('name')}, trying backup IP: {backup_ip}")
-            backup_result = ping_host(
-                backup_ip,
-                count=self.config.ping_count,
-                timeout_ms=self.config.ping_timeout
-            )
-            # Use backup result if it's better
-            if backup_result.status in ['ONLINE', 'SLOW'] or backup_result.packet_loss < result.packet_loss:
-                result = backup_result
-                used_ip = backup_ip
-                used_backup = True
+        # Use backup result if it's better
+        if backup_result is not None and (
+                backup_result.status in ['ONLINE', 'SLOW'] or backup_result.packet_loss < result.packet_loss):
+            result = backup_result
+            used_ip = backup_ip
+            used_backup = True
+
+        # Probe results may be shared by several entities, classify a private copy
+        result = self.classify_slow(entity.get('id'), copy.copy(result), learn)
 
         return {
             'entity_type': entity.get('type'),
@@ -289,77 +1216,734 @@ class MonitoringAgent:
             'min_rtt': result.min_rtt,
             'max_rtt': result.max_rtt,
             'avg_rtt': result.avg_rtt,
+            'error_message': result.error_message,
             'timestamp': datetime.utcnow().isoformat() + 'Z'
         }
 
+    def ping_entity(self, entity: Dict, learn: bool = True) -> Dict:
+        """Ping a single entity and return result. Tries backup IP if primary fails."""
+        primary_ip = entity.get('ip_address')
+        backup_ip = entity.get('backup_ip_address')
+
+        if not primary_ip:
+            return None
+
+        result = self.probe(primary_ip)
+        backup_result = None
+
+        # If primary failed and backup exists, try backup IP
+        if result.status in FAILURE_STATUSES and backup_ip:
+            logger.info(f"  Primary IP failed for {entity.get('name')}, trying backup IP: {backup_ip}")
+            backup_result = self.probe(backup_ip)
+
+        return self.build_result(entity, result, backup_result, learn)
+
     def ping_all_entities(self) -> List[Dict]:
-        """Ping all entities concurrently"""
-        results = []
+        """
+        Ping all entities concurrently.
+        Branches are probed first so ATMs behind a confirmed-down branch that
+        were already failing can be deferred to a low-rate probe and reported
+        as parent-unreachable instead of each burning a full timeout.
+        """
+        self.cycle_probes = {}
+        self.cycle_shed_ids = set()
+        self.cycle_deadline = time.monotonic() + self.config.cycle_deadline
+        skipped = self.collapsed_group_members() | self.paused_entities()
+        entities = [e for e in self.entities if e.get('id') not in skipped]
+        branches = [e for e in entities if e.get('type') != 'ATM']
+        atms = [e for e in entities if e.get('type') == 'ATM']
+
+        results = self.ping_entities(branches)
+
+        now = time.time()
+        to_probe = []
+        deferred = []
+        for atm in atms:
+            branch_id = atm.get('branch_id')
+            if (branch_id and self.is_branch_down(branch_id)
+                    and self.consecutive_failures.get(atm.get('id'), 0) > 0
+                    and now - self.last_probed.get(atm.get('id'), 0) < self.config.parent_down_probe_interval):
+                deferred.append(atm)
+            else:
+                to_probe.append(atm)
+
+        if deferred:
+            down_branches = {a.get('branch_id') for a in deferred}
+            logger.info(f"Deferring {len(deferred)} ATMs behind {len(down_branches)} down branches (parent-unreachable)")
+            for atm in deferred:
+                result = self.parent_unreachable_result(atm)
+                self.record_result(result)
+                results.append(result)
+
+        results.extend(self.ping_entities(to_probe))
+
+        probed = len(results) - len(deferred)
+        if self.cycle_probes:
+            logger.info(f"Probed {len(self.cycle_probes)} unique addresses for {probed} entities "
+                        f"(dedup ratio {probed / len(self.cycle_probes):.2f}x)")
+
+        # Shed entities are carried over with raised priority into the next cycle
+        self.shed_ids = self.cycle_shed_ids
+        self.metrics['cycles'] += 1
+        self.metrics['shed_probes'] += len(self.cycle_shed_ids)
+        if self.cycle_shed_ids:
+            logger.warning(f"Cycle deadline of {self.config.cycle_deadline:.0f}s reached: {len(self.cycle_shed_ids)} entities "
+                           f"deferred to next cycle ({self.metrics['shed_probes']} shed in total)")
+        return results
 
-        with ThreadPoolExecutor(max_workers=self.config.max_concurrent) as executor:
-            future_to_entity = {
-                executor.submit(self.ping_entity, entity): entity
-                for entity in self.entities
-            }
+    def confirm_failures(self, results: List[Dict]) -> List[Dict]:
+        """
+        Re-probe entities that just failed for the first time a few times at a
+        short interval, returning each re-probe as its own timestamped sample.
+        The server's hysteresis then reaches DOWN within seconds for real
+        outages, while a blip that answers again stops being re-probed.
+        Runs after the cycle is uploaded, and re-probes do not feed the RTT
+        baselines, which already learnt from the cycle's own probe.
+        """
+        candidates = [
+            self.entities_by_id[r['entity_id']] for r in results
+            if r['status'] in FAILURE_STATUSES and not r.get('parent_unreachable')
+            and self.consecutive_failures.get(r['entity_id']) == 1 and r['entity_id'] in self.entities_by_id
+        ]
+        if not candidates or self.config.confirm_probe_count <= 0:
+            return []
+
+        if len(candidates) > self.config.confirm_probe_max_entities:
+            candidates.sort(key=self.entity_priority)
+            candidates = candidates[:self.config.confirm_probe_max_entities]
+
+        logger.info(f"Confirming {len(candidates)} new failures with up to {self.config.confirm_probe_count} "
+                    f"re-probes every {self.config.confirm_probe_interval}s")
+
+        interval = self.config.confirm_probe_interval
+        probe_budget = self.config.ping_timeout / 1000 * self.config.ping_count
+        cycle_shed_ids = self.cycle_shed_ids
+        samples = []
+
+        for _ in range(self.config.confirm_probe_count):
+            if self.cycle_deadline and time.monotonic() + interval + probe_budget > self.cycle_deadline:
+                logger.info("Stopping confirmation re-probes at the cycle deadline")
+                break
+            time.sleep(interval)
+
+            # Confirmation samples must be fresh probes, not this cycle's cached results
+            self.cycle_probes = {}
+            self.cycle_shed_ids = set()
+            rows = self.ping_entities(candidates, learn=False)
+            samples.extend(rows)
+            candidates = [self.entities_by_id[r['entity_id']] for r in rows if r['status'] in FAILURE_STATUSES]
+            if not candidates:
+                break
 
-            for future in as_completed(future_to_entity):
-                entity = future_to_entity[future]
-                try:
-                    result = future.result()
-                    if result:
-                        results.append(result)
-                        status_icon = '✓' if result['status'] in ['ONLINE', 'SLOW'] else '✗'
-                        rtt = result.get('response_time_ms')
-                        rtt_str = f"{rtt:.1f}ms" if rtt else "N/A"
-                        loss = result.get('packet_loss', 100)
-                        backup_indicator = " [BACKUP]" if result.get('used_backup') else ""
-                        logger.info(f"  {status_icon} [{result['entity_type']}] {entity.get('name', entity.get('id'))} ({result['ip_address']}){backup_indicator}: {result['status']} - RTT: {rtt_str}, Loss: {loss}%")
-                except Exception as e:
-                    logger.error(f"Error pinging {entity.get('name', entity.get('id'))}: {e}")
+        self.cycle_shed_ids = cycle_shed_ids
+        return samples
+
+    def collapsed_group_members(self) -> set:
+        """
+        IDs of outage-group members that are skipped this cycle.
+        Each active group only has a small rotating sample probed.
+        """
+        known_ids = {e.get('id') for e in self.entities}
+        collapsed = set()
+        for group in self.outage_groups.values():
+            group.member_ids = [m for m in group.member_ids if m in known_ids]
+            sample = set(group.next_sample(self.config.group_outage_sample_size))
+            collapsed.update(m for m in group.member_ids if m not in sample)
+        return collapsed
+
+    def correlate_outages(self, results: List[Dict]) -> tuple:
+        """
+        Collapse correlated vendor/media failures into compact group events.
+        Returns the remaining per-entity results and the list of group events.
+        """
+        timestamp = datetime.utcnow().isoformat() + 'Z'
+        by_id = {e.get('id'): e for e in self.entities}
+        events = []
+
+        # Judge each entity by its latest row
+        latest = list({r['entity_id']: r for r in results}.values())
+
+        # Update active groups from their sampled members
+        for key, group in list(self.outage_groups.items()):
+            sampled = [r for r in latest if r['entity_id'] in group.sampled_ids]
+            recovered = [r for r in sampled if r['status'] not in FAILURE_STATUSES]
+            if sampled and len(recovered) / len(sampled) >= self.config.group_outage_recovery_ratio:
+                logger.info(f"Outage group {group.group_type} {group.group_key} recovered after {time.time() - group.since:.0f}s")
+                events.append(self.group_event(group, 'RECOVERED', group.member_ids, by_id, timestamp))
+                del self.outage_groups[key]
+                continue
+            # Sampled members only decide recovery; every member is reported through the group
+            events.append(self.group_event(group, 'OFFLINE', group.member_ids, by_id, timestamp))
+
+        # Detect new groups among this cycle's failures
+        grouped_ids = {m for g in self.outage_groups.values() for m in g.member_ids}
+        for group_type, field in OUTAGE_GROUP_FIELDS.items():
+            members: Dict[str, List[str]] = {}
+            for entity in self.entities:
+                if entity.get(field) and entity.get('id') not in grouped_ids:
+                    members.setdefault(entity[field], []).append(entity.get('id'))
+
+            failed: Dict[str, List[str]] = {}
+            for r in latest:
+                entity = by_id.get(r['entity_id'], {})
+                if (r['status'] in FAILURE_STATUSES and not r.get('parent_unreachable')
+                        and entity.get(field) and r['entity_id'] not in grouped_ids):
+                    failed.setdefault(entity[field], []).append(r['entity_id'])
+
+            for group_key, failed_ids in failed.items():
+                total = len(members.get(group_key, []))
+                if (len(failed_ids) < self.config.group_outage_min_members
+                        or len(failed_ids) / total < self.config.group_outage_failure_ratio):
+                    continue
+                group = OutageGroup(group_type, group_key, failed_ids)
+                self.outage_groups[(group_type, group_key)] = group
+                grouped_ids.update(failed_ids)
+                logger.warning(f"Outage group detected: {group_type} {group_key} - {len(failed_ids)}/{total} entities failed")
+                events.append(self.group_event(group, 'OFFLINE', failed_ids, by_id, timestamp))
+
+        collapsed_ids = {m for e in events if e['status'] == 'OFFLINE' for m in e['branch_ids'] + e['atm_ids']}
+        results = [r for r in results if r['entity_id'] not in collapsed_ids]
+        return results, events
+
+    def group_event(self, group: OutageGroup, status: str, member_ids: List[str],
+                    by_id: Dict[str, Dict], timestamp: str) -> Dict:
+        """Compact group event carrying member IDs instead of per-entity rows"""
+        return {
+            'group_type': group.group_type,
+            'group_key': group.group_key,
+            'status': status,
+            'branch_ids': [m for m in member_ids if by_id.get(m, {}).get('type') == 'BRANCH'],
+            'atm_ids': [m for m in member_ids if by_id.get(m, {}).get('type') == 'ATM'],
+            'since': datetime.utcfromtimestamp(group.since).isoformat() + 'Z',
+            'timestamp': timestamp
+        }
+
+    def probe_addresses(self, ip_addresses: List[str]) -> Dict[str, PingResult]:
+        """
+        Probe each address not yet probed this cycle exactly once, concurrently.
+        Returns the cycle's results for all requested addresses.
+        """
+        pending = [ip for ip in dict.fromkeys(ip_addresses) if ip not in self.cycle_probes]
+
+        if pending:
+            for ip, result in self.schedule_probes(pending):
+                self.cycle_probes[ip] = result
+
+        return {ip: self.cycle_probes[ip] for ip in ip_addresses if ip in self.cycle_probes}
+
+    def rate_limit_keys(self, ip_address: str) -> tuple:
+        """Rate limit keys of every entity that owns an address"""
+        keys = set()
+        for entity_id in self.ip_index.get(ip_address, []):
+            entity = self.entities_by_id.get(entity_id)
+            if entity:
+                keys.update(self.rate_limiter.keys_for(entity))
+        return tuple(sorted(keys))
+
+    def schedule_probes(self, ip_addresses: List[str]):
+        """
+        Probe addresses on the worker pool, drawing ping_count packets from the
+        rate limit buckets of each address before it is issued.
+        Addresses are queued per bucket set and served by priority, so a
+        throttled link waits for tokens while other probes keep flowing.
+        No probe is started that could not finish before the cycle deadline;
+        addresses left over are shed for this cycle.
+        Yields (ip, PingResult) as probes complete.
+        """
+        priority = {ip: self.address_priority(ip) for ip in ip_addresses}
+        queues: Dict[tuple, deque] = {}
+        for ip in sorted(ip_addresses, key=lambda ip: priority[ip]):
+            queues.setdefault(self.rate_limit_keys(ip), deque()).append(ip)
+
+        tokens = self.config.ping_count
+        max_workers = self.config.max_concurrent
+        probe_budget = self.config.ping_timeout / 1000 * self.config.ping_count
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            in_flight = {}
+            while queues or in_flight:
+                if queues and self.cycle_deadline and time.monotonic() + probe_budget > self.cycle_deadline:
+                    self.cycle_shed_ips.update(ip for queue in queues.values() for ip in queue)
+                    queues = {}
+
+                # Submit by head priority across bucket sets while workers are free
+                progress = True
+                while progress and len(in_flight) < max_workers:
+                    progress = False
+                    for keys in sorted(queues, key=lambda k: priority[queues[k][0]]):
+                        if len(in_flight) >= max_workers:
+                            break
+                        if not self.rate_limiter.try_acquire(keys, tokens):
+                            continue
+                        ip = queues[keys].popleft()
+                        if not queues[keys]:
+                            del queues[keys]
+                        in_flight[executor.submit(self.probe, ip)] = ip
+                        progress = True
+
+                timeout = None
+                if queues and len(in_flight) < max_workers:
+                    timeout = max(0.01, min(self.rate_limiter.wait_time(keys, tokens) for keys in queues))
+                if not in_flight:
+                    time.sleep(timeout or 0.01)
+                    continue
+
+                done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    ip = in_flight.pop(future)
+                    try:
+                        yield ip, future.result()
+                    except Exception as e:
+                        logger.error(f"Error pinging {ip}: {e}")
+                        result = PingResult(ip)
+                        result.error_message = str(e)
+                        yield ip, result
+
+    def acquire_probe_tokens(self, keys, timeout: float = 10.0):
+        """
+        Wait for link rate limit tokens outside the cycle scheduler.
+        Gives up waiting after `timeout`; the probe then goes ahead anyway.
+        """
+        give_up = time.monotonic() + timeout
+        while not self.rate_limiter.try_acquire(keys, self.config.ping_count):
+            if time.monotonic() >= give_up:
+                logger.warning(f"Rate limit wait exceeded {timeout}s for on-demand probe on {keys}")
+                return
+            time.sleep(min(0.1, self.rate_limiter.wait_time(keys, self.config.ping_count) or 0.01))
+
+    def probe_entity_now(self, entity_id: str) -> Optional[Dict]:
+        """Probe one entity immediately, outside the cycle schedule"""
+        entity = self.entities_by_id.get(entity_id)
+        if not entity:
+            return None
+        self.acquire_probe_tokens(tuple(self.rate_limiter.keys_for(entity)))
+        # Judged against the baselines, but only the cycle's samples train them
+        result = self.ping_entity(entity, learn=False)
+        if result:
+            self.latest_results[entity_id] = (time.time(), result)
+        return result
+
+    def probe_ip_now(self, ip_address: str) -> Dict:
+        """Probe an arbitrary address immediately and return a result row for it"""
+        self.acquire_probe_tokens(self.rate_limit_keys(ip_address))
+        result = self.probe(ip_address)
+        return {
+            'ip_address': ip_address,
+            'status': result.status,
+            'response_time_ms': result.response_time_ms,
+            'packet_loss': result.packet_loss,
+            'min_rtt': result.min_rtt,
+            'max_rtt': result.max_rtt,
+            'avg_rtt': result.avg_rtt,
+            'error_message': result.error_message,
+            'timestamp': datetime.utcnow().isoformat() + 'Z'
+        }
+
+    def request_entity_refresh(self):
+        """Refetch the entity list at the start of the next cycle"""
+        self.last_entity_refresh = 0
+
+    def pause_entity(self, entity_id: str, duration_seconds: float):
+        """Stop probing an entity for a while; a duration of 0 resumes it"""
+        if duration_seconds > 0:
+            self.paused_until[entity_id] = time.time() + duration_seconds
+            logger.info(f"Paused probing of {entity_id} for {duration_seconds}s")
+        else:
+            self.paused_until.pop(entity_id, None)
+            logger.info(f"Resumed probing of {entity_id}")
+
+    def paused_entities(self) -> set:
+        now = time.time()
+        for entity_id in [i for i, until in list(self.paused_until.items()) if until <= now]:
+            del self.paused_until[entity_id]
+        return set(self.paused_until)
+
+    def start_command_channel(self):
+        """Start long-polling the Helpdesk for commands if enabled in config.json"""
+        if not self.config.command_channel_enabled:
+            return
+        self.command_channel = CommandChannel(self)
+        self.command_channel.start()
+
+    def start_history_store(self):
+        """Start recording results to the local SQLite history if enabled in config.json"""
+        if not self.config.history_enabled:
+            return
+        self.history = HistoryStore(
+            self.config.history_path,
+            retention_days=self.config.history_retention_days,
+            batch_size=self.config.history_batch_size,
+            flush_interval=self.config.history_flush_interval
+        )
+        self.history.start()
+
+    def start_exporter(self):
+        """Start exporting results as hourly Parquet files if enabled in config.json"""
+        if not self.config.export_enabled:
+            return
+        if not PYARROW_AVAILABLE:
+            logger.warning("export_enabled is set but pyarrow is not installed, results are not exported")
+            return
+        self.exporter = ParquetExporter(
+            self.config.export_path,
+            self.config.agent_id,
+            batch_size=self.config.export_batch_size,
+            flush_interval=self.config.export_flush_interval,
+            compression=self.config.export_compression
+        )
+        self.exporter.start()
+
+    def start_capture(self):
+        """Start recording each cycle's entities and probe outcomes if enabled in config.json"""
+        if not self.config.capture_enabled:
+            return
+        self.capture = ProbeCapture(self.config.capture_path, self.config.agent_id, self.config.capture_max_mb)
+        try:
+            self.capture.start()
+        except OSError as e:
+            logger.error(f"Cannot capture probe cycles to {self.config.capture_path}: {e}")
+            self.capture = None
+
+    def start_snmp_collector(self):
+        """Start polling branch routers over SNMP if enabled in config.json"""
+        if not self.config.snmp_enabled:
+            return
+        self.snmp = SnmpCollector(
+            self.snmp_targets,
+            community=self.config.snmp_community,
+            port=self.config.snmp_port,
+            interval=self.config.snmp_interval,
+            timeout_ms=self.config.snmp_timeout,
+            retries=self.config.snmp_retries,
+            max_concurrent=self.config.snmp_max_concurrent,
+            max_repetitions=self.config.snmp_max_repetitions
+        )
+        self.snmp.start()
+
+    def start_control_api(self):
+        """Start the local control API if enabled in config.json"""
+        if not self.config.control_api_enabled:
+            return
+        bucket = TokenBucket(self.config.control_api_rate, self.config.control_api_burst)
+        self.control_api = ControlApiServer(self, bucket)
+        try:
+            self.control_api.start()
+        except OSError as e:
+            logger.error(f"Could not start control API: {e}")
+            self.control_api = None
+
+    def ping_entities(self, entities: List[Dict], learn: bool = True) -> List[Dict]:
+        """
+        Ping a list of entities concurrently.
+        Entities sharing a primary or backup address are served by a single probe.
+        """
+        results = []
+        entities = [e for e in entities if e.get('ip_address')]
+        if not entities:
+            return results
+
+        self.cycle_shed_ips = set()
+        primary = self.probe_addresses([e['ip_address'] for e in entities])
+
+        shed = [e for e in entities if e['ip_address'] not in primary]
+        self.cycle_shed_ids.update(e.get('id') for e in shed)
+        entities = [e for e in entities if e['ip_address'] in primary]
+
+        needs_backup = [
+            e for e in entities
+            if e.get('backup_ip_address') and primary[e['ip_address']].status in FAILURE_STATUSES
+        ]
+        for entity in needs_backup:
+            logger.info(f"  Primary IP failed for {entity.get('name')}, trying backup IP: {entity['backup_ip_address']}")
+        backup = self.probe_addresses([e['backup_ip_address'] for e in needs_backup])
+        backup_ids = {e.get('id') for e in needs_backup}
+
+        for entity in entities:
+            try:
+                result = self.build_result(
+                    entity,
+                    primary[entity['ip_address']],
+                    backup.get(entity.get('backup_ip_address')) if entity.get('id') in backup_ids else None,
+                    learn
+                )
+                self.record_result(result)
+                results.append(result)
+                status_icon = '✓' if result['status'] in ['ONLINE', 'SLOW'] else '✗'
+                rtt = result.get('response_time_ms')
+                rtt_str = f"{rtt:.1f}ms" if rtt else "N/A"
+                loss = result.get('packet_loss', 100)
+                backup_indicator = " [BACKUP]" if result.get('used_backup') else ""
+                logger.info(f"  {status_icon} [{result['entity_type']}] {entity.get('name', entity.get('id'))} ({result['ip_address']}){backup_indicator}: {result['status']} - RTT: {rtt_str}, Loss: {loss}%")
+            except Exception as e:
+                logger.error(f"Error pinging {entity.get('name', entity.get('id'))}: {e}")
 
         return results
 
-    def send_results(self, results: List[Dict]) -> bool:
-        """Send ping results to Helpdesk API"""
-        if not results:
-            logger.warning("No results to send")
-            return True
+    def build_batches(self, results: List[Dict], group_events: Optional[List[Dict]] = None) -> List[Dict]:
+        """
+        Split results into upload batches of about the current adaptive batch size.
+        All rows of one entity stay in the same batch so the Helpdesk sees its
+        samples in order even when batches are processed concurrently.
+        """
+        by_entity: Dict[str, List[Dict]] = {}
+        for result in results:
+            by_entity.setdefault(result['entity_id'], []).append(result)
+
+        batch_size = self.backpressure.batch_size
+        batches = []
+        current: List[Dict] = []
+        for rows in by_entity.values():
+            if current and len(current) + len(rows) > batch_size:
+                batches.append({'results': current})
+                current = []
+            current.extend(rows)
+        if current or not batches:
+            batches.append({'results': current})
+        if group_events:
+            batches[0]['group_events'] = group_events
+
+        # The batch id doubles as the idempotency key, so retries of the same
+        # batch are recognised by the Helpdesk and never applied twice
+        for batch in batches:
+            with self.batch_sequence_lock:
+                batch['sequence'] = next(self.batch_sequence)
+            batch['boot_id'] = self.boot_id
+            batch['batch_id'] = uuid.uuid4().hex
+        return batches
+
+    def upload_batch(self, batch: Dict) -> bool:
+        """POST one batch of results and group events"""
+        url = f"{self.config.helpdesk_url}/api/monitoring/agent/results"
+        payload = {'agent_id': self.config.agent_id, **batch}
+        headers = dict(self.session.headers)
+        headers['Idempotency-Key'] = batch['batch_id']
+        if self.config.upload_async:
+            headers['Prefer'] = 'respond-async'
+
+        # Honour Retry-After: wait briefly, or leave the batch for the spool
+        delay = self.backpressure.delay()
+        if delay > self.config.upload_max_wait:
+            logger.info(f"Helpdesk asked to back off for {delay:.0f}s, holding batch {batch['sequence']}")
+            return False
+        if delay:
+            time.sleep(delay)
 
+        started = time.monotonic()
         try:
-            url = f"{self.config.helpdesk_url}/api/monitoring/agent/results"
-            payload = {
-                'agent_id': self.config.agent_id,
-                'results': results
-            }
+            response = self.transport.post(url, payload, headers)
+        except TransportError as e:
+            self.backpressure.on_error()
+            logger.error(f"Error sending results: {e}")
+            return False
+        self.backpressure.on_response(response, time.monotonic() - started)
+
+        if response.status_code == 413 and len(batch['results']) > 1:
+            # Rejected before it was applied, so it can be re-split under new batch ids
+            parts = self.build_batches(batch['results'], batch.get('group_events'))
+            logger.warning(f"Batch {batch['sequence']} too large for Helpdesk, resending as {len(parts)} batches")
+            return all([self.upload_batch(part) for part in parts])
+
+        if response.status_code == 202:
+            # Queued by the Helpdesk, confirmed later through the status endpoint
+            with self.pending_lock:
+                self.pending_batches[batch['batch_id']] = (time.monotonic(), batch)
+                # Bounded like the spool; a forgotten batch stays queued on the Helpdesk, only unconfirmed
+                while (len(self.pending_batches) > 1 and sum(len(b['results']) for _, b in self.pending_batches.values())
+                       > self.config.upload_spool_max_results):
+                    self.pending_batches.pop(next(iter(self.pending_batches)))
+            logger.info(f"Batch {batch['sequence']} queued by Helpdesk ({len(batch['results'])} results)")
+            return True
 
-            logger.info(f"Sending {len(results)} results to: {url}")
-            logger.info(f"Payload preview (first 3 results):")
-            for r in results[:3]:
-                logger.info(f"  - {r['entity_type']} {r['entity_id']}: {r['status']} ({r.get('response_time_ms', 'N/A')}ms)")
-            if len(results) > 3:
-                logger.info(f"  ... and {len(results) - 3} more")
-
-            response = self.session.post(url, json=payload, timeout=60)
-
-            logger.info(f"API Response: {response.status_code}")
-            if response.status_code == 200:
-                data = response.json()
-                processed = data.get('processed', 0)
-                errors = data.get('errors', 0)
-                logger.info(f"Results accepted: {processed} processed, {errors} errors")
-                if data.get('error_details'):
-                    for err in data['error_details'][:5]:
-                        logger.warning(f"  Error: {err}")
+        if response.status_code == 200:
+            data = response.json()
+            processed = data.get('processed', 0)
+            errors = data.get('errors', 0)
+            if data.get('duplicate'):
+                logger.info(f"Batch {batch['sequence']} was already applied, skipped by Helpdesk")
                 return True
-            else:
-                logger.error(f"Failed to send results: {response.status_code}")
-                logger.error(f"Response body: {response.text[:500]}")
+            logger.info(f"Batch {batch['sequence']} accepted: {processed} processed, {errors} errors")
+            check = data.get('sequence_check') or {}
+            if check.get('status') in ('gap', 'out_of_order'):
+                logger.warning(f"Helpdesk saw batch {batch['sequence']} {check['status'].replace('_', ' ')}: {check}")
+            if data.get('error_details'):
+                for err in data['error_details'][:5]:
+                    logger.warning(f"  Error: {err}")
+            return True
+
+        logger.error(f"Failed to send results: {response.status_code}")
+        logger.error(f"Response body: {response.text[:500]}")
+        return False
+
+    def upload_batches(self, batches: List[Dict]) -> List[Dict]:
+        """Upload batches with up to upload_pipeline_depth in flight, returning the ones that failed"""
+        if len(batches) == 1:
+            return [] if self.upload_batch(batches[0]) else batches
+
+        depth = min(self.backpressure.pipeline_depth(self.config.upload_pipeline_depth), len(batches))
+        with ThreadPoolExecutor(max_workers=depth, thread_name_prefix='upload') as executor:
+            outcomes = list(executor.map(self.upload_batch, batches))
+        return [batch for batch, ok in zip(batches, outcomes) if not ok]
+
+    def send_results(self, results: List[Dict], group_events: Optional[List[Dict]] = None,
+                     retry: bool = False, confirm: bool = False) -> bool:
+        """
+        Send ping results and outage group events to Helpdesk API, optionally
+        retrying failed batches once. In async upload mode, confirm waits until
+        the Helpdesk has actually applied the batches instead of just queued them.
+        """
+        if not results and not group_events:
+            logger.warning("No results to send")
+            return True
+
+        if self.history:
+            self.history.record(results)
+        if self.exporter:
+            self.exporter.record(results, self.entities_by_id)
+
+        batches = self.build_batches(results, group_events)
+        logger.info(f"Sending {len(results)} results in {len(batches)} batches to: "
+                    f"{self.config.helpdesk_url}/api/monitoring/agent/results")
+        for event in group_events or []:
+            members = len(event['branch_ids']) + len(event['atm_ids'])
+            logger.info(f"  - Group {event['group_type']} {event['group_key']}: {event['status']} ({members} members)")
+        logger.info(f"Payload preview (first 3 results):")
+        for r in results[:3]:
+            logger.info(f"  - {r['entity_type']} {r['entity_id']}: {r['status']} ({r.get('response_time_ms', 'N/A')}ms)")
+        if len(results) > 3:
+            logger.info(f"  ... and {len(results) - 3} more")
+
+        started = time.monotonic()
+        spooled = self.take_spool()
+        if spooled:
+            # Older spooled batches go first so the Helpdesk sees samples in order
+            logger.info(f"Replaying {len(spooled)} spooled batches first")
+            still_failed = self.upload_batches(spooled)
+            if still_failed:
+                self.spool_batches(still_failed + batches)
                 return False
 
-        except requests.RequestException as e:
-            logger.error(f"Error sending results: {e}")
+        failed = self.upload_batches(batches)
+        logger.info(f"Uploaded {len(batches) - len(failed)}/{len(batches)} batches in {time.monotonic() - started:.1f}s "
+                    f"(batch size now {self.backpressure.batch_size})")
+
+        if failed and retry and self.backpressure.delay() <= self.config.upload_max_wait:
+            delay = max(self.config.retry_delay, self.backpressure.delay())
+            logger.info(f"Retrying {len(failed)} failed batches in {delay:.0f} seconds...")
+            time.sleep(delay)
+            failed = self.upload_batches(failed)
+
+        if failed:
+            self.spool_batches(failed)
             return False
 
+        if confirm and self.config.upload_async:
+            return self.confirm_batches([b['batch_id'] for b in batches], self.config.upload_confirm_timeout)
+        return True
+
+    def fetch_batch_statuses(self, batch_ids: List[str]) -> Dict[str, Dict]:
+        """Ask the Helpdesk how queued batches are doing, by batch id"""
+        url = f"{self.config.helpdesk_url}/api/monitoring/agent/results/status"
+        statuses = {}
+        for i in range(0, len(batch_ids), 100):
+            chunk = batch_ids[i:i + 100]
+            try:
+                response = self.session.get(url, params={
+                    'agent_id': self.config.agent_id,
+                    'batch_ids': ','.join(chunk)
+                }, timeout=30)
+            except requests.RequestException as e:
+                logger.warning(f"Batch status check failed: {e}")
+                continue
+            if response.status_code != 200:
+                logger.warning(f"Batch status check failed: {response.status_code} - {response.text[:200]}")
+                continue
+            for entry in response.json().get('batches', []):
+                statuses[entry['batch_id']] = entry
+        return statuses
+
+    def check_pending_batches(self) -> Dict[str, str]:
+        """
+        Settle queued batches: applied ones are forgotten, failed or unknown ones
+        are spooled for an (idempotent) resend. Returns the status seen per batch id.
+        """
+        with self.pending_lock:
+            pending = dict(self.pending_batches)
+        if not pending:
+            return {}
+
+        statuses = self.fetch_batch_statuses(list(pending))
+        seen = {}
+        resend = []
+        for batch_id, (accepted_at, batch) in pending.items():
+            entry = statuses.get(batch_id)
+            if entry is None:
+                continue
+            status = seen[batch_id] = entry.get('status')
+
+            if status == 'COMPLETED':
+                logger.info(f"Queued batch {batch['sequence']} applied: {entry.get('processed', 0)} processed, "
+                            f"{entry.get('errors', 0)} errors")
+            elif status in ('FAILED', 'UNKNOWN'):
+                logger.warning(f"Queued batch {batch['sequence']} {status.lower()} on Helpdesk, resending")
+                resend.append(batch)
+            else:
+                age = time.monotonic() - accepted_at
+                if age > self.config.upload_confirm_timeout:
+                    logger.warning(f"Queued batch {batch['sequence']} still {status} after {age:.0f}s")
+                continue
+
+            with self.pending_lock:
+                self.pending_batches.pop(batch_id, None)
+
+        if resend:
+            self.spool_batches(resend)
+        return seen
+
+    def confirm_batches(self, batch_ids: List[str], timeout: float) -> bool:
+        """Poll until the given queued batches are applied; False on failure or timeout"""
+        deadline = time.monotonic() + timeout
+        with self.pending_lock:
+            # Batches answered with 200 were applied inline already
+            remaining = {b for b in batch_ids if b in self.pending_batches}
+
+        while remaining:
+            statuses = self.check_pending_batches()
+            if any(statuses.get(b) in ('FAILED', 'UNKNOWN') for b in remaining):
+                return False
+            remaining = {b for b in remaining if statuses.get(b) != 'COMPLETED'}
+            if not remaining:
+                break
+            if time.monotonic() >= deadline:
+                logger.warning(f"{len(remaining)} queued batches not confirmed within {timeout:.0f}s")
+                return False
+            time.sleep(self.config.upload_status_poll_interval)
+        return True
+
+    def take_spool(self) -> List[Dict]:
+        with self.spool_lock:
+            batches = list(self.spool)
+            self.spool.clear()
+        return batches
+
+    def spool_batches(self, batches: List[Dict]):
+        """
+        Keep batches the Helpdesk could not take for the next upload, instead of
+        retrying them on our own schedule. The spool holds at most
+        upload_spool_max_results rows; the oldest batches are dropped beyond that.
+        """
+        with self.spool_lock:
+            self.spool.extend(batches)
+            total = sum(len(b['results']) for b in self.spool)
+            dropped = 0
+            while self.spool and total > self.config.upload_spool_max_results:
+                oldest = self.spool.popleft()
+                total -= len(oldest['results'])
+                dropped += len(oldest['results'])
+            self.metrics['spool_dropped_results'] += dropped
+        if dropped:
+            logger.warning(f"Upload spool full, dropped {dropped} oldest results")
+        logger.info(f"Spooled {len(batches)} batches for the next upload ({total} results waiting)")
+
     def run_once(self):
         """Run a single monitoring cycle"""
         # Refresh entities if needed
@@ -370,26 +1954,44 @@ class MonitoringAgent:
             logger.warning("No entities to monitor")
             return
 
+        if self.capture:
+            self.capture.begin_cycle(self.entities)
+
         # Ping all entities
         logger.info(f"Starting ping cycle for {len(self.entities)} entities...")
         start_time = time.time()
         results = self.ping_all_entities()
+        results, group_events = self.correlate_outages(results)
         ping_duration = time.time() - start_time
 
-        # Count statuses
-        online = sum(1 for r in results if r['status'] == 'ONLINE')
-        slow = sum(1 for r in results if r['status'] == 'SLOW')
-        offline = sum(1 for r in results if r['status'] in ['OFFLINE', 'TIMEOUT', 'ERROR'])
+        # Count statuses (latest sample per entity)
+        latest = list({r['entity_id']: r for r in results}.values())
+        online = sum(1 for r in latest if r['status'] == 'ONLINE')
+        slow = sum(1 for r in latest if r['status'] == 'SLOW')
+        offline = sum(1 for r in latest if r['status'] in ['OFFLINE', 'TIMEOUT', 'ERROR'])
 
-        logger.info(f"Ping cycle complete in {ping_duration:.1f}s: {online} online, {slow} slow, {offline} offline")
+        grouped = sum(len(e['branch_ids']) + len(e['atm_ids']) for e in group_events if e['status'] == 'OFFLINE')
+
+        logger.info(f"Ping cycle complete in {ping_duration:.1f}s: {online} online, {slow} slow, {offline} offline, {grouped} in outage groups")
+
+        # Settle batches queued by the Helpdesk in earlier cycles
+        self.check_pending_batches()
+
+        self.attach_diagnostics(results)
+        self.attach_snmp(results)
 
         # Send results to Helpdesk
-        success = self.send_results(results)
+        self.send_results(results, group_events, retry=self.config.retry_on_failure)
 
-        if not success and self.config.retry_on_failure:
-            logger.info(f"Retrying in {self.config.retry_delay} seconds...")
-            time.sleep(self.config.retry_delay)
-            self.send_results(results)
+        # New failures are confirmed only once the cycle is uploaded, so the
+        # re-probe interval never holds back the other rows
+        confirmations = self.confirm_failures(results)
+        if confirmations:
+            self.attach_diagnostics(confirmations)
+            self.send_results(confirmations, retry=self.config.retry_on_failure)
+
+        if self.capture:
+            self.capture.end_cycle()
 
     def run(self):
         """Main run loop"""
@@ -398,23 +2000,35 @@ class MonitoringAgent:
         logger.info(f"Ping interval: {self.config.ping_interval} seconds")
 
         # Initial entity fetch
-        if not self.fetch_entities():
+        if not self.load_initial_entities():
             logger.error("Failed to fetch initial entity list. Check API key and URL.")
             if self.config.retry_on_failure:
                 logger.info("Retrying in 30 seconds...")
                 time.sleep(30)
-                if not self.fetch_entities():
+                if not self.load_initial_entities():
                     logger.error("Failed again. Exiting.")
                     sys.exit(1)
             else:
                 sys.exit(1)
 
-        # Main loop
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self.handle_sighup)
+
+        self.start_history_store()
+        self.start_exporter()
+        self.start_capture()
+        self.start_snmp_collector()
+        self.start_control_api()
+        self.start_command_channel()
+
+        # Main loop - cycles start every ping_interval regardless of how long a cycle took
         while True:
             try:
+                cycle_start = time.monotonic()
                 self.run_once()
-                logger.info(f"Sleeping for {self.config.ping_interval} seconds...")
-                time.sleep(self.config.ping_interval)
+                sleep_time = max(0.0, self.config.ping_interval - (time.monotonic() - cycle_start))
+                logger.info(f"Sleeping for {sleep_time:.1f} seconds...")
+                self.wait_for_next_cycle(cycle_start)
             except KeyboardInterrupt:
                 logger.info("Stopping monitoring agent...")
                 break
@@ -422,9 +2036,142 @@ class MonitoringAgent:
                 logger.error(f"Unexpected error: {e}")
                 time.sleep(10)
 
+        if self.history:
+            self.history.close()
+        if self.exporter:
+            self.exporter.close()
+        if self.capture:
+            self.capture.close()
+        if self.snmp:
+            self.snmp.close()
+
+
+def parse_since(value: str) -> datetime:
+    """A relative age such as 90m, 24h or 7d, or an ISO timestamp (UTC unless given)"""
+    match = re.fullmatch(r'(\d+)([mhd])', value)
+    if match:
+        unit = {'m': 'minutes', 'h': 'hours', 'd': 'days'}[match.group(2)]
+        return datetime.now(timezone.utc) - timedelta(**{unit: int(match.group(1))})
+    moment = datetime.fromisoformat(value.rstrip('Z'))
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+
+def history_command(argv: List[str]):
+    """python agent.py history [config.json] [--entity ID] [--since 24h] ...: query the local history"""
+    parser = argparse.ArgumentParser(prog='agent.py history', description='Query the local result history')
+    parser.add_argument('config', nargs='?', default='config.json', help='agent config file')
+    parser.add_argument('--entity', help='entity id')
+    parser.add_argument('--status', help='only results with this status, e.g. OFFLINE')
+    parser.add_argument('--since', default='24h', help='start: age (90m, 24h, 7d) or ISO timestamp')
+    parser.add_argument('--until', help='end: age or ISO timestamp (default now)')
+    parser.add_argument('--limit', type=int, default=100, help='most recent results to show')
+    parser.add_argument('--json', action='store_true', help='print one JSON object per line')
+    args = parser.parse_args(argv)
+
+    config = Config(args.config)
+    if not os.path.exists(config.history_path):
+        logger.error(f"No history at {config.history_path} (is history_enabled set?)")
+        sys.exit(1)
+
+    store = HistoryStore(config.history_path)
+    results = store.query(
+        entity_id=args.entity,
+        since=parse_since(args.since),
+        until=parse_since(args.until) if args.until else None,
+        status=args.status.upper() if args.status else None,
+        limit=args.limit
+    )
+
+    for result in results:
+        if args.json:
+            print(json.dumps(result))
+            continue
+        rtt = f"{result['response_time_ms']:.0f} ms" if result['response_time_ms'] is not None else '-'
+        loss = f"{result['packet_loss']:.0f}%" if result['packet_loss'] is not None else '-'
+        backup = ' (backup)' if result['used_backup'] else ''
+        print(f"{result['checked_at']}  {result['entity_type'] or '':6} {result['entity_id']}  "
+              f"{result['status']:8} {rtt:>9} {loss:>5}  {result['ip_address'] or ''}{backup}"
+              f"{'  ' + result['error_message'] if result['error_message'] else ''}")
+    if not args.json:
+        print(f"{len(results)} results")
+
+
+def replay_command(argv: List[str]):
+    """python agent.py replay CAPTURE [config.json] [--speed 10] [--helpdesk-url URL]: replay a probe capture"""
+    parser = argparse.ArgumentParser(prog='agent.py replay',
+                                     description='Run captured probe cycles through classification and upload again')
+    parser.add_argument('capture', help='capture file (.ndjson.gz)')
+    parser.add_argument('config', nargs='?', default='config.json', help='agent config file')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='times faster than recorded; all configured durations are compressed alike')
+    parser.add_argument('--helpdesk-url', help='endpoint to upload to instead of helpdesk_url, e.g. a local Helpdesk')
+    parser.add_argument('--api-key', help='API key for that endpoint')
+    parser.add_argument('--cycles', type=int, help='stop after this many cycles')
+    args = parser.parse_args(argv)
+
+    if args.speed <= 0:
+        parser.error('--speed must be positive')
+    if not os.path.exists(args.capture):
+        logger.error(f"No capture at {args.capture}")
+        sys.exit(1)
+
+    config = Config(args.config) if os.path.exists(args.config) else Config(args.config, data={})
+    data = config.scaled(args.speed).data
+    # Nothing but classification, correlation and upload may act on the replayed cycles
+    data.update(capture_enabled=False, diagnostics_enabled=False, control_api_enabled=False,
+                command_channel_enabled=False, history_enabled=False, export_enabled=False, snmp_enabled=False)
+    if args.helpdesk_url:
+        data['helpdesk_url'] = args.helpdesk_url.rstrip('/')
+    if args.api_key:
+        data['api_key'] = args.api_key
+    config = Config(config.config_path, data)
+    try:
+        config.validate()
+    except ValueError as e:
+        logger.error(f"Invalid configuration: {e}")
+        sys.exit(1)
+
+    agent = MonitoringAgent(config)
+    agent.replay = ProbeReplay(args.speed)
+    logger.info(f"Replaying {args.capture} at {args.speed:g}x to {config.helpdesk_url}")
+
+    replay_start = time.monotonic()
+    first_start = None
+    replayed = 0
+    for cycle in read_capture(args.capture):
+        if args.cycles and replayed >= args.cycles:
+            break
+        if first_start is None:
+            first_start = cycle['started_at']
+        # Cycles start as far apart as they were recorded, divided by the speed
+        time.sleep(max(0.0, replay_start + (cycle['started_at'] - first_start) / args.speed - time.monotonic()))
+
+        agent.entities = cycle['entities']
+        agent.build_topology()
+        agent.last_entity_refresh = time.time()
+        agent.replay.begin_cycle(cycle)
+        started = time.monotonic()
+        agent.run_once()
+        replayed += 1
+        recorded = datetime.fromtimestamp(cycle['started_at'], timezone.utc).isoformat().replace('+00:00', 'Z')
+        print(f"cycle {replayed} ({recorded}): {len(cycle['entities'])} entities, {len(cycle['probes'])} probes, "
+              f"replayed in {time.monotonic() - started:.2f}s (recorded {cycle['duration_ms'] / 1000:.1f}s)")
+
+    spooled = sum(len(b['results']) for b in agent.spool)
+    print(f"{replayed} cycles replayed in {time.monotonic() - replay_start:.1f}s: "
+          f"{agent.replay.served} probes served, {agent.replay.repeated} repeated, "
+          f"{agent.replay.missing} not in the capture, {spooled} results left unsent")
+
 
 def main():
     """Main entry point"""
+    if len(sys.argv) > 1 and sys.argv[1] == 'history':
+        history_command(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == 'replay':
+        replay_command(sys.argv[2:])
+        return
+
     print("=" * 60)
     print("Bank SulutGo Network Monitoring Agent")
     print("=" * 60)
@@ -436,6 +2183,12 @@ def main():
 
     config = Config(config_path)
 
+    try:
+        config.validate()
+    except ValueError as e:
+        logger.error(f"Invalid configuration: {e}")
+        sys.exit(1)
+
     # Validate API key
     if config.api_key == 'YOUR_API_KEY_HERE' or not config.api_key:
         logger.error("Please set your API key in config.json")
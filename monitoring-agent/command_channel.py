@@ -0,0 +1,142 @@
+"""
+Command channel for the Network Monitoring Agent
+Long-polls the Helpdesk for re-probe, refresh and pause commands and runs them on the agent
+"""
+
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class CommandChannel:
+    """
+    Background long-poll loop against /api/monitoring/agent/commands.
+    Re-probes run immediately on a small dedicated pool and are uploaded as
+    soon as they finish; every command is acknowledged with its outcome.
+    """
+
+    def __init__(self, agent):
+        self.agent = agent
+        self.stop_event = threading.Event()
+        self.session = requests.Session()
+        self.max_workers = agent.config.command_max_concurrent
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='command')
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"{self.agent.config.helpdesk_url}/api/monitoring/agent/commands"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='command-channel', daemon=True)
+        self.thread.start()
+        logger.info(f"Command channel polling {self.base_url}")
+
+    def stop(self):
+        self.stop_event.set()
+        self.executor.shutdown(wait=False)
+
+    def configure(self, config):
+        """Apply reloaded settings; re-probes already running finish on the old pool"""
+        if config.command_max_concurrent != self.max_workers:
+            old = self.executor
+            self.max_workers = config.command_max_concurrent
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='command')
+            old.shutdown(wait=False)
+
+    def sync_session(self):
+        """Pick up credentials and TLS settings from the agent (they may be reloaded)"""
+        self.session.headers.update(self.agent.session.headers)
+        self.session.verify = self.agent.session.verify
+
+    def poll(self) -> List[Dict]:
+        wait = self.agent.config.command_poll_wait
+        response = self.session.get(
+            self.base_url,
+            params={'agent_id': self.agent.config.agent_id, 'wait': wait},
+            timeout=wait + 15
+        )
+        if response.status_code != 200:
+            raise requests.RequestException(f"{response.status_code} - {response.text[:200]}")
+        return response.json().get('commands', [])
+
+    def acknowledge(self, acks: List[Dict]):
+        if not acks:
+            return
+        try:
+            response = self.session.post(
+                f"{self.base_url}/ack",
+                json={'agent_id': self.agent.config.agent_id, 'acks': acks},
+                timeout=30
+            )
+            if response.status_code != 200:
+                logger.warning(f"Command ack failed: {response.status_code} - {response.text[:200]}")
+        except requests.RequestException as e:
+            logger.warning(f"Command ack failed: {e}")
+
+    def run(self):
+        while not self.stop_event.is_set():
+            self.sync_session()
+            try:
+                commands = self.poll()
+            except (requests.RequestException, ValueError) as e:
+                logger.warning(f"Command poll failed: {e}")
+                self.stop_event.wait(self.agent.config.command_retry_delay)
+                continue
+
+            if commands:
+                logger.info(f"Received {len(commands)} commands from Helpdesk")
+                self.acknowledge(self.execute(commands))
+
+    def execute(self, commands: List[Dict]) -> List[Dict]:
+        """Run a batch of commands, re-probes concurrently, and return their acks"""
+        acks = []
+        reprobes = {}
+
+        for command in commands:
+            command_type = command.get('type')
+            entity_id = command.get('entity_id')
+            payload = command.get('payload') or {}
+
+            if command_type == 'REPROBE':
+                if entity_id in self.agent.entities_by_id:
+                    reprobes[command['id']] = self.executor.submit(self.agent.probe_entity_now, entity_id)
+                else:
+                    acks.append({'id': command['id'], 'status': 'FAILED', 'result': {'error': 'Unknown entity'}})
+            elif command_type == 'REFRESH_ENTITIES':
+                self.agent.request_entity_refresh()
+                acks.append({'id': command['id'], 'status': 'COMPLETED', 'result': {'scheduled': True}})
+            elif command_type == 'PAUSE_ENTITY':
+                duration = payload.get('duration_seconds', 3600)
+                self.agent.pause_entity(entity_id, duration)
+                acks.append({'id': command['id'], 'status': 'COMPLETED', 'result': {'paused_seconds': duration}})
+            else:
+                acks.append({'id': command['id'], 'status': 'FAILED', 'result': {'error': f'Unknown command type: {command_type}'}})
+
+        results = []
+        for command_id, future in reprobes.items():
+            try:
+                result = future.result()
+            except Exception as e:
+                acks.append({'id': command_id, 'status': 'FAILED', 'result': {'error': str(e)}})
+                continue
+            results.append(result)
+            acks.append({'id': command_id, 'status': 'COMPLETED', 'result': {
+                'status': result['status'],
+                'response_time_ms': result['response_time_ms'],
+                'timestamp': result['timestamp']
+            }})
+
+        if results:
+            started = time.time()
+            # Wait until a queued upload is applied so the ack means the Helpdesk has the result
+            self.agent.send_results(results, confirm=True)
+            logger.info(f"Uploaded {len(results)} re-probe results in {time.time() - started:.1f}s")
+
+        return acks
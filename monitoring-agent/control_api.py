@@ -0,0 +1,233 @@
+"""
+Local HTTP control API for the Network Monitoring Agent
+Lets operators probe an entity or IP on demand without waiting for the next cycle
+
+Endpoints (JSON):
+  POST /probe         {"entity_id": "..."} or {"ip": "..."}  probe now (cached for the TTL)
+  GET  /result        ?entity_id=... or ?ip=...              latest known result, never probes
+  POST /probe/batch   {"entity_ids": ["...", ...]}            probe several entities now
+"""
+
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse, parse_qs
+
+logger = logging.getLogger(__name__)
+
+
+class ControlApiHandler(BaseHTTPRequestHandler):
+    """Request handler, dispatching to the owning ControlApiServer"""
+    server_version = 'MonitoringAgentControl/1.0'
+
+    def log_message(self, format, *args):
+        logger.debug(f"Control API {self.address_string()} - {format % args}")
+
+    def send_json(self, status: int, body: Dict, headers: Optional[Dict] = None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_json(self) -> Optional[Dict]:
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return {}
+        try:
+            body = json.loads(self.rfile.read(length))
+        except (ValueError, UnicodeDecodeError):
+            return None
+        return body if isinstance(body, dict) else None
+
+    def authorized(self) -> bool:
+        token = self.server.control.token
+        if not token:
+            return True
+        return self.headers.get('Authorization') == f'Bearer {token}'
+
+    def do_GET(self):
+        if not self.authorized():
+            return self.send_json(401, {'error': 'Unauthorized'})
+        url = urlparse(self.path)
+        if url.path != '/result':
+            return self.send_json(404, {'error': 'Not found'})
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        status, body = self.server.control.get_result(query.get('entity_id'), query.get('ip'))
+        self.send_json(status, body)
+
+    def do_POST(self):
+        if not self.authorized():
+            return self.send_json(401, {'error': 'Unauthorized'})
+        body = self.read_json()
+        if body is None:
+            return self.send_json(400, {'error': 'Request body must be a JSON object'})
+
+        path = urlparse(self.path).path
+        if path == '/probe':
+            status, response = self.server.control.probe(body.get('entity_id'), body.get('ip'))
+        elif path == '/probe/batch':
+            status, response = self.server.control.probe_batch(body.get('entity_ids'))
+        else:
+            status, response = 404, {'error': 'Not found'}
+
+        headers = {}
+        if status == 429:
+            headers['Retry-After'] = str(response.get('retry_after_seconds', 1))
+        self.send_json(status, response, headers)
+
+
+class ControlApiServer:
+    """
+    Runs the control API on a background thread.
+    On-demand probes run on their own small worker pool and draw from a
+    dedicated token bucket, so API traffic cannot starve the regular schedule.
+    Repeated requests for the same target within the cache TTL are answered
+    from cache without probing or spending tokens.
+    """
+
+    def __init__(self, agent, rate_bucket):
+        self.agent = agent
+        self.rate_bucket = rate_bucket
+        self.ip_cache: Dict[str, Tuple[float, Dict]] = {}
+        self.cache_lock = threading.Lock()
+        self.max_workers = agent.config.control_api_max_concurrent
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix='control-api'
+        )
+        self.httpd: Optional[ThreadingHTTPServer] = None
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def token(self) -> str:
+        return self.agent.config.control_api_token
+
+    @property
+    def cache_ttl(self) -> float:
+        return self.agent.config.control_api_cache_ttl
+
+    def start(self):
+        config = self.agent.config
+        self.httpd = ThreadingHTTPServer((config.control_api_host, config.control_api_port), ControlApiHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.control = self
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='control-api', daemon=True)
+        self.thread.start()
+        logger.info(f"Control API listening on http://{config.control_api_host}:{self.httpd.server_port}")
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+        self.executor.shutdown(wait=False)
+
+    def configure(self, config):
+        """Apply reloaded settings; host and port changes need a restart"""
+        self.rate_bucket.configure(config.control_api_rate, config.control_api_burst)
+        if config.control_api_max_concurrent != self.max_workers:
+            old = self.executor
+            self.max_workers = config.control_api_max_concurrent
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix='control-api'
+            )
+            old.shutdown(wait=False)
+
+    def cached(self, entity_id: Optional[str], ip: Optional[str]) -> Optional[Tuple[float, Dict]]:
+        """Latest (timestamp, result) for an entity or address, from cycles or on-demand probes"""
+        if entity_id:
+            return self.agent.latest_results.get(entity_id)
+        with self.cache_lock:
+            return self.ip_cache.get(ip)
+
+    def with_age(self, cached: Tuple[float, Dict], from_cache: bool) -> Dict:
+        checked_at, result = cached
+        age = time.time() - checked_at
+        return {
+            'result': result,
+            'cached': from_cache,
+            'age_seconds': round(age, 1),
+            'stale': age > self.cache_ttl
+        }
+
+    def rate_limited(self, tokens: int = 1) -> Optional[Dict]:
+        if self.rate_bucket.try_acquire(tokens):
+            return None
+        return {
+            'error': 'Rate limit exceeded',
+            'retry_after_seconds': max(1, int(self.rate_bucket.wait_time(tokens) + 0.999))
+        }
+
+    def run_probe(self, entity_id: Optional[str], ip: Optional[str]) -> Optional[Dict]:
+        if entity_id:
+            return self.agent.probe_entity_now(entity_id)
+        result = self.agent.probe_ip_now(ip)
+        now = time.time()
+        with self.cache_lock:
+            # Ad-hoc addresses are not bounded by the entity list, drop expired entries
+            for key in [k for k, (checked_at, _) in self.ip_cache.items() if now - checked_at > self.cache_ttl]:
+                del self.ip_cache[key]
+            self.ip_cache[ip] = (now, result)
+        return result
+
+    def get_result(self, entity_id: Optional[str], ip: Optional[str]) -> Tuple[int, Dict]:
+        if not entity_id and not ip:
+            return 400, {'error': 'entity_id or ip is required'}
+        cached = self.cached(entity_id, ip)
+        if not cached:
+            return 404, {'error': 'No result available'}
+        return 200, self.with_age(cached, True)
+
+    def probe(self, entity_id: Optional[str], ip: Optional[str]) -> Tuple[int, Dict]:
+        if not entity_id and not ip:
+            return 400, {'error': 'entity_id or ip is required'}
+        if entity_id and entity_id not in self.agent.entities_by_id:
+            return 404, {'error': f'Unknown entity: {entity_id}'}
+
+        cached = self.cached(entity_id, ip)
+        if cached and time.time() - cached[0] <= self.cache_ttl:
+            return 200, self.with_age(cached, True)
+
+        limited = self.rate_limited()
+        if limited:
+            return 429, limited
+
+        result = self.executor.submit(self.run_probe, entity_id, ip).result()
+        return 200, {'result': result, 'cached': False, 'age_seconds': 0.0, 'stale': False}
+
+    def probe_batch(self, entity_ids) -> Tuple[int, Dict]:
+        if not isinstance(entity_ids, list) or not all(isinstance(i, str) for i in entity_ids):
+            return 400, {'error': 'entity_ids must be a list of strings'}
+        if len(entity_ids) > self.agent.config.control_api_max_batch:
+            return 400, {'error': f'At most {self.agent.config.control_api_max_batch} entity_ids per batch'}
+
+        responses: Dict[str, Dict] = {}
+        to_probe = []
+        for entity_id in dict.fromkeys(entity_ids):
+            if entity_id not in self.agent.entities_by_id:
+                responses[entity_id] = {'error': 'Unknown entity'}
+                continue
+            cached = self.cached(entity_id, None)
+            if cached and time.time() - cached[0] <= self.cache_ttl:
+                responses[entity_id] = self.with_age(cached, True)
+            else:
+                to_probe.append(entity_id)
+
+        if to_probe:
+            # One token per probe; a batch larger than the burst leaves the bucket in debt
+            limited = self.rate_limited(len(to_probe))
+            if limited:
+                return 429, limited
+            futures = {entity_id: self.executor.submit(self.run_probe, entity_id, None) for entity_id in to_probe}
+            for entity_id, future in futures.items():
+                responses[entity_id] = {'result': future.result(), 'cached': False, 'age_seconds': 0.0, 'stale': False}
+
+        return 200, {'results': responses}
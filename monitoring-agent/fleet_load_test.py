@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""
+Fleet load test for the Helpdesk monitoring API
+Simulates N agents with M entities each against a Helpdesk, every virtual
+agent using the agent's own entity fetch, outage correlation, batching and
+upload code with its own connection pool. Results follow a status mix with
+sticky per-entity states, outage storms take whole vendors down across the
+fleet, and the agents send on an aligned, staggered or random schedule.
+
+Usage:
+    python fleet_load_test.py [config.json] --agents 20 --entities 500 --cycles 5 --interval 60 \\
+        --schedule staggered --storm-cycles 3-4 --report fleet-report.json --label 2.4.0
+
+It reports the ingestion throughput the Helpdesk confirmed (results it says it
+processed) and p50/p95/p99 latency of /api/monitoring/agent/results and
+/entities, and writes them as a JSON report; --baseline prints the change
+against the report of an earlier release.
+
+The entity list is fetched with the config's credentials and split between
+the virtual agents, repeating entities when N x M exceeds it. Results are
+written to the Helpdesk like real ones (they advance the state machine and
+may open incidents), so point it at a staging instance.
+"""
+
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from datetime import datetime
+from typing import Dict, List
+
+from agent import Config, MonitoringAgent, logger
+from load_test import FAILURE_STATUSES, fabricate_row, percentile
+
+
+DEFAULT_STATUS_MIX = 'ONLINE=93,SLOW=4,OFFLINE=2,TIMEOUT=1'
+SCHEDULES = ('aligned', 'staggered', 'random')
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """ONLINE=93,SLOW=4,OFFLINE=2,TIMEOUT=1 as normalised weights"""
+    mix = {}
+    for part in value.split(','):
+        status, _, weight = part.partition('=')
+        mix[status.strip().upper()] = float(weight)
+    total = sum(mix.values())
+    if total <= 0 or any(w < 0 for w in mix.values()):
+        raise argparse.ArgumentTypeError(f"invalid status mix {value!r}")
+    return {status: weight / total for status, weight in mix.items()}
+
+
+def parse_cycles(value: str) -> set:
+    """Cycle numbers like 3-5,8"""
+    cycles = set()
+    for part in filter(None, value.split(',')):
+        first, _, last = part.partition('-')
+        cycles.update(range(int(first), int(last or first) + 1))
+    return cycles
+
+
+def latency_summary(seconds: List[float]) -> Dict:
+    return {
+        'count': len(seconds),
+        'p50': round(percentile(seconds, 50) * 1000, 1),
+        'p95': round(percentile(seconds, 95) * 1000, 1),
+        'p99': round(percentile(seconds, 99) * 1000, 1),
+        'max': round(max(seconds, default=0) * 1000, 1),
+        'mean': round(sum(seconds) / len(seconds) * 1000, 1) if seconds else 0.0
+    }
+
+
+class Recorder:
+    """Every request the virtual agents made, shared between their threads"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (finished at, latency, cycle, status code, rows, processed, errors, duplicate)
+        self.uploads: List[tuple] = []
+        # (latency, ok)
+        self.fetches: List[tuple] = []
+        self.failed_uploads = 0
+
+    def upload(self, *sample):
+        with self.lock:
+            self.uploads.append(sample)
+
+    def upload_failed(self):
+        with self.lock:
+            self.failed_uploads += 1
+
+    def fetch(self, latency: float, ok: bool):
+        with self.lock:
+            self.fetches.append((latency, ok))
+
+
+class RecordingTransport:
+    """Wraps the agent's upload transport to record each response as the Helpdesk sent it"""
+
+    def __init__(self, transport, recorder: Recorder, agent: 'FleetAgent'):
+        self.transport = transport
+        self.recorder = recorder
+        self.agent = agent
+
+    def configure(self, config):
+        self.transport.configure(config)
+
+    def close(self):
+        self.transport.close()
+
+    def post(self, url: str, payload: Dict, headers: Dict):
+        started = time.monotonic()
+        try:
+            response = self.transport.post(url, payload, headers)
+        except Exception:
+            self.recorder.upload_failed()
+            raise
+        finished = time.monotonic()
+
+        processed = errors = 0
+        duplicate = False
+        if response.status_code == 200:
+            try:
+                data = response.json()
+                processed, errors = data.get('processed', 0), data.get('errors', 0)
+                duplicate = bool(data.get('duplicate'))
+            except ValueError:
+                pass
+        self.recorder.upload(finished, finished - started, self.agent.cycle, response.status_code,
+                             len(payload.get('results', [])), processed, errors, duplicate)
+        return response
+
+
+class FleetAgent(MonitoringAgent):
+    """One virtual agent: its slice of the entity list, sticky entity states and recorded requests"""
+
+    def __init__(self, config: Config, recorder: Recorder, offset: int, size: int, seed: int):
+        super().__init__(config)
+        self.recorder = recorder
+        self.transport = RecordingTransport(self.transport, recorder, self)
+        self.offset = offset
+        self.size = size
+        self.rng = random.Random(seed)
+        self.states: Dict[str, str] = {}
+        self.cycle = 0
+
+    def fetch_entities(self, on_page=None) -> bool:
+        started = time.monotonic()
+        ok = super().fetch_entities()
+        self.recorder.fetch(time.monotonic() - started, ok)
+        if ok and self.entities:
+            full = self.entities
+            self.entities = [full[(self.offset + i) % len(full)] for i in range(self.size)]
+            self.build_topology()
+        return ok
+
+    def fabricate_cycle(self, mix: Dict[str, float], churn: float, storm_vendors: set) -> List[Dict]:
+        """
+        One cycle of results: an entity keeps its previous status unless it
+        redraws from the mix (with probability churn), so the mix holds across
+        the fleet without every entity flapping; storm vendors fail outright.
+        Like a real cycle, members of an active outage group are skipped but
+        for the group's rotating sample.
+        """
+        statuses, weights = list(mix), list(mix.values())
+        timestamp = datetime.utcnow().isoformat() + 'Z'
+        skipped = self.collapsed_group_members()
+        results = []
+        for entity in self.entities:
+            if entity['id'] in skipped:
+                continue
+            if entity.get('network_vendor') in storm_vendors:
+                status = self.rng.choice(FAILURE_STATUSES)
+            else:
+                status = self.states.get(entity['id'])
+                if status is None or self.rng.random() < churn:
+                    status = self.rng.choices(statuses, weights)[0]
+                self.states[entity['id']] = status
+
+            if status == 'ONLINE':
+                results.append(fabricate_row(entity, status, round(self.rng.uniform(5, 150), 2), 0.0, timestamp))
+            elif status == 'SLOW':
+                loss = self.rng.choice([0.0, 0.0, 33.3])
+                results.append(fabricate_row(entity, status, round(self.rng.uniform(800, 2500), 2), loss, timestamp))
+            else:
+                results.append(fabricate_row(entity, status, None, 100.0, timestamp))
+        return results
+
+
+def run_agent(agent: FleetAgent, args, start_at: float, storm_vendors: set, errors: List[str]):
+    """Cycle loop of one virtual agent; a cycle that overruns delays the next like in the real agent"""
+    next_start = start_at
+    for cycle in range(1, args.cycles + 1):
+        time.sleep(max(0.0, next_start - time.monotonic()))
+        cycle_start = time.monotonic()
+        agent.cycle = cycle
+        try:
+            refresh = args.entity_refresh_cycles and (cycle - 1) % args.entity_refresh_cycles == 0
+            if cycle == 1 or refresh:
+                agent.fetch_entities()
+            if not agent.entities:
+                errors.append(f"{agent.config.agent_id}: no entities")
+                return
+            results = agent.fabricate_cycle(args.status_mix, args.churn,
+                                            storm_vendors if cycle in args.storm_cycles else set())
+            results, group_events = agent.correlate_outages(results)
+            agent.send_results(results, group_events)
+        except Exception as e:
+            errors.append(f"{agent.config.agent_id} cycle {cycle}: {e}")
+        next_start = max(cycle_start + args.interval, time.monotonic())
+
+
+def build_report(args, recorder: Recorder, elapsed: float, helpdesk_url: str) -> Dict:
+    uploads = recorder.uploads
+    status_codes: Dict[str, int] = {}
+    for sample in uploads:
+        status_codes[str(sample[3])] = status_codes.get(str(sample[3]), 0) + 1
+    processed = sum(s[5] for s in uploads)
+    rows = sum(s[4] for s in uploads)
+
+    # Peak throughput over the busiest second, by response time
+    per_second: Dict[int, int] = {}
+    for sample in uploads:
+        per_second[int(sample[0])] = per_second.get(int(sample[0]), 0) + sample[5]
+
+    cycles = []
+    for cycle in range(1, args.cycles + 1):
+        samples = [s for s in uploads if s[2] == cycle]
+        cycles.append({
+            'cycle': cycle,
+            'storm': cycle in args.storm_cycles,
+            'requests': len(samples),
+            'rows': sum(s[4] for s in samples),
+            'processed': sum(s[5] for s in samples),
+            'latency_ms': latency_summary([s[1] for s in samples])
+        })
+
+    fetches = recorder.fetches
+    return {
+        'label': args.label,
+        'generated_at': datetime.utcnow().isoformat() + 'Z',
+        'helpdesk_url': helpdesk_url,
+        'parameters': {
+            'agents': args.agents,
+            'entities_per_agent': args.entities,
+            'cycles': args.cycles,
+            'interval_seconds': args.interval,
+            'schedule': args.schedule,
+            'status_mix': args.status_mix,
+            'churn': args.churn,
+            'storm_cycles': sorted(args.storm_cycles),
+            'storm_ratio': args.storm_ratio,
+            'seed': args.seed
+        },
+        'duration_seconds': round(elapsed, 2),
+        'results_api': {
+            'requests': len(uploads),
+            'failed_requests': recorder.failed_uploads,
+            'status_codes': status_codes,
+            'rows_sent': rows,
+            'processed': processed,
+            'errors': sum(s[6] for s in uploads),
+            'duplicates': sum(1 for s in uploads if s[7]),
+            'latency_ms': latency_summary([s[1] for s in uploads]),
+            'throughput': {
+                'processed_per_second': round(processed / elapsed, 1) if elapsed else 0.0,
+                'sent_per_second': round(rows / elapsed, 1) if elapsed else 0.0,
+                'peak_processed_per_second': max(per_second.values(), default=0)
+            }
+        },
+        'entities_api': {
+            'requests': len(fetches),
+            'failed_requests': sum(1 for f in fetches if not f[1]),
+            'latency_ms': latency_summary([f[0] for f in fetches])
+        },
+        'cycles': cycles
+    }
+
+
+# Report fields compared against a baseline: (path, higher is better)
+COMPARED = [
+    (('results_api', 'throughput', 'processed_per_second'), True),
+    (('results_api', 'throughput', 'peak_processed_per_second'), True),
+    (('results_api', 'latency_ms', 'p50'), False),
+    (('results_api', 'latency_ms', 'p95'), False),
+    (('results_api', 'latency_ms', 'p99'), False),
+    (('entities_api', 'latency_ms', 'p50'), False),
+    (('entities_api', 'latency_ms', 'p95'), False),
+    (('entities_api', 'latency_ms', 'p99'), False),
+]
+
+
+def print_comparison(report: Dict, baseline: Dict):
+    print(f"\nagainst {baseline.get('label') or 'baseline'} ({baseline.get('generated_at')}):")
+    if baseline.get('parameters') != report['parameters']:
+        print("  note: load parameters differ from the baseline")
+    for path, higher_is_better in COMPARED:
+        old, new = baseline, report
+        for key in path:
+            old, new = (old or {}).get(key), (new or {}).get(key)
+        if not isinstance(old, (int, float)) or not isinstance(new, (int, float)):
+            continue
+        change = (new - old) / old * 100 if old else 0.0
+        worse = change < 0 if higher_is_better else change > 0
+        print(f"  {'.'.join(path):45} {old:>10} -> {new:>10} ({change:+.1f}%{' worse' if worse and change else ''})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the Helpdesk with a fleet of virtual agents')
+    parser.add_argument('config', nargs='?', default='config.json')
+    parser.add_argument('--agents', type=int, default=10, help='virtual agents')
+    parser.add_argument('--entities', type=int, default=500, help='entities per agent')
+    parser.add_argument('--cycles', type=int, default=5, help='cycles each agent runs')
+    parser.add_argument('--interval', type=float, default=60, help='seconds between an agent\'s cycles')
+    parser.add_argument('--schedule', choices=SCHEDULES, default='staggered',
+                        help='aligned: all agents send at once; staggered: spread evenly; random: random offsets')
+    parser.add_argument('--status-mix', type=parse_mix, default=parse_mix(DEFAULT_STATUS_MIX),
+                        help=f'status weights (default {DEFAULT_STATUS_MIX})')
+    parser.add_argument('--churn', type=float, default=0.05, help='chance an entity redraws its status each cycle')
+    parser.add_argument('--storm-cycles', type=parse_cycles, default=set(), help='cycles with an outage storm, e.g. 3-4')
+    parser.add_argument('--storm-ratio', type=float, default=0.3, help='share of vendors down in a storm')
+    parser.add_argument('--entity-refresh-cycles', type=int, default=0,
+                        help='refetch the entity list every this many cycles (default: only at start)')
+    parser.add_argument('--seed', type=int, default=1, help='random seed')
+    parser.add_argument('--label', default='', help='release or build name stored in the report')
+    parser.add_argument('--report', default='fleet-report.json', help='JSON report to write')
+    parser.add_argument('--baseline', help='earlier report to compare against')
+    parser.add_argument('--verbose', action='store_true', help='log every upload like a real agent')
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    config = Config(args.config)
+    config.validate()
+
+    rng = random.Random(args.seed)
+    recorder = Recorder()
+    # The full list, for sizing the slices and picking storm vendors
+    lister = MonitoringAgent(config)
+    if not lister.fetch_entities() or not lister.entities:
+        logger.error("No entities available, cannot build a fleet")
+        sys.exit(1)
+    full = lister.entities
+    vendors = sorted({e.get('network_vendor') for e in full if e.get('network_vendor')})
+    storm_vendors = set(rng.sample(vendors, max(1, round(len(vendors) * args.storm_ratio)))) if vendors else set()
+    if args.storm_cycles and not storm_vendors:
+        logger.warning("Entities carry no network_vendor, storms will have no effect")
+
+    agents = []
+    for i in range(args.agents):
+        agent_config = Config(config.config_path, data=dict(config.data, agent_id=f"{config.agent_id}-fleet-{i + 1:03d}"))
+        agents.append(FleetAgent(agent_config, recorder, (i * args.entities) % len(full), args.entities, args.seed + i))
+
+    print(f"Fleet load test: {args.agents} agents x {args.entities} entities ({len(full)} distinct), "
+          f"{args.cycles} cycles every {args.interval:g}s, {args.schedule} schedule"
+          f"{f', storms in cycles {sorted(args.storm_cycles)} on {len(storm_vendors)}/{len(vendors)} vendors' if args.storm_cycles else ''}")
+
+    started = time.monotonic()
+    errors: List[str] = []
+    threads = []
+    for i, agent in enumerate(agents):
+        if args.schedule == 'aligned':
+            offset = 0.0
+        elif args.schedule == 'staggered':
+            offset = args.interval * i / args.agents
+        else:
+            offset = rng.uniform(0, args.interval)
+        thread = threading.Thread(target=run_agent, name=agent.config.agent_id,
+                                  args=(agent, args, started + offset, storm_vendors, errors), daemon=True)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    report = build_report(args, recorder, elapsed, config.helpdesk_url)
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    results_api, entities_api = report['results_api'], report['entities_api']
+    for cycle in report['cycles']:
+        print(f"cycle {cycle['cycle']}{' (storm)' if cycle['storm'] else ''}: {cycle['rows']} rows in "
+              f"{cycle['requests']} requests, {cycle['processed']} processed, "
+              f"p95 {cycle['latency_ms']['p95']:.0f} ms")
+    print(f"results: {results_api['requests']} requests {results_api['status_codes']}, "
+          f"{results_api['failed_requests']} failed, {results_api['processed']}/{results_api['rows_sent']} "
+          f"rows processed, {results_api['errors']} errors, {results_api['duplicates']} duplicates")
+    print(f"  throughput {results_api['throughput']['processed_per_second']:.0f}/s processed "
+          f"(peak {results_api['throughput']['peak_processed_per_second']}/s), latency p50 "
+          f"{results_api['latency_ms']['p50']:.0f} ms p95 {results_api['latency_ms']['p95']:.0f} ms "
+          f"p99 {results_api['latency_ms']['p99']:.0f} ms")
+    print(f"entities: {entities_api['requests']} fetches ({entities_api['failed_requests']} failed), latency p50 "
+          f"{entities_api['latency_ms']['p50']:.0f} ms p95 {entities_api['latency_ms']['p95']:.0f} ms "
+          f"p99 {entities_api['latency_ms']['p99']:.0f} ms")
+    for error in errors[:10]:
+        print(f"error: {error}")
+    print(f"report written to {args.report}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            print_comparison(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+"""
+Local result history for the Network Monitoring Agent
+An embedded SQLite database (WAL mode) with one table per UTC day. Results are
+queued by the threads producing them and written in batches by a single writer
+thread, so recording adds no latency to probing; days past the retention are
+dropped whole.
+"""
+
+import re
+import time
+import queue
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Day tables are named results_YYYYMMDD
+PARTITION_RE = re.compile(r'^results_(\d{8})$')
+
+COLUMNS = ('checked_at', 'entity_type', 'entity_id', 'ip_address', 'used_backup', 'status',
+           'response_time_ms', 'packet_loss', 'min_rtt', 'max_rtt', 'avg_rtt', 'error_message')
+
+# How often the writer looks for day tables past the retention
+RETENTION_CHECK_SECONDS = 3600
+
+
+def partition_name(day: datetime) -> str:
+    return f"results_{day.strftime('%Y%m%d')}"
+
+
+def parse_timestamp(value: str) -> datetime:
+    """Result timestamps are naive UTC ISO strings with a trailing Z"""
+    return datetime.fromisoformat(value.rstrip('Z')).replace(tzinfo=timezone.utc)
+
+
+def to_millis(moment: datetime) -> int:
+    return int(moment.timestamp() * 1000)
+
+
+class HistoryStore:
+    """Batched, day-partitioned SQLite store of probe results"""
+
+    def __init__(self, path: str, retention_days: int = 14, batch_size: int = 500,
+                 flush_interval: float = 2.0, max_queued: int = 50000):
+        self.path = path
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue: queue.Queue = queue.Queue(maxsize=max_queued)
+        self.dropped = 0
+        self.written = 0
+        self.stopping = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.partitions: set = set()
+
+    def connect(self, readonly: bool = False) -> sqlite3.Connection:
+        if readonly:
+            return sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, timeout=30)
+        conn = sqlite3.connect(self.path, timeout=30)
+        # auto_vacuum only takes effect on a new database, before the first table
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='history-writer', daemon=True)
+        self.thread.start()
+        logger.info(f"Recording result history to {self.path} ({self.retention_days} days)")
+
+    def close(self, timeout: float = 10.0):
+        """Write out whatever is queued and stop the writer"""
+        self.stopping.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def record(self, results: List[Dict]):
+        """Queue results for the writer; never blocks, drops results when the queue is full"""
+        for result in results:
+            try:
+                self.queue.put_nowait(result)
+            except queue.Full:
+                self.dropped += 1
+
+    def take_batch(self) -> List[Dict]:
+        batch: List[Dict] = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if self.stopping.is_set():
+                remaining = 0
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        conn = self.connect()
+        last_retention = 0.0
+        try:
+            while not (self.stopping.is_set() and self.queue.empty()):
+                batch = self.take_batch()
+                if batch:
+                    try:
+                        self.write(conn, batch)
+                    except sqlite3.Error as e:
+                        logger.error(f"Failed to write {len(batch)} results to history: {e}")
+                if time.monotonic() - last_retention > RETENTION_CHECK_SECONDS:
+                    last_retention = time.monotonic()
+                    try:
+                        self.apply_retention(conn)
+                    except sqlite3.Error as e:
+                        logger.error(f"History retention failed: {e}")
+        finally:
+            conn.close()
+
+    def ensure_partition(self, conn: sqlite3.Connection, name: str):
+        if name in self.partitions:
+            return
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {name} (
+                checked_at INTEGER NOT NULL,
+                entity_type TEXT,
+                entity_id TEXT NOT NULL,
+                ip_address TEXT,
+                used_backup INTEGER,
+                status TEXT,
+                response_time_ms REAL,
+                packet_loss REAL,
+                min_rtt REAL,
+                max_rtt REAL,
+                avg_rtt REAL,
+                error_message TEXT
+            )""")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name}_entity ON {name} (entity_id, checked_at)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name}_time ON {name} (checked_at)")
+        self.partitions.add(name)
+
+    def write(self, conn: sqlite3.Connection, batch: List[Dict]):
+        """Insert a batch in one transaction, each row into its day's table"""
+        rows: Dict[str, List[tuple]] = {}
+        for result in batch:
+            try:
+                checked_at = parse_timestamp(result['timestamp'])
+            except (KeyError, TypeError, ValueError):
+                checked_at = datetime.now(timezone.utc)
+            rows.setdefault(partition_name(checked_at), []).append((
+                to_millis(checked_at),
+                result.get('entity_type'),
+                result.get('entity_id'),
+                result.get('ip_address'),
+                1 if result.get('used_backup') else 0,
+                result.get('status'),
+                result.get('response_time_ms'),
+                result.get('packet_loss'),
+                result.get('min_rtt'),
+                result.get('max_rtt'),
+                result.get('avg_rtt'),
+                result.get('error_message')
+            ))
+
+        placeholders = ', '.join('?' for _ in COLUMNS)
+        with conn:
+            for name, values in rows.items():
+                self.ensure_partition(conn, name)
+                conn.executemany(f"INSERT INTO {name} ({', '.join(COLUMNS)}) VALUES ({placeholders})", values)
+        self.written += len(batch)
+
+    def list_partitions(self, conn: sqlite3.Connection) -> List[str]:
+        names = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        return sorted(name for name in names if PARTITION_RE.match(name))
+
+    def apply_retention(self, conn: sqlite3.Connection):
+        """Drop day tables older than retention_days and give the space back"""
+        oldest_kept = partition_name(datetime.now(timezone.utc) - timedelta(days=self.retention_days))
+        expired = [name for name in self.list_partitions(conn) if name < oldest_kept]
+        if not expired:
+            return
+        with conn:
+            for name in expired:
+                conn.execute(f"DROP TABLE IF EXISTS {name}")
+                self.partitions.discard(name)
+        conn.execute('PRAGMA incremental_vacuum')
+        logger.info(f"Dropped {len(expired)} history days past the {self.retention_days}-day retention")
+
+    def query(self, entity_id: Optional[str] = None, since: Optional[datetime] = None,
+              until: Optional[datetime] = None, status: Optional[str] = None,
+              limit: int = 100) -> List[Dict]:
+        """
+        Results between since and until (default: the last day), newest
+        first, optionally for one entity and/or status. Only the day tables
+        overlapping the range are read, through their indexes.
+        """
+        until = until or datetime.now(timezone.utc)
+        since = since or until - timedelta(days=1)
+
+        conn = self.connect(readonly=True)
+        try:
+            first, last = partition_name(since), partition_name(until)
+            names = [name for name in self.list_partitions(conn) if first <= name <= last]
+            if not names:
+                return []
+
+            conditions = ['checked_at >= ?', 'checked_at < ?']
+            params: List = [to_millis(since), to_millis(until)]
+            if entity_id:
+                conditions.append('entity_id = ?')
+                params.append(entity_id)
+            if status:
+                conditions.append('status = ?')
+                params.append(status)
+            where = ' AND '.join(conditions)
+
+            sql = ' UNION ALL '.join(f"SELECT {', '.join(COLUMNS)} FROM {name} WHERE {where}" for name in names)
+            rows = conn.execute(f"{sql} ORDER BY checked_at DESC LIMIT ?", params * len(names) + [limit])
+
+            results = []
+            for row in rows:
+                result = dict(zip(COLUMNS, row))
+                result['checked_at'] = datetime.fromtimestamp(
+                    result['checked_at'] / 1000, timezone.utc).isoformat().replace('+00:00', 'Z')
+                result['used_backup'] = bool(result['used_backup'])
+                results.append(result)
+            return results
+        finally:
+            conn.close()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Load test for the Helpdesk result ingestion endpoint
+Fetches the real entity list with the agent's credentials, fabricates ping
+results for it and uploads them through the agent's own batching, pipelining
+and backpressure code, reporting throughput and per-batch latency.
+
+Usage:
+    python load_test.py [config.json] --cycles 5 --rows 5000 --failure-ratio 0.05
+
+Results are written to the Helpdesk like real ones (they advance the state
+machine and may open incidents), so point it at a staging instance.
+"""
+
+import sys
+import time
+import random
+import argparse
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from agent import Config, MonitoringAgent, logger
+
+
+FAILURE_STATUSES = ['OFFLINE', 'TIMEOUT']
+
+
+def fabricate_row(entity: Dict, status: str, rtt: Optional[float], packet_loss: float, timestamp: str) -> Dict:
+    """One result row in the agent's upload format"""
+    failed = status in FAILURE_STATUSES
+    return {
+        'entity_type': entity['type'],
+        'entity_id': entity['id'],
+        'ip_address': entity['ip_address'],
+        'primary_ip': entity['ip_address'],
+        'backup_ip': None,
+        'used_backup': False,
+        'status': status,
+        'response_time_ms': int(rtt) if rtt else None,
+        'packet_loss': packet_loss,
+        'min_rtt': rtt,
+        'max_rtt': rtt,
+        'avg_rtt': rtt,
+        'error_message': 'Load test failure' if failed else None,
+        'timestamp': timestamp
+    }
+
+
+def fabricate_results(entities: List[Dict], rows: int, failure_ratio: float) -> List[Dict]:
+    """Build `rows` results by cycling through the entities, repeating them if there are fewer"""
+    results = []
+    timestamp = datetime.utcnow().isoformat() + 'Z'
+    for i in range(rows):
+        entity = entities[i % len(entities)]
+        if random.random() < failure_ratio:
+            results.append(fabricate_row(entity, random.choice(FAILURE_STATUSES), None, 100.0, timestamp))
+        else:
+            results.append(fabricate_row(entity, 'ONLINE', round(random.uniform(5, 150), 2), 0.0, timestamp))
+    return results
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+class TimedAgent(MonitoringAgent):
+    """MonitoringAgent recording the latency and outcome of every batch upload"""
+
+    def __init__(self, config: Config):
+        super().__init__(config)
+        self.samples: List[tuple] = []
+        self.samples_lock = threading.Lock()
+
+    def upload_batch(self, batch: Dict) -> bool:
+        started = time.monotonic()
+        ok = super().upload_batch(batch)
+        with self.samples_lock:
+            self.samples.append((time.monotonic() - started, len(batch['results']), ok))
+        return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the Helpdesk result ingestion endpoint')
+    parser.add_argument('config', nargs='?', default='config.json')
+    parser.add_argument('--cycles', type=int, default=3, help='upload cycles to run')
+    parser.add_argument('--rows', type=int, default=5000, help='results per cycle')
+    parser.add_argument('--failure-ratio', type=float, default=0.05, help='share of failed results')
+    parser.add_argument('--batch-size', type=int, help='override upload_batch_size')
+    parser.add_argument('--depth', type=int, help='override upload_pipeline_depth')
+    parser.add_argument('--interval', type=float, default=0, help='seconds between cycle starts')
+    args = parser.parse_args()
+
+    config = Config(args.config)
+    if args.batch_size:
+        config.data['upload_batch_size'] = args.batch_size
+    if args.depth:
+        config.data['upload_pipeline_depth'] = args.depth
+        config.data['upload_pool_size'] = max(config.upload_pool_size, args.depth)
+    config.validate()
+
+    agent = TimedAgent(config)
+    if not agent.fetch_entities() or not agent.entities:
+        logger.error("No entities available, cannot build a load")
+        sys.exit(1)
+
+    print(f"Load test: {args.cycles} cycles x {args.rows} results over {len(agent.entities)} entities, "
+          f"batch size {config.upload_batch_size}, pipeline depth {config.upload_pipeline_depth}")
+
+    totals = []
+    for cycle in range(1, args.cycles + 1):
+        cycle_start = time.monotonic()
+        agent.samples.clear()
+        results = fabricate_results(agent.entities, args.rows, args.failure_ratio)
+        ok = agent.send_results(results)
+        elapsed = time.monotonic() - cycle_start
+
+        latencies = [s[0] for s in agent.samples]
+        failed = sum(1 for s in agent.samples if not s[2])
+        totals.append((args.rows, elapsed))
+        print(f"cycle {cycle}: {'ok' if ok else 'INCOMPLETE'} {args.rows} results in {elapsed:.2f}s "
+              f"({args.rows / elapsed:.0f}/s), {len(agent.samples)} batches ({failed} failed), "
+              f"batch latency p50 {percentile(latencies, 50):.2f}s p95 {percentile(latencies, 95):.2f}s "
+              f"max {max(latencies, default=0):.2f}s, next batch size {agent.backpressure.batch_size}, "
+              f"spooled {sum(len(b['results']) for b in agent.spool)}")
+
+        if args.interval and cycle < args.cycles:
+            time.sleep(max(0.0, args.interval - elapsed))
+
+    rows = sum(t[0] for t in totals)
+    seconds = sum(t[1] for t in totals)
+    print(f"total: {rows} results in {seconds:.2f}s ({rows / seconds:.0f}/s)")
+
+
+if __name__ == '__main__':
+    main()
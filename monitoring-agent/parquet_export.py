@@ -0,0 +1,195 @@
+"""
+Parquet export for the Network Monitoring Agent
+Streams probe results into hourly Parquet files laid out as
+<export_path>/date=YYYY-MM-DD/hour=HH/*.parquet, which pandas and DuckDB read
+directly (hive partitioning). Entity, vendor and other repeating text columns
+are dictionary-encoded and RTT columns are typed floats. Rows are written as
+row groups by a background thread, so at most one batch per open hour is held
+in memory; a file only gets its .parquet name once its hour is closed.
+"""
+
+import os
+import time
+import uuid
+import queue
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    pa = None
+    pq = None
+    PYARROW_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Text columns repeating across rows, stored dictionary-encoded
+DICTIONARY_COLUMNS = ('entity_type', 'entity_id', 'entity_code', 'network_media', 'network_vendor',
+                      'ip_address', 'status')
+FLOAT_COLUMNS = ('response_time_ms', 'packet_loss', 'min_rtt', 'max_rtt', 'avg_rtt')
+
+# An hour's file stays open this long after the hour ends for results still arriving
+CLOSE_GRACE_SECONDS = 120
+
+
+def export_schema():
+    text = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema(
+        [pa.field('checked_at', pa.timestamp('ms', tz='UTC'))] +
+        [pa.field(name, text) for name in DICTIONARY_COLUMNS] +
+        [pa.field('used_backup', pa.bool_())] +
+        [pa.field(name, pa.float64()) for name in FLOAT_COLUMNS] +
+        [pa.field('error_message', pa.string())]
+    )
+
+
+def checked_at(result: Dict) -> Optional[datetime]:
+    """Result timestamps are naive UTC ISO strings with a trailing Z"""
+    try:
+        return datetime.fromisoformat(result['timestamp'].rstrip('Z')).replace(tzinfo=timezone.utc)
+    except (KeyError, AttributeError, ValueError):
+        return None
+
+
+def hour_of(result: Dict) -> datetime:
+    moment = checked_at(result) or datetime.now(timezone.utc)
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+class HourFile:
+    """One Parquet file being written for an hour, renamed into place on close"""
+
+    def __init__(self, directory: str, agent_id: str, hour: datetime, schema, compression: str):
+        partition = os.path.join(directory, f"date={hour:%Y-%m-%d}", f"hour={hour:%H}")
+        os.makedirs(partition, exist_ok=True)
+        self.hour = hour
+        self.path = os.path.join(partition, f"{agent_id}-{hour:%Y%m%dT%H}-{uuid.uuid4().hex[:8]}.parquet")
+        self.writer = pq.ParquetWriter(self.path + '.tmp', schema, compression=compression)
+        self.rows = 0
+
+    def write(self, table):
+        self.writer.write_table(table)
+        self.rows += table.num_rows
+
+    def close(self):
+        self.writer.close()
+        os.replace(self.path + '.tmp', self.path)
+
+
+class ParquetExporter:
+    """Batched, hour-partitioned Parquet writer fed from the upload path"""
+
+    def __init__(self, directory: str, agent_id: str, batch_size: int = 5000,
+                 flush_interval: float = 300.0, compression: str = 'zstd', max_queued: int = 100000):
+        self.directory = directory
+        self.agent_id = agent_id
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.compression = compression
+        self.queue: queue.Queue = queue.Queue(maxsize=max_queued)
+        self.dropped = 0
+        self.written = 0
+        self.stopping = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.schema = export_schema()
+        # Normally only the current hour is open, plus the previous one during its grace period
+        self.files: Dict[datetime, HourFile] = {}
+        self.buffers: Dict[datetime, List[Dict]] = {}
+        self.last_flush = time.monotonic()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='parquet-export', daemon=True)
+        self.thread.start()
+        logger.info(f"Exporting results as hourly Parquet files to {self.directory}")
+
+    def close(self, timeout: float = 30.0):
+        """Write out whatever is queued, close the open hours and stop"""
+        self.stopping.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def record(self, results: List[Dict], entities_by_id: Dict[str, Dict]):
+        """Queue results with their entity attributes; never blocks, drops rows when the queue is full"""
+        for result in results:
+            entity = entities_by_id.get(result.get('entity_id')) or {}
+            row = dict(result,
+                       entity_code=entity.get('code'),
+                       network_media=entity.get('network_media'),
+                       network_vendor=entity.get('network_vendor'))
+            try:
+                self.queue.put_nowait(row)
+            except queue.Full:
+                self.dropped += 1
+
+    def run(self):
+        try:
+            while not (self.stopping.is_set() and self.queue.empty()):
+                try:
+                    row = self.queue.get(timeout=0 if self.stopping.is_set() else 1.0)
+                    hour = hour_of(row)
+                    buffer = self.buffers.setdefault(hour, [])
+                    buffer.append(row)
+                    if len(buffer) >= self.batch_size:
+                        self.flush(hour)
+                except queue.Empty:
+                    pass
+
+                if time.monotonic() - self.last_flush >= self.flush_interval:
+                    self.last_flush = time.monotonic()
+                    for hour in list(self.buffers):
+                        self.flush(hour)
+                    self.close_finished_hours()
+        except Exception as e:
+            logger.error(f"Parquet export stopped: {e}")
+        finally:
+            for hour in list(self.buffers):
+                self.flush(hour)
+            for hour in list(self.files):
+                self.close_hour(hour)
+
+    def flush(self, hour: datetime):
+        """Write an hour's buffered rows as one row group of its file"""
+        rows = self.buffers.pop(hour, None)
+        if not rows:
+            return
+        try:
+            if hour not in self.files:
+                self.files[hour] = HourFile(self.directory, self.agent_id, hour, self.schema, self.compression)
+            self.files[hour].write(self.to_table(rows))
+            self.written += len(rows)
+        except (OSError, pa.ArrowException) as e:
+            logger.error(f"Failed to export {len(rows)} results: {e}")
+
+    def close_finished_hours(self):
+        """Close hours that ended more than CLOSE_GRACE_SECONDS ago; later stragglers get a new file"""
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=1, seconds=CLOSE_GRACE_SECONDS)
+        for hour in [h for h in set(self.files) | set(self.buffers) if h <= cutoff]:
+            self.flush(hour)
+            self.close_hour(hour)
+
+    def close_hour(self, hour: datetime):
+        hour_file = self.files.pop(hour, None)
+        if hour_file is None:
+            return
+        try:
+            hour_file.close()
+            logger.info(f"Exported {hour_file.rows} results to {hour_file.path}")
+        except (OSError, pa.ArrowException) as e:
+            logger.error(f"Failed to close export file {hour_file.path}: {e}")
+
+    def to_table(self, rows: List[Dict]):
+        columns = {
+            'checked_at': pa.array([checked_at(r) for r in rows], type=pa.timestamp('ms', tz='UTC'))
+        }
+        for name in DICTIONARY_COLUMNS:
+            columns[name] = pa.array([r.get(name) for r in rows], type=pa.string()).dictionary_encode()
+        columns['used_backup'] = pa.array([bool(r.get('used_backup')) for r in rows], type=pa.bool_())
+        for name in FLOAT_COLUMNS:
+            columns[name] = pa.array([r.get(name) for r in rows], type=pa.float64())
+        columns['error_message'] = pa.array([r.get('error_message') for r in rows], type=pa.string())
+        return pa.table(columns, schema=self.schema)
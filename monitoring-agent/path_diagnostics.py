@@ -0,0 +1,150 @@
+"""
+Path diagnostics for the Network Monitoring Agent
+Traceroute-style TTL-stepped probes run in the background when an entity goes DOWN or comes back UP
+"""
+
+import re
+import time
+import logging
+import platform
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# "From 10.1.1.1 icmp_seq=1 Time to live exceeded" (Linux), "92 bytes from 10.1.1.1: Time to live exceeded" (macOS),
+# "Reply from 10.1.1.1: TTL expired in transit." (Windows)
+TTL_EXCEEDED_RE = re.compile(r'from ([\d.]+)\S*\s.*?(?:time to live exceeded|ttl expired)', re.IGNORECASE)
+# "64 bytes from 8.8.8.8: icmp_seq=1 ttl=117 time=10.2 ms", "Reply from 8.8.8.8: bytes=32 time<1ms TTL=117"
+ECHO_REPLY_RE = re.compile(r'(?:bytes from|reply from) ([\d.]+):.*?time[=<]([\d.]+)\s*ms', re.IGNORECASE)
+
+
+def probe_hop(ip_address: str, ttl: int, timeout_ms: int = 1000) -> Dict:
+    """
+    Send one echo request with a limited TTL.
+    Returns the responding hop address and whether it was the target itself.
+    """
+    system = platform.system().lower()
+    timeout_sec = max(1, int(timeout_ms / 1000))
+
+    # -n on Linux and macOS: numeric hop addresses for TTL_EXCEEDED_RE, and no reverse DNS per hop
+    if system == 'windows':
+        cmd = ['ping', '-n', '1', '-i', str(ttl), '-w', str(timeout_ms), ip_address]
+    elif system == 'darwin':
+        cmd = ['ping', '-n', '-c', '1', '-m', str(ttl), '-W', str(timeout_ms), ip_address]
+    else:
+        cmd = ['ping', '-n', '-c', '1', '-t', str(ttl), '-W', str(timeout_sec), ip_address]
+
+    hop = {'ttl': ttl, 'ip_address': None, 'rtt_ms': None, 'reached': False}
+    started = time.monotonic()
+    try:
+        process = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout_sec + 5)
+    except (subprocess.TimeoutExpired, OSError):
+        return hop
+    output = process.stdout + process.stderr
+
+    reply = ECHO_REPLY_RE.search(output)
+    if reply and reply.group(1) == ip_address:
+        hop.update(ip_address=reply.group(1), rtt_ms=float(reply.group(2)), reached=True)
+        return hop
+
+    exceeded = TTL_EXCEEDED_RE.search(output)
+    if exceeded:
+        # ping does not report an RTT for TTL exceeded replies, use the elapsed time
+        hop.update(ip_address=exceeded.group(1), rtt_ms=round((time.monotonic() - started) * 1000, 1))
+    return hop
+
+
+def trace_path(ip_address: str, max_hops: int = 20, hop_timeout_ms: int = 1000,
+               budget_seconds: float = 30) -> Dict:
+    """Step the TTL from 1 until the target answers, max_hops is reached or the time budget runs out"""
+    started = time.monotonic()
+    hops: List[Dict] = []
+    reached = False
+    truncated = False
+
+    for ttl in range(1, max_hops + 1):
+        if time.monotonic() - started + hop_timeout_ms / 1000 > budget_seconds:
+            truncated = True
+            break
+        hop = probe_hop(ip_address, ttl, hop_timeout_ms)
+        hops.append(hop)
+        if hop['reached']:
+            reached = True
+            break
+
+    responding = [h for h in hops if h['ip_address']]
+    return {
+        'target': ip_address,
+        'hops': hops,
+        'last_responding_hop': responding[-1] if responding else None,
+        'reached': reached,
+        'truncated': truncated,
+        'duration_ms': round((time.monotonic() - started) * 1000),
+        'timestamp': datetime.utcnow().isoformat() + 'Z'
+    }
+
+
+class PathDiagnostics:
+    """
+    Bounded background pool for path traces.
+    A target already being traced is not traced again, and finished traces
+    wait here until the agent attaches them to the entity's next uploaded result.
+    """
+
+    def __init__(self, max_concurrent: int = 2, max_hops: int = 20,
+                 hop_timeout_ms: int = 1000, budget_seconds: float = 30):
+        self.max_hops = max_hops
+        self.hop_timeout_ms = hop_timeout_ms
+        self.budget_seconds = budget_seconds
+        self.max_concurrent = max_concurrent
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix='path-diag')
+        self.lock = threading.Lock()
+        self.in_flight: set = set()
+        self.completed: Dict[str, Dict] = {}
+
+    def configure(self, config):
+        """Apply reloaded settings; traces already running finish on the old pool"""
+        self.max_hops = config.diagnostics_max_hops
+        self.hop_timeout_ms = config.diagnostics_hop_timeout
+        self.budget_seconds = config.diagnostics_budget
+        if config.diagnostics_max_concurrent != self.max_concurrent:
+            old = self.executor
+            self.max_concurrent = config.diagnostics_max_concurrent
+            self.executor = ThreadPoolExecutor(max_workers=self.max_concurrent, thread_name_prefix='path-diag')
+            old.shutdown(wait=False)
+
+    def submit(self, entity_id: str, ip_address: str, transition: str) -> bool:
+        """Queue a trace for an entity; returns False if its target is already being traced"""
+        with self.lock:
+            if ip_address in self.in_flight:
+                return False
+            self.in_flight.add(ip_address)
+        self.executor.submit(self._run, entity_id, ip_address, transition)
+        return True
+
+    def _run(self, entity_id: str, ip_address: str, transition: str):
+        try:
+            trace = trace_path(ip_address, self.max_hops, self.hop_timeout_ms, self.budget_seconds)
+            trace['transition'] = transition
+            last_hop = trace['last_responding_hop']
+            logger.info(f"Path to {ip_address} ({transition}): {len(trace['hops'])} hops, "
+                        f"last responding hop {last_hop['ip_address'] if last_hop else 'none'}")
+            with self.lock:
+                self.completed[entity_id] = trace
+        except Exception as e:
+            logger.error(f"Path diagnostics for {ip_address} failed: {e}")
+        finally:
+            with self.lock:
+                self.in_flight.discard(ip_address)
+
+    def take(self, entity_id: str) -> Optional[Dict]:
+        """Pop the finished trace for an entity, if any"""
+        with self.lock:
+            return self.completed.pop(entity_id, None)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
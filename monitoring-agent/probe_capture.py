@@ -0,0 +1,206 @@
+"""
+Probe capture and replay for the Network Monitoring Agent
+A capture records every cycle's entity list and the raw outcome of each probe
+(as ping reported it, before baseline classification) in a gzipped NDJSON
+file: one line per cycle, with an entity list only written again when it
+changes. A replay serves those outcomes back in place of ping, taking the
+recorded time divided by a speed factor, so a captured incident runs through
+the agent's classification, correlation and upload path again.
+"""
+
+import os
+import gzip
+import json
+import time
+import zlib
+import hashlib
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional
+
+from probing import PingResult
+
+logger = logging.getLogger(__name__)
+
+CAPTURE_VERSION = 1
+
+# Each recorded probe is a JSON array of these, in this order
+PROBE_FIELDS = ('offset_ms', 'duration_ms', 'ip', 'status', 'packet_loss', 'response_time_ms',
+                'min_rtt', 'avg_rtt', 'max_rtt', 'error_message')
+
+
+def entity_set_id(entities: List[Dict]) -> str:
+    return hashlib.sha1(json.dumps(entities, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class ProbeCapture:
+    """Writes cycles to <directory>/<agent_id>-<start time>.ndjson.gz until max_mb is reached"""
+
+    def __init__(self, directory: str, agent_id: str, max_mb: float = 500):
+        self.directory = directory
+        self.agent_id = agent_id
+        self.max_bytes = max_mb * 1024 * 1024
+        self.path: Optional[str] = None
+        self.raw = None
+        self.file = None
+        self.lock = threading.Lock()
+        self.cycle: Optional[Dict] = None
+        self.probes: List[list] = []
+        self.written_sets: set = set()
+        self.cycles = 0
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+        self.path = os.path.join(self.directory, f"{self.agent_id}-{stamp}.ndjson.gz")
+        self.raw = open(self.path, 'wb')
+        self.file = gzip.GzipFile(fileobj=self.raw, mode='wb')
+        self.write({'type': 'capture', 'version': CAPTURE_VERSION, 'agent_id': self.agent_id,
+                    'started_at': datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')})
+        logger.info(f"Capturing probe cycles to {self.path}")
+
+    def write(self, record: Dict):
+        self.file.write(json.dumps(record, separators=(',', ':')).encode() + b'\n')
+
+    def begin_cycle(self, entities: List[Dict]):
+        """Start recording a cycle over `entities`; an unfinished previous cycle is written first"""
+        if self.file is None:
+            return
+        self.end_cycle()
+        set_id = entity_set_id(entities)
+        if set_id not in self.written_sets:
+            self.write({'type': 'entities', 'id': set_id, 'entities': entities})
+            self.written_sets.add(set_id)
+        with self.lock:
+            self.cycle = {'type': 'cycle', 'started_at': time.time(), 'entities': set_id}
+            self.probes = []
+
+    def record(self, ip_address: str, started: float, duration: float, result: PingResult):
+        """Note one probe outcome; only buffered here, written at the end of the cycle"""
+        with self.lock:
+            if self.cycle is None:
+                return
+            self.probes.append([
+                round((started - self.cycle['started_at']) * 1000),
+                round(duration * 1000),
+                ip_address,
+                result.status,
+                result.packet_loss,
+                result.response_time_ms,
+                result.min_rtt,
+                result.avg_rtt,
+                result.max_rtt,
+                result.error_message
+            ])
+
+    def end_cycle(self):
+        """Write the current cycle and flush it, so a crash loses at most the cycle in progress"""
+        with self.lock:
+            cycle, probes = self.cycle, self.probes
+            self.cycle, self.probes = None, []
+        if cycle is None or self.file is None:
+            return
+        cycle['duration_ms'] = round((time.time() - cycle['started_at']) * 1000)
+        cycle['probes'] = probes
+        try:
+            self.write(cycle)
+            self.file.flush()
+            self.cycles += 1
+        except OSError as e:
+            logger.error(f"Probe capture stopped: {e}")
+            self.close()
+            return
+        if self.raw.tell() >= self.max_bytes:
+            logger.warning(f"Probe capture reached {self.max_bytes / (1024 * 1024):.0f} MB, stopped after "
+                           f"{self.cycles} cycles")
+            self.close()
+
+    def close(self):
+        if self.file is None:
+            return
+        try:
+            self.file.close()
+            self.raw.close()
+        except OSError:
+            pass
+        self.file = None
+        logger.info(f"Probe capture {self.path} closed ({self.cycles} cycles)")
+
+
+def read_capture(path: str) -> Iterator[Dict]:
+    """
+    Cycles of a capture file, oldest first, each with its entity list
+    resolved. A file cut short by a crash is read up to its last whole cycle.
+    """
+    entity_sets: Dict[str, List[Dict]] = {}
+    try:
+        with gzip.open(path, 'rb') as f:
+            for line in f:
+                record = json.loads(line)
+                if record.get('type') == 'capture' and record.get('version') != CAPTURE_VERSION:
+                    raise ValueError(f"{path} is capture version {record.get('version')}, "
+                                     f"expected {CAPTURE_VERSION}")
+                if record.get('type') == 'entities':
+                    entity_sets[record['id']] = record['entities']
+                elif record.get('type') == 'cycle':
+                    record['entities'] = entity_sets.get(record['entities'], [])
+                    yield record
+    except (EOFError, zlib.error, json.JSONDecodeError) as e:
+        logger.warning(f"{path} ends in an incomplete cycle ({e}), replaying what was complete")
+
+
+class ProbeReplay:
+    """
+    Answers probes from the cycle being replayed. An address probed more
+    often than recorded gets its last outcome again; one not recorded in the
+    cycle gets its outcome from the latest earlier cycle, or an error.
+    """
+
+    def __init__(self, speed: float = 1.0):
+        self.speed = speed
+        self.lock = threading.Lock()
+        self.outcomes: Dict[str, deque] = {}
+        self.last: Dict[str, list] = {}
+        self.served = 0
+        self.repeated = 0
+        self.missing = 0
+
+    def begin_cycle(self, cycle: Dict):
+        outcomes: Dict[str, deque] = {}
+        for probe in cycle['probes']:
+            outcomes.setdefault(probe[2], deque()).append(probe)
+        with self.lock:
+            self.outcomes = outcomes
+
+    def probe(self, ip_address: str) -> PingResult:
+        with self.lock:
+            queued = self.outcomes.get(ip_address)
+            if queued:
+                probe = queued.popleft()
+                self.last[ip_address] = probe
+                self.served += 1
+            else:
+                probe = self.last.get(ip_address)
+                if probe is None:
+                    self.missing += 1
+                else:
+                    self.repeated += 1
+
+        result = PingResult(ip_address)
+        if probe is None:
+            result.error_message = 'Not in the capture'
+            return result
+
+        time.sleep(probe[1] / 1000 / self.speed)
+        values = dict(zip(PROBE_FIELDS, probe))
+        result.status = values['status']
+        result.success = values['status'] not in ('OFFLINE', 'TIMEOUT', 'ERROR')
+        result.packet_loss = values['packet_loss']
+        result.response_time_ms = values['response_time_ms']
+        result.min_rtt = values['min_rtt']
+        result.avg_rtt = values['avg_rtt']
+        result.max_rtt = values['max_rtt']
+        result.error_message = values['error_message']
+        return result
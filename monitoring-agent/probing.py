@@ -0,0 +1,377 @@
+"""
+Probing engine of the Network Monitoring Agent
+The agent's ping implementation, result type and link rate limiter, usable on
+their own by scripts and network-test tooling with the agent directory on
+sys.path. probe_many runs probes concurrently on asyncio and yields results as
+they complete; probe_many_sync wraps it for synchronous callers:
+
+    from probing import probe_many, probe_many_sync
+
+    async for result in probe_many(['10.1.1.1', '10.1.1.2'], count=3, timeout_ms=2000):
+        print(result.ip_address, result.status, result.response_time_ms)
+
+    results = probe_many_sync(['10.1.1.1'], probe_type='tcp', port=443)
+
+Targets are addresses or entity dicts with an 'ip_address' (plus 'type',
+'id'/'branch_id', 'network_media', 'network_vendor' for rate limit keys).
+"""
+
+import re
+import time
+import asyncio
+import platform
+import threading
+import subprocess
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Union
+
+PROBE_TYPES = ('icmp', 'tcp')
+
+# Results above this average RTT are SLOW even without loss
+SLOW_RTT_MS = 1000
+
+
+class PingResult:
+    """Ping result data class"""
+    def __init__(self, ip_address: str):
+        self.ip_address = ip_address
+        self.success = False
+        self.status = 'ERROR'
+        self.response_time_ms: Optional[float] = None
+        self.packet_loss: float = 100.0
+        self.min_rtt: Optional[float] = None
+        self.max_rtt: Optional[float] = None
+        self.avg_rtt: Optional[float] = None
+        self.error_message: Optional[str] = None
+
+
+def ping_command(ip_address: str, count: int, timeout_ms: int) -> List[str]:
+    if platform.system().lower() == 'windows':
+        return ['ping', '-n', str(count), '-w', str(timeout_ms), ip_address]
+    # Linux/macOS
+    return ['ping', '-c', str(count), '-W', str(int(timeout_ms / 1000)), ip_address]
+
+
+def classify(result: PingResult):
+    """Set success and status from packet loss and RTT"""
+    if result.packet_loss == 0 and result.response_time_ms:
+        result.success = True
+        if result.response_time_ms > SLOW_RTT_MS:
+            result.status = 'SLOW'
+        else:
+            result.status = 'ONLINE'
+    elif result.packet_loss < 100:
+        result.success = True
+        result.status = 'SLOW'
+    else:
+        result.success = False
+        result.status = 'OFFLINE'
+
+
+def parse_ping_output(result: PingResult, output: str):
+    """Fill in loss, RTT statistics and status from ping's output"""
+    system = platform.system().lower()
+
+    # Parse packet loss
+    if system == 'windows':
+        loss_match = re.search(r'\((\d+)% loss\)', output)
+    else:
+        loss_match = re.search(r'(\d+(?:\.\d+)?)\s*%\s*packet\s*loss', output, re.IGNORECASE)
+
+    if loss_match:
+        result.packet_loss = float(loss_match.group(1))
+
+    # Parse RTT statistics
+    if system == 'windows':
+        rtt_match = re.search(r'Minimum = (\d+)ms.*Maximum = (\d+)ms.*Average = (\d+)ms', output)
+        if rtt_match:
+            result.min_rtt = float(rtt_match.group(1))
+            result.max_rtt = float(rtt_match.group(2))
+            result.avg_rtt = float(rtt_match.group(3))
+            result.response_time_ms = result.avg_rtt
+    else:
+        rtt_match = re.search(r'([\d.]+)/([\d.]+)/([\d.]+)', output)
+        if rtt_match:
+            result.min_rtt = float(rtt_match.group(1))
+            result.avg_rtt = float(rtt_match.group(2))
+            result.max_rtt = float(rtt_match.group(3))
+            result.response_time_ms = result.avg_rtt
+
+    classify(result)
+
+
+def ping_host(ip_address: str, count: int = 3, timeout_ms: int = 3000) -> PingResult:
+    """
+    Ping a host and return detailed results
+    Works on Windows, Linux, and macOS
+    """
+    result = PingResult(ip_address)
+
+    try:
+        process = subprocess.run(
+            ping_command(ip_address, count, timeout_ms),
+            capture_output=True,
+            text=True,
+            timeout=timeout_ms / 1000 * count + 5
+        )
+        parse_ping_output(result, process.stdout + process.stderr)
+
+    except subprocess.TimeoutExpired:
+        result.status = 'TIMEOUT'
+        result.error_message = 'Ping timed out'
+    except Exception as e:
+        result.status = 'ERROR'
+        result.error_message = str(e)
+
+    return result
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket, refilled continuously at `rate` tokens per second.
+    A request larger than the capacity waits for a full bucket and then takes
+    all it asked for, leaving the bucket in debt, so it is paid in full and the
+    long-run rate never exceeds `rate`.
+    """
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.lock = threading.Lock()
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def configure(self, rate: float, capacity: Optional[float] = None):
+        """Change the rate in place, keeping the tokens already accumulated (or owed)"""
+        with self.lock:
+            self._refill()
+            self.rate = rate
+            self.capacity = capacity if capacity is not None else max(rate, 1)
+            self.tokens = min(self.tokens, self.capacity)
+
+    def available(self, tokens: float) -> bool:
+        with self.lock:
+            self._refill()
+            return self.tokens >= min(tokens, self.capacity)
+
+    def take(self, tokens: float):
+        with self.lock:
+            self._refill()
+            self.tokens -= tokens
+
+    def try_acquire(self, tokens: float = 1) -> bool:
+        with self.lock:
+            self._refill()
+            if self.tokens >= min(tokens, self.capacity):
+                self.tokens -= tokens
+                return True
+            return False
+
+    def wait_time(self, tokens: float = 1) -> float:
+        """Seconds until a request for `tokens` will be granted"""
+        with self.lock:
+            self._refill()
+            missing = min(tokens, self.capacity) - self.tokens
+            return max(0.0, missing / self.rate) if self.rate > 0 else 0.0
+
+
+# Entity attributes a rate limit can be keyed on; 'branch' is per branch_id
+RATE_LIMIT_FIELDS = {
+    'network_media': 'network_media',
+    'network_vendor': 'network_vendor',
+}
+
+
+class RateLimiter:
+    """
+    Packets-per-second limits per network link (media, vendor or branch).
+    A probe must draw its packets from every bucket its target belongs to.
+    """
+    def __init__(self, limits: Dict):
+        self.lock = threading.Lock()
+        self.buckets: Dict[tuple, TokenBucket] = {}
+        self.limits: Dict = {}
+        self.configure(limits)
+
+    def configure(self, limits: Dict):
+        """Apply new limits, resizing existing buckets in place"""
+        with self.lock:
+            self.limits = limits or {}
+            for key, bucket in list(self.buckets.items()):
+                rate = self._rate(key)
+                if rate:
+                    bucket.configure(rate)
+                else:
+                    del self.buckets[key]
+
+    def _rate(self, key: tuple) -> float:
+        dimension, value = key
+        if dimension == 'branch':
+            return self.limits.get('branch') or 0
+        return (self.limits.get(dimension) or {}).get(value) or 0
+
+    def keys_for(self, entity: Dict) -> List[tuple]:
+        """Rate limit keys that apply to an entity"""
+        keys = []
+        for dimension, field in RATE_LIMIT_FIELDS.items():
+            value = entity.get(field)
+            if value and self._rate((dimension, value)):
+                keys.append((dimension, value))
+        branch_id = entity.get('id') if entity.get('type') == 'BRANCH' else entity.get('branch_id')
+        if branch_id and self.limits.get('branch'):
+            keys.append(('branch', branch_id))
+        return keys
+
+    def _buckets(self, keys) -> List[TokenBucket]:
+        with self.lock:
+            buckets = []
+            for key in keys:
+                rate = self._rate(key)
+                if not rate:
+                    continue
+                if key not in self.buckets:
+                    self.buckets[key] = TokenBucket(rate)
+                buckets.append(self.buckets[key])
+            return buckets
+
+    def try_acquire(self, keys, tokens: float) -> bool:
+        """Take tokens from all buckets of the given keys, or from none"""
+        buckets = self._buckets(keys)
+        with self.lock:
+            if not all(b.available(tokens) for b in buckets):
+                return False
+            for bucket in buckets:
+                bucket.take(tokens)
+            return True
+
+    def wait_time(self, keys, tokens: float) -> float:
+        return max([b.wait_time(tokens) for b in self._buckets(keys)], default=0.0)
+
+
+async def ping_host_async(ip_address: str, count: int = 3, timeout_ms: int = 3000) -> PingResult:
+    """ping_host without a thread: the ping process is awaited on the event loop"""
+    result = PingResult(ip_address)
+
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *ping_command(ip_address, count, timeout_ms),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT
+        )
+        try:
+            output, _ = await asyncio.wait_for(process.communicate(), timeout_ms / 1000 * count + 5)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            result.status = 'TIMEOUT'
+            result.error_message = 'Ping timed out'
+            return result
+        parse_ping_output(result, output.decode(errors='replace'))
+
+    except Exception as e:
+        result.status = 'ERROR'
+        result.error_message = str(e)
+
+    return result
+
+
+async def tcp_probe(ip_address: str, port: int, count: int = 3, timeout_ms: int = 3000) -> PingResult:
+    """
+    Time `count` TCP connects to ip_address:port. A refused connection still
+    proves the host answered, so it counts as a reply; only timeouts and
+    unreachable errors count as loss.
+    """
+    result = PingResult(ip_address)
+    rtts: List[float] = []
+    error = None
+
+    for _ in range(count):
+        started = time.perf_counter()
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(ip_address, port), timeout_ms / 1000)
+            rtts.append((time.perf_counter() - started) * 1000)
+            writer.close()
+        except ConnectionRefusedError:
+            rtts.append((time.perf_counter() - started) * 1000)
+        except asyncio.TimeoutError:
+            error = f'Connect to port {port} timed out'
+        except OSError as e:
+            error = str(e)
+
+    result.packet_loss = (count - len(rtts)) / count * 100
+    if rtts:
+        result.min_rtt = round(min(rtts), 3)
+        result.max_rtt = round(max(rtts), 3)
+        result.avg_rtt = round(sum(rtts) / len(rtts), 3)
+        result.response_time_ms = result.avg_rtt
+    classify(result)
+    if not rtts:
+        result.error_message = error
+    return result
+
+
+async def probe(ip_address: str, probe_type: str = 'icmp', count: int = 3, timeout_ms: int = 3000,
+                port: Optional[int] = None) -> PingResult:
+    """Probe one address with the given probe type"""
+    if probe_type == 'tcp':
+        return await tcp_probe(ip_address, port, count, timeout_ms)
+    return await ping_host_async(ip_address, count, timeout_ms)
+
+
+async def probe_many(targets: Iterable[Union[str, Dict]], probe_type: str = 'icmp', count: int = 3,
+                     timeout_ms: int = 3000, port: Optional[int] = None, concurrency: int = 20,
+                     rate_limiter: Optional[RateLimiter] = None) -> AsyncIterator[PingResult]:
+    """
+    Probe targets with at most `concurrency` probes in flight, yielding each
+    result as it completes. With a rate_limiter, every probe first draws
+    `count` packets from the buckets of its target, as the agent does.
+    Targets are consumed lazily, so a generator of any length is fine.
+    """
+    if probe_type not in PROBE_TYPES:
+        raise ValueError(f"probe_type must be one of {', '.join(PROBE_TYPES)} (got {probe_type!r})")
+    if probe_type == 'tcp' and not port:
+        raise ValueError("tcp probes need a port")
+
+    pending = iter(targets)
+    results: asyncio.Queue = asyncio.Queue()
+    finished = object()
+
+    async def worker():
+        try:
+            for target in pending:
+                entity = target if isinstance(target, dict) else {'ip_address': target}
+                if rate_limiter:
+                    keys = rate_limiter.keys_for(entity)
+                    while not rate_limiter.try_acquire(keys, count):
+                        await asyncio.sleep(max(0.01, rate_limiter.wait_time(keys, count)))
+                try:
+                    result = await probe(entity['ip_address'], probe_type, count, timeout_ms, port)
+                except Exception as e:
+                    result = PingResult(entity.get('ip_address'))
+                    result.error_message = str(e)
+                await results.put(result)
+        finally:
+            await results.put(finished)
+
+    workers = [asyncio.ensure_future(worker()) for _ in range(max(1, concurrency))]
+    try:
+        running = len(workers)
+        while running:
+            item = await results.get()
+            if item is finished:
+                running -= 1
+            else:
+                yield item
+    finally:
+        for task in workers:
+            task.cancel()
+
+
+def probe_many_sync(targets: Iterable[Union[str, Dict]], **options) -> List[PingResult]:
+    """Run probe_many to completion and return its results in completion order"""
+    async def collect():
+        return [result async for result in probe_many(targets, **options)]
+    return asyncio.run(collect())
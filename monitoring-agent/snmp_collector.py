@@ -0,0 +1,434 @@
+"""
+SNMP collector for the Network Monitoring Agent
+Polls branch routers for interface counters and CPU load with SNMPv2c
+GETBULK requests over asyncio UDP, many routers at once, on a schedule of its
+own. Two successive samples of a router give each interface's throughput and
+utilization, which the agent attaches to the router's next result row. The
+BER encoding SNMPv2c needs is implemented here, so no SNMP library is
+required; snmp_standin.py answers the same requests for local testing.
+"""
+
+import time
+import random
+import asyncio
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# BER / SNMP tags
+INTEGER = 0x02
+OCTET_STRING = 0x04
+NULL = 0x05
+OBJECT_IDENTIFIER = 0x06
+SEQUENCE = 0x30
+IP_ADDRESS = 0x40
+COUNTER32 = 0x41
+GAUGE32 = 0x42
+TIMETICKS = 0x43
+COUNTER64 = 0x46
+NO_SUCH_OBJECT = 0x80
+NO_SUCH_INSTANCE = 0x81
+END_OF_MIB_VIEW = 0x82
+
+GET_REQUEST = 0xA0
+GET_NEXT_REQUEST = 0xA1
+GET_RESPONSE = 0xA2
+GET_BULK_REQUEST = 0xA5
+
+SNMP_V2C = 1
+UNSIGNED_TAGS = (COUNTER32, GAUGE32, TIMETICKS, COUNTER64)
+EXCEPTION_TAGS = (NO_SUCH_OBJECT, NO_SUCH_INSTANCE, END_OF_MIB_VIEW)
+
+# IF-MIB ifXTable / ifTable columns and CPU load (Cisco, then HOST-RESOURCES)
+IF_NAME = (1, 3, 6, 1, 2, 1, 31, 1, 1, 1, 1)
+IF_HC_IN_OCTETS = (1, 3, 6, 1, 2, 1, 31, 1, 1, 1, 6)
+IF_HC_OUT_OCTETS = (1, 3, 6, 1, 2, 1, 31, 1, 1, 1, 10)
+IF_HIGH_SPEED = (1, 3, 6, 1, 2, 1, 31, 1, 1, 1, 15)
+IF_OPER_STATUS = (1, 3, 6, 1, 2, 1, 2, 2, 1, 8)
+CISCO_CPU_1MIN = (1, 3, 6, 1, 4, 1, 9, 9, 109, 1, 1, 1, 1, 7)
+HR_PROCESSOR_LOAD = (1, 3, 6, 1, 2, 1, 25, 3, 3, 1, 2)
+POLLED_COLUMNS = (IF_NAME, IF_OPER_STATUS, IF_HIGH_SPEED, IF_HC_IN_OCTETS, IF_HC_OUT_OCTETS,
+                  CISCO_CPU_1MIN, HR_PROCESSOR_LOAD)
+
+IF_OPER_UP = 1
+
+# GETBULK rounds per router before a walk is cut short
+MAX_WALK_ROUNDS = 50
+
+Oid = Tuple[int, ...]
+
+
+def encode_length(length: int) -> bytes:
+    if length < 0x80:
+        return bytes([length])
+    size = (length.bit_length() + 7) // 8
+    return bytes([0x80 | size]) + length.to_bytes(size, 'big')
+
+
+def encode_tlv(tag: int, payload: bytes) -> bytes:
+    return bytes([tag]) + encode_length(len(payload)) + payload
+
+
+def encode_integer(value: int) -> bytes:
+    """Two's complement in as few bytes as hold the sign; unsigned types get a leading zero when needed"""
+    return value.to_bytes(max(1, (value.bit_length() + 8) // 8), 'big', signed=True)
+
+
+def encode_oid(oid: Oid) -> bytes:
+    encoded = bytearray([oid[0] * 40 + oid[1]])
+    for arc in oid[2:]:
+        chunk = [arc & 0x7F]
+        arc >>= 7
+        while arc:
+            chunk.append(0x80 | (arc & 0x7F))
+            arc >>= 7
+        encoded.extend(reversed(chunk))
+    return bytes(encoded)
+
+
+def encode_value(tag: int, value: Any) -> bytes:
+    if tag == INTEGER or tag in UNSIGNED_TAGS:
+        return encode_tlv(tag, encode_integer(int(value)))
+    if tag == OCTET_STRING:
+        return encode_tlv(tag, value.encode() if isinstance(value, str) else bytes(value))
+    if tag == OBJECT_IDENTIFIER:
+        return encode_tlv(tag, encode_oid(value))
+    if tag == IP_ADDRESS:
+        return encode_tlv(tag, bytes(int(part) for part in value.split('.')))
+    return encode_tlv(tag, b'')
+
+
+def encode_message(pdu_type: int, request_id: int, community: str, varbinds: List[tuple],
+                   error_status: int = 0, error_index: int = 0) -> bytes:
+    """
+    An SNMPv2c message. varbinds are (oid, tag, value); for GETBULK
+    error_status and error_index carry non-repeaters and max-repetitions.
+    """
+    bindings = b''.join(
+        encode_tlv(SEQUENCE, encode_tlv(OBJECT_IDENTIFIER, encode_oid(oid)) + encode_value(tag, value))
+        for oid, tag, value in varbinds
+    )
+    pdu = encode_tlv(pdu_type, (
+        encode_tlv(INTEGER, encode_integer(request_id)) +
+        encode_tlv(INTEGER, encode_integer(error_status)) +
+        encode_tlv(INTEGER, encode_integer(error_index)) +
+        encode_tlv(SEQUENCE, bindings)
+    ))
+    return encode_tlv(SEQUENCE, (
+        encode_tlv(INTEGER, encode_integer(SNMP_V2C)) +
+        encode_tlv(OCTET_STRING, community.encode()) +
+        pdu
+    ))
+
+
+def decode_tlv(data: bytes, pos: int) -> Tuple[int, bytes, int]:
+    """(tag, value, position after it); raises ValueError on truncated input"""
+    if pos + 2 > len(data):
+        raise ValueError('truncated BER element')
+    tag = data[pos]
+    length = data[pos + 1]
+    pos += 2
+    if length & 0x80:
+        size = length & 0x7F
+        length = int.from_bytes(data[pos:pos + size], 'big')
+        pos += size
+    if pos + length > len(data):
+        raise ValueError('truncated BER element')
+    return tag, data[pos:pos + length], pos + length
+
+
+def decode_oid(payload: bytes) -> Oid:
+    if not payload:
+        raise ValueError('empty OID')
+    arcs = [payload[0] // 40, payload[0] % 40]
+    arc = 0
+    for byte in payload[1:]:
+        arc = (arc << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            arcs.append(arc)
+            arc = 0
+    return tuple(arcs)
+
+
+def decode_value(tag: int, payload: bytes) -> Any:
+    if tag == INTEGER:
+        return int.from_bytes(payload, 'big', signed=True)
+    if tag in UNSIGNED_TAGS:
+        return int.from_bytes(payload, 'big', signed=False)
+    if tag == OCTET_STRING:
+        return payload
+    if tag == OBJECT_IDENTIFIER:
+        return decode_oid(payload)
+    if tag == IP_ADDRESS:
+        return '.'.join(str(b) for b in payload)
+    return None
+
+
+def decode_message(data: bytes) -> Dict:
+    """Any SNMPv2c message, requests included: version, community, PDU fields and (oid, tag, value) varbinds"""
+    tag, message, _ = decode_tlv(data, 0)
+    if tag != SEQUENCE:
+        raise ValueError('not an SNMP message')
+    _, version, pos = decode_tlv(message, 0)
+    _, community, pos = decode_tlv(message, pos)
+    pdu_type, pdu, _ = decode_tlv(message, pos)
+
+    fields = []
+    pos = 0
+    for _ in range(3):
+        _, value, pos = decode_tlv(pdu, pos)
+        fields.append(int.from_bytes(value, 'big', signed=True))
+    _, bindings, _ = decode_tlv(pdu, pos)
+
+    varbinds = []
+    pos = 0
+    while pos < len(bindings):
+        _, binding, pos = decode_tlv(bindings, pos)
+        _, oid, inner = decode_tlv(binding, 0)
+        value_tag, value, _ = decode_tlv(binding, inner)
+        varbinds.append((decode_oid(oid), value_tag, decode_value(value_tag, value)))
+
+    return {
+        'version': int.from_bytes(version, 'big'),
+        'community': community.decode(errors='replace'),
+        'pdu_type': pdu_type,
+        'request_id': fields[0],
+        'error_status': fields[1],
+        'error_index': fields[2],
+        'varbinds': varbinds
+    }
+
+
+class SnmpSession(asyncio.DatagramProtocol):
+    """UDP endpoint to one router, matching responses to requests by request id"""
+
+    def __init__(self):
+        self.transport = None
+        self.pending: Dict[int, asyncio.Future] = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            message = decode_message(data)
+        except (ValueError, IndexError):
+            return
+        future = self.pending.pop(message['request_id'], None)
+        if future and not future.done():
+            future.set_result(message)
+
+    def error_received(self, exc):
+        # ICMP port unreachable: nothing is listening, fail fast instead of timing out
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(exc)
+        self.pending.clear()
+
+
+class SnmpCollector:
+    """
+    Scheduled GETBULK polling of routers from `targets()`, a callable
+    returning (entity_id, host) pairs. At most max_concurrent routers are
+    polled at once; the latest sample of each router waits in `samples`
+    until the agent takes it for an upload.
+    """
+
+    def __init__(self, targets: Callable[[], List[tuple]], community: str = 'public', port: int = 161,
+                 interval: float = 60.0, timeout_ms: float = 2000, retries: int = 1,
+                 max_concurrent: int = 50, max_repetitions: int = 10):
+        self.targets = targets
+        self.community = community
+        self.port = port
+        self.interval = interval
+        self.timeout_ms = timeout_ms
+        self.retries = retries
+        self.max_concurrent = max_concurrent
+        self.max_repetitions = max_repetitions
+        self.lock = threading.Lock()
+        self.samples: Dict[str, Dict] = {}
+        # Last counter readings per router: (monotonic time, {if_index: (in octets, out octets)})
+        self.counters: Dict[str, tuple] = {}
+        self.request_id = random.randint(1, 1 << 30)
+        self.stopping = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='snmp-collector', daemon=True)
+        self.thread.start()
+        logger.info(f"Polling routers over SNMP every {self.interval:g}s, {self.max_concurrent} at a time")
+
+    def close(self, timeout: float = 10.0):
+        self.stopping.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def take(self, entity_id: str) -> Optional[Dict]:
+        """The router's latest sample, handed out once"""
+        with self.lock:
+            return self.samples.pop(entity_id, None)
+
+    def run(self):
+        try:
+            asyncio.run(self.schedule())
+        except Exception as e:
+            logger.error(f"SNMP collector stopped: {e}")
+
+    async def schedule(self):
+        while not self.stopping.is_set():
+            started = time.monotonic()
+            await self.poll_all(self.targets())
+            # Short sleeps so close() does not wait out a whole interval
+            while not self.stopping.is_set():
+                remaining = started + self.interval - time.monotonic()
+                if remaining <= 0:
+                    break
+                await asyncio.sleep(min(remaining, 0.5))
+
+    async def poll_all(self, targets: List[tuple]) -> int:
+        """Poll every router once; returns how many answered"""
+        if not targets:
+            return 0
+        started = time.monotonic()
+        semaphore = asyncio.Semaphore(self.max_concurrent)
+
+        async def bounded(entity_id: str, host: str) -> bool:
+            async with semaphore:
+                return await self.poll(entity_id, host)
+
+        answered = sum(await asyncio.gather(*(bounded(entity_id, host) for entity_id, host in targets)))
+
+        # Forget routers no longer monitored
+        current = {entity_id for entity_id, _ in targets}
+        with self.lock:
+            self.counters = {k: v for k, v in self.counters.items() if k in current}
+            self.samples = {k: v for k, v in self.samples.items() if k in current}
+
+        logger.info(f"SNMP poll: {answered}/{len(targets)} routers answered in {time.monotonic() - started:.1f}s")
+        return answered
+
+    async def poll(self, entity_id: str, host: str) -> bool:
+        loop = asyncio.get_running_loop()
+        try:
+            transport, session = await loop.create_datagram_endpoint(SnmpSession, remote_addr=(host, self.port))
+        except OSError as e:
+            logger.debug(f"SNMP {host}: {e}")
+            return False
+        try:
+            table = await self.walk(session, POLLED_COLUMNS)
+        except (asyncio.TimeoutError, OSError, ValueError) as e:
+            logger.debug(f"SNMP {host}: {e or 'timed out'}")
+            return False
+        finally:
+            transport.close()
+
+        sample = self.build_sample(entity_id, table, time.monotonic())
+        with self.lock:
+            self.samples[entity_id] = sample
+        return True
+
+    def next_request_id(self) -> int:
+        self.request_id = self.request_id % 0x7FFFFFFF + 1
+        return self.request_id
+
+    async def request(self, session: SnmpSession, pdu_type: int, oids: List[Oid],
+                      non_repeaters: int = 0, max_repetitions: int = 0) -> List[tuple]:
+        """Send one request, retrying on timeout; the response's varbinds"""
+        loop = asyncio.get_running_loop()
+        for _ in range(self.retries + 1):
+            request_id = self.next_request_id()
+            future = loop.create_future()
+            session.pending[request_id] = future
+            session.transport.sendto(encode_message(pdu_type, request_id, self.community,
+                                                    [(oid, NULL, None) for oid in oids],
+                                                    non_repeaters, max_repetitions))
+            try:
+                message = await asyncio.wait_for(future, self.timeout_ms / 1000)
+            except asyncio.TimeoutError:
+                session.pending.pop(request_id, None)
+                continue
+            if message['error_status']:
+                raise ValueError(f"SNMP error status {message['error_status']}")
+            return message['varbinds']
+        raise asyncio.TimeoutError()
+
+    async def walk(self, session: SnmpSession, columns: Tuple[Oid, ...]) -> Dict[Oid, Dict[Oid, Any]]:
+        """
+        Walk table columns side by side with GETBULK: each round asks for the
+        next max_repetitions rows of every column not yet finished. Returns
+        {column: {row index: value}}; columns the router lacks come back empty.
+        """
+        table: Dict[Oid, Dict[Oid, Any]] = {column: {} for column in columns}
+        cursor: Dict[Oid, Optional[Oid]] = {column: column for column in columns}
+
+        for _ in range(MAX_WALK_ROUNDS):
+            active = [column for column in columns if cursor[column] is not None]
+            if not active:
+                break
+            varbinds = await self.request(session, GET_BULK_REQUEST, [cursor[c] for c in active],
+                                          max_repetitions=self.max_repetitions)
+            advanced = set()
+            # Repetitions come back row by row, one varbind per requested column
+            for i, (oid, tag, value) in enumerate(varbinds):
+                column = active[i % len(active)]
+                if cursor[column] is None:
+                    continue
+                if tag in EXCEPTION_TAGS or oid[:len(column)] != column or oid <= cursor[column]:
+                    cursor[column] = None
+                    continue
+                table[column][oid[len(column):]] = value
+                cursor[column] = oid
+                advanced.add(column)
+            for column in active:
+                if column not in advanced:
+                    cursor[column] = None
+        return table
+
+    def build_sample(self, entity_id: str, table: Dict[Oid, Dict[Oid, Any]], now: float) -> Dict:
+        """
+        CPU load and, from the previous reading, the throughput and
+        utilization of every interface that is up and has a speed.
+        Interfaces whose counters went backwards (a reboot) skip this sample.
+        """
+        in_octets, out_octets = table[IF_HC_IN_OCTETS], table[IF_HC_OUT_OCTETS]
+        counters = {index[0]: (in_octets[index], out_octets[index]) for index in in_octets if index in out_octets}
+        with self.lock:
+            previous = self.counters.get(entity_id)
+            self.counters[entity_id] = (now, counters)
+
+        interfaces = []
+        if previous and now > previous[0]:
+            elapsed = now - previous[0]
+            for if_index, (octets_in, octets_out) in sorted(counters.items()):
+                speed_mbps = table[IF_HIGH_SPEED].get((if_index,), 0)
+                before = previous[1].get(if_index)
+                if (not before or not speed_mbps
+                        or table[IF_OPER_STATUS].get((if_index,), IF_OPER_UP) != IF_OPER_UP):
+                    continue
+                delta_in, delta_out = octets_in - before[0], octets_out - before[1]
+                if delta_in < 0 or delta_out < 0:
+                    continue
+                in_bps = delta_in * 8 / elapsed
+                out_bps = delta_out * 8 / elapsed
+                name = table[IF_NAME].get((if_index,))
+                interfaces.append({
+                    'if_index': if_index,
+                    'name': name.decode(errors='replace') if isinstance(name, bytes) else name,
+                    'speed_mbps': speed_mbps,
+                    'in_bps': round(in_bps),
+                    'out_bps': round(out_bps),
+                    'in_utilization': round(in_bps / (speed_mbps * 1e6) * 100, 2),
+                    'out_utilization': round(out_bps / (speed_mbps * 1e6) * 100, 2)
+                })
+
+        cpu = list(table[CISCO_CPU_1MIN].values()) or list(table[HR_PROCESSOR_LOAD].values())
+        utilizations = [max(i['in_utilization'], i['out_utilization']) for i in interfaces]
+        return {
+            'sampled_at': datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z'),
+            'cpu_percent': max(cpu) if cpu else None,
+            'max_utilization': max(utilizations) if utilizations else None,
+            'interfaces': interfaces
+        }
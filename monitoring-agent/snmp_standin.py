@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Local SNMPv2c stand-in for testing the agent's SNMP collector
+Answers GET, GETNEXT and GETBULK for a synthetic branch router: a few
+interfaces whose 64-bit octet counters grow at a set share of line rate,
+with some jitter, and a CPU load. Point the agent at it with
+snmp_port set to the stand-in's port and a branch whose IP is 127.0.0.1.
+
+    python snmp_standin.py --port 1161 --interfaces 4 --load 0.6
+"""
+
+import sys
+import time
+import random
+import asyncio
+import argparse
+from bisect import bisect_right
+from typing import Dict, List, Tuple
+
+from snmp_collector import (
+    encode_message, decode_message, Oid,
+    INTEGER, OCTET_STRING, GAUGE32, COUNTER64, NO_SUCH_OBJECT, END_OF_MIB_VIEW,
+    GET_REQUEST, GET_NEXT_REQUEST, GET_RESPONSE,
+    IF_NAME, IF_HC_IN_OCTETS, IF_HC_OUT_OCTETS, IF_HIGH_SPEED, IF_OPER_STATUS, HR_PROCESSOR_LOAD
+)
+
+
+class SyntheticRouter:
+    """A MIB whose counters are computed from the time they are read"""
+
+    def __init__(self, interfaces: int, speed_mbps: int, load: float, cpu: int):
+        self.started = time.monotonic()
+        self.interfaces = interfaces
+        self.speed_mbps = speed_mbps
+        self.load = load
+        self.cpu = cpu
+        self.base = {i: random.randint(0, 1 << 40) for i in range(1, interfaces + 1)}
+        static = {}
+        for i in range(1, interfaces + 1):
+            static[IF_NAME + (i,)] = (OCTET_STRING, f"Gi0/{i - 1}")
+            # The last interface is down, to exercise oper status filtering
+            static[IF_OPER_STATUS + (i,)] = (INTEGER, 2 if i == interfaces and interfaces > 1 else 1)
+            static[IF_HIGH_SPEED + (i,)] = (GAUGE32, speed_mbps)
+            static[IF_HC_IN_OCTETS + (i,)] = None
+            static[IF_HC_OUT_OCTETS + (i,)] = None
+        static[HR_PROCESSOR_LOAD + (1,)] = None
+        self.static = static
+        self.oids: List[Oid] = sorted(static)
+
+    def value(self, oid: Oid) -> Tuple[int, object]:
+        if oid not in self.static:
+            return NO_SUCH_OBJECT, None
+        fixed = self.static[oid]
+        if fixed is not None:
+            return fixed
+        if oid[:len(HR_PROCESSOR_LOAD)] == HR_PROCESSOR_LOAD:
+            return INTEGER, max(0, min(100, self.cpu + random.randint(-5, 5)))
+        index = oid[-1]
+        share = self.load * (1.0 if oid[:len(IF_HC_IN_OCTETS)] == IF_HC_IN_OCTETS else 0.4)
+        elapsed = time.monotonic() - self.started
+        octets = self.base[index] + int(elapsed * self.speed_mbps * 1e6 / 8 * share * random.uniform(0.97, 1.0))
+        return COUNTER64, octets % (1 << 64)
+
+    def next(self, oid: Oid) -> Tuple[Oid, int, object]:
+        position = bisect_right(self.oids, oid)
+        if position >= len(self.oids):
+            return oid, END_OF_MIB_VIEW, None
+        following = self.oids[position]
+        return (following,) + self.value(following)
+
+    def respond(self, message: Dict) -> List[tuple]:
+        requested = [oid for oid, _, _ in message['varbinds']]
+        if message['pdu_type'] == GET_REQUEST:
+            return [(oid,) + self.value(oid) for oid in requested]
+        if message['pdu_type'] == GET_NEXT_REQUEST:
+            return [self.next(oid) for oid in requested]
+
+        non_repeaters = max(0, message['error_status'])
+        repetitions = max(0, message['error_index'])
+        varbinds = [self.next(oid) for oid in requested[:non_repeaters]]
+        cursors = requested[non_repeaters:]
+        for _ in range(repetitions):
+            if not cursors:
+                break
+            row = [self.next(oid) for oid in cursors]
+            varbinds.extend(row)
+            cursors = [oid for oid, _, _ in row]
+            if all(tag == END_OF_MIB_VIEW for _, tag, _ in row):
+                break
+        return varbinds
+
+
+class StandinProtocol(asyncio.DatagramProtocol):
+    def __init__(self, router: SyntheticRouter, community: str, drop: float):
+        self.router = router
+        self.community = community
+        self.drop = drop
+        self.transport = None
+        self.requests = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            message = decode_message(data)
+        except (ValueError, IndexError):
+            return
+        # A wrong community is silently ignored, as a real agent does
+        if message['community'] != self.community or random.random() < self.drop:
+            return
+        self.requests += 1
+        self.transport.sendto(encode_message(GET_RESPONSE, message['request_id'], self.community,
+                                             self.router.respond(message)), addr)
+
+
+async def serve(args):
+    router = SyntheticRouter(args.interfaces, args.speed_mbps, args.load, args.cpu)
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: StandinProtocol(router, args.community, args.drop), local_addr=(args.host, args.port))
+    print(f"SNMP stand-in on udp://{args.host}:{args.port} ({args.interfaces} interfaces, "
+          f"{args.speed_mbps} Mbps, load {args.load:.0%})", flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        transport.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local SNMPv2c stand-in for a branch router')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1161)
+    parser.add_argument('--community', default='public')
+    parser.add_argument('--interfaces', type=int, default=4)
+    parser.add_argument('--speed-mbps', type=int, default=100)
+    parser.add_argument('--load', type=float, default=0.5, help='Inbound share of line rate; outbound is 40%% of it')
+    parser.add_argument('--cpu', type=int, default=20, help='CPU load percent, with some jitter')
+    parser.add_argument('--drop', type=float, default=0.0, help='Share of requests left unanswered')
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,623 @@
+#!/usr/bin/env python3
+"""
+Soak test for the Network Monitoring Agent
+Runs the agent's own cycle loop for thousands of cycles against a local
+stand-in for the Helpdesk entity feed and result ingestion, with a simulated
+network instead of ping. Branch, vendor and single-host outages are injected
+into the network and slowdowns (slow responses and 503s) into the Helpdesk,
+and a share of the ATMs is replaced on every entity refresh.
+
+Time is compressed by --time-scale: every duration in the agent's
+configuration, the simulated RTTs and the injected faults are divided by it,
+so at the default of 120 a 60 s ping interval lasts 0.5 s and a day of
+cycles takes 12 minutes. Lags and drift are reported in simulated seconds.
+Too high a scale shows up as cycles late from the harness's own overhead.
+
+Usage:
+    python soak_test.py [config.json] --cycles 5000 --entities 300 --time-scale 120
+
+Every --report-every cycles it prints the agent process's RSS, open file
+descriptors, thread count and log size, the cycle-start drift, cycle time and
+delivery lag; at the end it compares resource use against the first window
+and exits with status 1 if threads, descriptors or memory kept growing or too
+many cycles started late. The agent's log goes to monitoring-agent.log only,
+unless --verbose.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit, parse_qs
+
+import requests
+
+from agent import Config, MonitoringAgent, logger
+from load_test import percentile
+from probing import PingResult, classify
+from transport import UploadBackpressure
+
+
+SOAK_API_KEY = 'soak-test-key'
+
+# Simulated round-trip times in ms by network media
+MEDIA_RTT = {'FO': 12, 'M2M': 90, 'VSAT': 650}
+VENDORS = ['Telkom', 'Lintasarta', 'Indosat', 'Telkomsat']
+
+# Injected fault durations in simulated seconds
+OUTAGE_DURATION = (120, 1800)
+SLOWDOWN_DURATION = (60, 900)
+SLOWDOWN_DELAY = (2, 45)
+SLOWDOWN_REJECT_RATIO = 0.3
+
+
+class SimClock:
+    """Simulated seconds since `epoch` (a time.monotonic() value), `scale` times faster than real time"""
+
+    def __init__(self, scale: float, epoch: Optional[float] = None):
+        self.scale = scale
+        self.epoch = time.monotonic() if epoch is None else epoch
+
+    def now(self) -> float:
+        return (time.monotonic() - self.epoch) * self.scale
+
+    def sleep(self, sim_seconds: float):
+        time.sleep(sim_seconds / self.scale)
+
+
+def build_fleet(branches: int, atms_per_branch: int, seed: int) -> List[Dict]:
+    """Branches with their ATMs, shaped like the entity feed"""
+    rng = random.Random(seed)
+    entities = []
+    for b in range(branches):
+        media = rng.choice(['FO', 'FO', 'M2M', 'VSAT'])
+        branch = {
+            'id': f"branch-{b:05d}",
+            'type': 'BRANCH',
+            'code': f"B{b:05d}",
+            'name': f"Branch {b}",
+            'ip_address': f"10.{b // 250}.{b % 250}.1",
+            'backup_ip_address': f"10.{100 + b // 250}.{b % 250}.1" if media == 'VSAT' else None,
+            'network_media': media,
+            'network_vendor': rng.choice(VENDORS)
+        }
+        entities.append(branch)
+        for a in range(atms_per_branch):
+            entities.append(new_atm(branch, a, rng))
+    return entities
+
+
+def new_atm(branch: Dict, index: int, rng: random.Random, generation: int = 0) -> Dict:
+    """An ATM behind `branch`; replacements (later generations) get a new id and address"""
+    host = (index + generation * 7) % 240 + 10
+    return {
+        'id': f"atm-{branch['code']}-{index}-{generation}",
+        'type': 'ATM',
+        'code': f"A{branch['code'][1:]}{index:02d}{generation}",
+        'name': f"ATM {branch['name']} #{index}",
+        'ip_address': branch['ip_address'].rsplit('.', 1)[0] + f".{host}",
+        'network_media': rng.choice(['FO', 'M2M', 'VSAT']),
+        'network_vendor': branch['network_vendor'],
+        'branch_id': branch['id'],
+        'branch_code': branch['code'],
+        'branch_name': branch['name']
+    }
+
+
+class StubHelpdesk:
+    """State behind the stand-in Helpdesk: the fleet, injected slowdowns and what was delivered"""
+
+    def __init__(self, fleet: List[Dict], clock: SimClock, slowdowns_per_hour: float,
+                 churn: float, seed: int):
+        self.fleet = fleet
+        self.clock = clock
+        self.churn = churn
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.fetches = 0
+        self.slowdowns_per_hour = slowdowns_per_hour
+        self.next_slowdown = self.schedule_next(0.0)
+        self.slow_until = 0.0
+        self.slowdowns = 0
+        self.batch_ids: set = set()
+        self.reset_window()
+
+    def reset_window(self):
+        self.received = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.lags: List[float] = []
+
+    def schedule_next(self, now: float) -> float:
+        if self.slowdowns_per_hour <= 0:
+            return float('inf')
+        return now + self.rng.expovariate(self.slowdowns_per_hour / 3600)
+
+    def slowed(self) -> bool:
+        """Whether the Helpdesk is in an injected slowdown now"""
+        now = self.clock.now()
+        with self.lock:
+            while self.next_slowdown <= now:
+                self.slow_until = max(self.slow_until, self.next_slowdown + self.rng.uniform(*SLOWDOWN_DURATION))
+                self.slowdowns += 1
+                self.next_slowdown = self.schedule_next(self.next_slowdown)
+            return now < self.slow_until
+
+    def entities(self, fresh: bool) -> List[Dict]:
+        """The fleet; every full fetch after the first replaces `churn` of the ATMs"""
+        with self.lock:
+            if fresh:
+                self.fetches += 1
+                if self.fetches > 1 and self.churn > 0:
+                    self.replace_atms()
+            return list(self.fleet)
+
+    def replace_atms(self):
+        self.generation += 1
+        branches = {e['id']: e for e in self.fleet if e['type'] == 'BRANCH'}
+        for i, entity in enumerate(self.fleet):
+            if entity['type'] == 'ATM' and self.rng.random() < self.churn:
+                index = int(entity['id'].split('-')[2])
+                self.fleet[i] = new_atm(branches[entity['branch_id']], index, self.rng, self.generation)
+
+    def accept(self, batch_id: Optional[str], results: List[Dict]) -> bool:
+        """Record a delivered batch; False if it was already applied"""
+        received_at = time.time()
+        with self.lock:
+            if batch_id and batch_id in self.batch_ids:
+                self.duplicates += 1
+                return False
+            if batch_id:
+                self.batch_ids.add(batch_id)
+            self.received += len(results)
+            for result in results:
+                try:
+                    checked = datetime.fromisoformat(result['timestamp'].rstrip('Z'))
+                except (KeyError, AttributeError, ValueError):
+                    continue
+                # Timestamps are naive UTC
+                sent = (checked - datetime(1970, 1, 1)).total_seconds()
+                self.lags.append(max(0.0, received_at - sent) * self.clock.scale)
+        return True
+
+    def stats(self) -> Dict:
+        """Delivery since the previous call"""
+        with self.lock:
+            stats = {
+                'received': self.received,
+                'duplicates': self.duplicates,
+                'rejected': self.rejected,
+                'slowdowns': self.slowdowns,
+                'lag_p50': percentile(self.lags, 50),
+                'lag_p95': percentile(self.lags, 95),
+                'lag_max': max(self.lags, default=0.0)
+            }
+            self.reset_window()
+            return stats
+
+
+def make_handler(helpdesk: StubHelpdesk):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status: int, body, content_type: str = 'application/json'):
+            data = body if isinstance(body, bytes) else json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def authorized(self) -> bool:
+            if self.headers.get('Authorization') == f'Bearer {SOAK_API_KEY}':
+                return True
+            self.send_json(401, {'success': False, 'error': 'Invalid API key'})
+            return False
+
+        def do_GET(self):
+            parts = urlsplit(self.path)
+            query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+            if parts.path == '/soak/stats':
+                self.send_json(200, helpdesk.stats())
+            elif parts.path == '/api/monitoring/agent/entities':
+                if self.authorized():
+                    self.entity_feed(query)
+            else:
+                self.send_json(404, {'success': False, 'error': 'Not found'})
+
+        def entity_feed(self, query: Dict[str, str]):
+            cursor = query.get('cursor')
+            entities = helpdesk.entities(fresh=cursor is None)
+            if query.get('format') != 'ndjson' and 'ndjson' not in self.headers.get('Accept', ''):
+                self.send_json(200, {'success': True, 'entities': entities})
+                return
+
+            start = 0
+            if cursor:
+                ids = [f"{e['type']}:{e['id']}" for e in entities]
+                start = ids.index(cursor) + 1 if cursor in ids else len(ids)
+            limit = int(query.get('limit', 5000))
+            page = entities[start:start + limit]
+            more = start + limit < len(entities)
+            lines = [json.dumps(e) for e in page]
+            lines.append(json.dumps({
+                'type': 'END',
+                'total': len(page),
+                'next_cursor': f"{page[-1]['type']}:{page[-1]['id']}" if more and page else None,
+                'generated_at': datetime.utcnow().isoformat() + 'Z'
+            }))
+            self.send_json(200, ('\n'.join(lines) + '\n').encode(), 'application/x-ndjson')
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if urlsplit(self.path).path != '/api/monitoring/agent/results':
+                self.send_json(404, {'success': False, 'error': 'Not found'})
+                return
+            if not self.authorized():
+                return
+
+            if helpdesk.slowed():
+                helpdesk.clock.sleep(helpdesk.rng.uniform(*SLOWDOWN_DELAY))
+                if helpdesk.rng.random() < SLOWDOWN_REJECT_RATIO:
+                    with helpdesk.lock:
+                        helpdesk.rejected += 1
+                    self.send_json(503, {'success': False, 'error': 'Service temporarily unavailable'})
+                    return
+
+            payload = json.loads(body or b'{}')
+            results = payload.get('results') or []
+            applied = helpdesk.accept(self.headers.get('Idempotency-Key'), results)
+            self.send_json(200, {'success': True, 'processed': len(results) if applied else 0,
+                                 'errors': 0, 'duplicate': not applied})
+
+    return StubHandler
+
+
+def serve_stub(port_queue, fleet: List[Dict], scale: float, epoch: float,
+               slowdowns_per_hour: float, churn: float, seed: int):
+    """Child process entry point, so the stub's threads and sockets stay out of the agent's numbers"""
+    logging.disable(logging.CRITICAL)
+    helpdesk = StubHelpdesk(fleet, SimClock(scale, epoch), slowdowns_per_hour, churn, seed)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(helpdesk))
+    server.daemon_threads = True
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+class SimulatedNetwork:
+    """
+    Answers probes from per-host RTTs with jitter and occasional loss, and
+    injects outages of a whole branch (with its ATMs), a vendor or a single
+    host at random in simulated time.
+    """
+
+    def __init__(self, fleet: List[Dict], clock: SimClock, outages_per_hour: float, seed: int):
+        self.clock = clock
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.outages_per_hour = outages_per_hour
+        self.outages: List[tuple] = []
+        self.down: set = set()
+        self.started = 0
+        self.update_fleet(fleet)
+        self.next_outage = self.schedule_next(0.0)
+
+    def update_fleet(self, fleet: List[Dict]):
+        with self.lock:
+            self.rtt = {}
+            self.by_branch: Dict[str, set] = {}
+            self.by_vendor: Dict[str, set] = {}
+            for entity in fleet:
+                addresses = [a for a in (entity['ip_address'], entity.get('backup_ip_address')) if a]
+                for address in addresses:
+                    self.rtt[address] = MEDIA_RTT.get(entity.get('network_media'), 50)
+                branch = entity['id'] if entity['type'] == 'BRANCH' else entity.get('branch_id')
+                self.by_branch.setdefault(branch, set()).update(addresses)
+                self.by_vendor.setdefault(entity.get('network_vendor'), set()).update(addresses)
+
+    def schedule_next(self, now: float) -> float:
+        if self.outages_per_hour <= 0:
+            return float('inf')
+        return now + self.rng.expovariate(self.outages_per_hour / 3600)
+
+    def advance(self, now: float):
+        """Start the outages due by `now` and end the expired ones (caller holds the lock)"""
+        changed = False
+        while self.next_outage <= now:
+            kind = self.rng.choices(['host', 'branch', 'vendor'], weights=[6, 3, 1])[0]
+            if kind == 'vendor':
+                hosts = self.by_vendor[self.rng.choice(list(self.by_vendor))]
+            elif kind == 'branch':
+                hosts = self.by_branch[self.rng.choice(list(self.by_branch))]
+            else:
+                hosts = {self.rng.choice(list(self.rtt))}
+            self.outages.append((self.next_outage + self.rng.uniform(*OUTAGE_DURATION), frozenset(hosts)))
+            self.started += 1
+            self.next_outage = self.schedule_next(self.next_outage)
+            changed = True
+        if any(end <= now for end, _ in self.outages):
+            self.outages = [o for o in self.outages if o[0] > now]
+            changed = True
+        if changed:
+            self.down = set().union(*(hosts for _, hosts in self.outages))
+
+    def probe(self, ip_address: str, count: int, timeout_ms: float) -> PingResult:
+        """Like ping_host: count echoes a simulated second apart, each waiting up to the (unscaled) timeout"""
+        with self.lock:
+            self.advance(self.clock.now())
+            down = ip_address in self.down
+            base = self.rtt.get(ip_address)
+            rtts = [] if down or base is None else [
+                base * self.rng.uniform(0.8, 1.6) for _ in range(count) if self.rng.random() > 0.005
+            ]
+
+        result = PingResult(ip_address)
+        if not rtts:
+            self.clock.sleep(count - 1 + timeout_ms / 1000)
+            result.error_message = 'Request timed out' if base is not None else 'Destination host unreachable'
+            classify(result)
+            return result
+
+        self.clock.sleep(count - 1 + max(rtts) / 1000)
+        result.packet_loss = round(100.0 * (count - len(rtts)) / count, 1)
+        result.min_rtt = round(min(rtts), 3)
+        result.max_rtt = round(max(rtts), 3)
+        result.avg_rtt = round(sum(rtts) / len(rtts), 3)
+        result.response_time_ms = result.avg_rtt
+        classify(result)
+        return result
+
+
+class SoakAgent(MonitoringAgent):
+    """MonitoringAgent probing the simulated network and counting the results it hands to the uploader"""
+
+    def __init__(self, config: Config, network: SimulatedNetwork, scale: float):
+        super().__init__(config)
+        self.network = network
+        self.scale = scale
+        self.produced = 0
+        # Retry-After is whole seconds, so the Helpdesk sends none and the fallback backoff is compressed
+        self.backpressure.DEFAULT_RETRY_AFTER = UploadBackpressure.DEFAULT_RETRY_AFTER / scale
+        self.backpressure.MAX_RETRY_AFTER = UploadBackpressure.MAX_RETRY_AFTER / scale
+
+    def probe(self, ip_address: str) -> PingResult:
+        return self.network.probe(ip_address, self.config.ping_count, self.config.ping_timeout * self.scale)
+
+    def fetch_entities(self, on_page=None) -> bool:
+        ok = super().fetch_entities(on_page)
+        if ok:
+            self.network.update_fleet(self.entities)
+        return ok
+
+    def send_results(self, results: List[Dict], group_events: Optional[List[Dict]] = None,
+                     retry: bool = False, confirm: bool = False) -> bool:
+        self.produced += len(results)
+        return super().send_results(results, group_events, retry, confirm)
+
+
+def soak_config(base: Config, scale: float, helpdesk_url: str, work_dir: str, args) -> Dict:
+    """The base configuration pointed at the stub, with every duration and rate compressed"""
+    data = base.scaled(scale).data
+    data.update({
+        'helpdesk_url': helpdesk_url,
+        'api_key': SOAK_API_KEY,
+        'agent_id': 'soak-test',
+        'verify_ssl': False,
+        # Path diagnostics shell out to traceroute, which the simulated network cannot answer
+        'diagnostics_enabled': False,
+        'control_api_enabled': False,
+        'command_channel_enabled': False,
+        # The simulated routers have no SNMP agent to poll
+        'snmp_enabled': False,
+        'upload_async': False,
+        'history_enabled': args.history,
+        'history_path': os.path.join(work_dir, 'history.db'),
+        'export_enabled': args.export,
+        'export_path': os.path.join(work_dir, 'export')
+    })
+    if args.entity_refresh:
+        data['entity_refresh_interval_seconds'] = args.entity_refresh / scale
+    return data
+
+
+def read_resources() -> Dict:
+    """RSS in MB, open file descriptors and threads of this process"""
+    rss = None
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    rss = int(line.split()[1]) / 1024
+                    break
+    except OSError:
+        import resource
+        # Peak rather than current RSS where /proc is missing (KB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        rss = peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+    fds = None
+    for fd_dir in ('/proc/self/fd', '/dev/fd'):
+        if os.path.isdir(fd_dir):
+            fds = len(os.listdir(fd_dir))
+            break
+
+    return {'rss_mb': rss, 'fds': fds, 'threads': threading.active_count()}
+
+
+def log_file_size() -> int:
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, logging.FileHandler):
+            try:
+                return os.path.getsize(handler.baseFilename)
+            except OSError:
+                return 0
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Soak test the agent against a simulated network and Helpdesk')
+    parser.add_argument('config', nargs='?', help='agent config to start from (default: built-in defaults)')
+    parser.add_argument('--cycles', type=int, default=2000, help='ping cycles to run')
+    parser.add_argument('--entities', type=int, default=300, help='approximate fleet size')
+    parser.add_argument('--atms-per-branch', type=int, default=2, help='ATMs behind each branch')
+    parser.add_argument('--time-scale', type=float, default=120, help='simulated seconds per real second')
+    parser.add_argument('--outages-per-hour', type=float, default=6, help='injected network outages per simulated hour')
+    parser.add_argument('--slowdowns-per-hour', type=float, default=1, help='injected Helpdesk slowdowns per simulated hour')
+    parser.add_argument('--churn', type=float, default=0.02, help='share of ATMs replaced on each entity refresh')
+    parser.add_argument('--entity-refresh', type=float, help='simulated seconds between entity refreshes')
+    parser.add_argument('--report-every', type=int, default=100, help='cycles per report line')
+    parser.add_argument('--history', action='store_true', help='also record to the local history store')
+    parser.add_argument('--export', action='store_true', help='also export Parquet files')
+    parser.add_argument('--work-dir', help='directory for config, history and export (default: a temp dir)')
+    parser.add_argument('--seed', type=int, default=1, help='random seed for the fleet and injected faults')
+    parser.add_argument('--max-rss-growth-mb', type=float, default=50, help='allowed RSS growth after the first window')
+    parser.add_argument('--max-fd-growth', type=int, default=8, help='allowed descriptor growth after the first window')
+    parser.add_argument('--max-thread-growth', type=int, default=2, help='allowed thread growth after the first window')
+    parser.add_argument('--late-after', type=float, default=0.1,
+                        help='a cycle starting this share of the ping interval after it was due is late')
+    parser.add_argument('--max-late-share', type=float, default=0.05, help='allowed share of late cycles')
+    parser.add_argument('--verbose', action='store_true', help='also print the agent log to the console')
+    args = parser.parse_args()
+
+    if not args.verbose:
+        root = logging.getLogger()
+        for handler in [h for h in root.handlers if not isinstance(h, logging.FileHandler)]:
+            root.removeHandler(handler)
+
+    scale = args.time_scale
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='agent-soak-')
+    os.makedirs(work_dir, exist_ok=True)
+    clock = SimClock(scale)
+    fleet = build_fleet(max(1, args.entities // (1 + args.atms_per_branch)), args.atms_per_branch, args.seed)
+
+    port_queue = multiprocessing.Queue()
+    stub = multiprocessing.Process(target=serve_stub, daemon=True, args=(
+        port_queue, fleet, scale, clock.epoch, args.slowdowns_per_hour, args.churn, args.seed))
+    stub.start()
+    helpdesk_url = f"http://127.0.0.1:{port_queue.get(timeout=30)}"
+
+    base = Config(args.config) if args.config else Config(os.path.join(work_dir, 'base.json'), data={})
+    config_path = os.path.join(work_dir, 'config.json')
+    with open(config_path, 'w') as f:
+        json.dump(soak_config(base, scale, helpdesk_url, work_dir, args), f, indent=2)
+    config = Config(config_path)
+    try:
+        config.validate()
+    except ValueError as e:
+        logger.error(f"Invalid configuration: {e}")
+        sys.exit(1)
+
+    network = SimulatedNetwork(fleet, clock, args.outages_per_hour, args.seed)
+    agent = SoakAgent(config, network, scale)
+    if not agent.load_initial_entities():
+        logger.error("Stub Helpdesk did not serve the entity list")
+        sys.exit(1)
+    agent.start_history_store()
+    agent.start_exporter()
+
+    interval = config.ping_interval
+    print(f"Soak test: {args.cycles} cycles over {len(fleet)} entities at {scale:g}x "
+          f"({base.ping_interval}s interval = {interval * 1000:.0f} ms), work dir {work_dir}")
+    print(f"{'cycle':>6} {'sim h':>6} {'rss MB':>7} {'fds':>4} {'thr':>4} {'log MB':>7} "
+          f"{'late p95':>8} {'drift':>7} {'cycle p95':>9} {'lag p50':>7} {'lag p95':>7} {'lag max':>7} "
+          f"{'spool':>6} {'outages':>7} {'slow':>4} {'503s':>4}")
+
+    stats_url = f"{helpdesk_url}/soak/stats"
+    samples: List[Dict] = []
+    late: List[float] = []
+    durations: List[float] = []
+    delivered = 0
+    errors = 0
+    all_late: List[float] = []
+    all_durations: List[float] = []
+    log_start = log_file_size()
+    first_start = time.monotonic()
+    previous_start = None
+
+    for cycle in range(1, args.cycles + 1):
+        cycle_start = time.monotonic()
+        # The agent schedules each cycle from the previous start, so late starts accumulate into drift
+        if previous_start is not None:
+            late.append(max(0.0, cycle_start - previous_start - interval))
+        previous_start = cycle_start
+        drift = cycle_start - first_start - (cycle - 1) * interval
+        try:
+            agent.run_once()
+        except Exception as e:
+            errors += 1
+            logger.error(f"Unexpected error: {e}")
+        durations.append(time.monotonic() - cycle_start)
+
+        if cycle % args.report_every == 0 or cycle == args.cycles:
+            stats = requests.get(stats_url, timeout=10).json()
+            delivered += stats['received']
+            sample = dict(read_resources(), cycle=cycle, log_mb=(log_file_size() - log_start) / (1024 * 1024))
+            samples.append(sample)
+            all_late.extend(late)
+            all_durations.extend(durations)
+            spooled = sum(len(b['results']) for b in agent.spool)
+            print(f"{cycle:>6} {clock.now() / 3600:>6.1f} {sample['rss_mb']:>7.1f} {sample['fds'] or '-':>4} "
+                  f"{sample['threads']:>4} {sample['log_mb']:>7.1f} "
+                  f"{percentile(late, 95) * scale:>7.1f}s {drift * scale:>6.0f}s "
+                  f"{percentile(durations, 95) * scale:>8.1f}s "
+                  f"{stats['lag_p50']:>6.1f}s {stats['lag_p95']:>6.1f}s {stats['lag_max']:>6.0f}s "
+                  f"{spooled:>6} {network.started:>7} {stats['slowdowns']:>4} {stats['rejected']:>4}", flush=True)
+            late.clear()
+            durations.clear()
+
+        if cycle < args.cycles:
+            agent.wait_for_next_cycle(cycle_start)
+
+    if agent.history:
+        agent.history.close()
+    if agent.exporter:
+        agent.exporter.close()
+    stub.terminate()
+
+    elapsed = time.monotonic() - first_start
+    spooled = sum(len(b['results']) for b in agent.spool)
+    print(f"\n{args.cycles} cycles in {elapsed:.0f}s ({elapsed * scale / 3600:.1f} simulated hours), "
+          f"{errors} cycle errors")
+    print(f"results: {agent.produced} produced, {delivered} delivered, {spooled} still spooled, "
+          f"{agent.metrics['spool_dropped_results']} dropped from the spool")
+    print(f"log: {samples[-1]['log_mb']:.1f} MB written, {(log_file_size() - log_start) / args.cycles:.0f} bytes per cycle")
+
+    # Growth is measured from the end of the first window, after caches and pools have warmed up
+    warm, last = samples[0], samples[-1]
+    checks = [
+        ('threads', last['threads'] - warm['threads'], args.max_thread_growth),
+        ('file descriptors', (last['fds'] or 0) - (warm['fds'] or 0), args.max_fd_growth),
+        ('RSS MB', last['rss_mb'] - warm['rss_mb'], args.max_rss_growth_mb),
+    ]
+    failed = False
+    for name, growth, allowed in checks:
+        ok = growth <= allowed
+        failed |= not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {name} grew by {growth:g} after cycle {warm['cycle']} (allowed {allowed:g})")
+    late_share = sum(1 for t in all_late if t > args.late_after * interval) / max(1, len(all_late))
+    ok = late_share <= args.max_late_share
+    failed |= not ok
+    print(f"{'ok  ' if ok else 'FAIL'} {late_share:.1%} of cycles started over "
+          f"{args.late_after * base.ping_interval:g}s late (p95 {percentile(all_late, 95) * scale:.1f}s, "
+          f"max {max(all_late, default=0) * scale:.0f}s, allowed {args.max_late_share:.0%} late)")
+    if percentile(all_durations, 50) > 0.9 * interval:
+        print(f"note: the median cycle took {percentile(all_durations, 50) * 1000:.0f} ms of the "
+              f"{interval * 1000:.0f} ms interval, lower --time-scale to tell agent delays from harness overhead")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
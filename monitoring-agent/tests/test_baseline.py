@@ -0,0 +1,74 @@
+import pytest
+
+from agent import RttBaseline
+
+# enter above max(mean * 2, mean + 5), leave below max(mean * 1.5, mean + 2.5)
+THRESHOLDS = dict(warmup_samples=3, enter_factor=2.0, exit_factor=1.5, min_delta_ms=5.0, fallback_ms=100.0)
+
+
+def warmed_up(mean: float = 10.0) -> RttBaseline:
+    baseline = RttBaseline(alpha=0.5)
+    for _ in range(THRESHOLDS['warmup_samples']):
+        assert not baseline.classify(mean, **THRESHOLDS)
+    return baseline
+
+
+def test_ewma_starts_at_first_sample_and_moves_by_alpha():
+    baseline = RttBaseline(alpha=0.25)
+    baseline.update(20.0)
+    assert baseline.mean == 20.0
+    baseline.update(40.0)
+    assert baseline.mean == pytest.approx(25.0)
+    baseline.update(25.0, alpha=1.0)
+    assert baseline.mean == pytest.approx(25.0)
+    assert baseline.samples == 3
+
+
+def test_fallback_threshold_applies_until_warmed_up():
+    baseline = RttBaseline(alpha=0.5)
+    assert baseline.classify(150.0, **THRESHOLDS)
+    assert not baseline.classify(50.0, **THRESHOLDS)
+    assert baseline.samples == 2
+
+
+def test_slow_is_entered_and_left_at_different_thresholds():
+    baseline = warmed_up()
+    assert baseline.mean == pytest.approx(10.0)
+
+    # Between the exit and enter thresholds: not slow while fast
+    assert not baseline.classify(18.0, **THRESHOLDS)
+    baseline.mean = 10.0
+    assert baseline.classify(21.0, **THRESHOLDS)
+    # ... but still slow once slow
+    baseline.mean = 10.0
+    assert baseline.classify(18.0, **THRESHOLDS)
+    baseline.mean = 10.0
+    assert not baseline.classify(14.0, **THRESHOLDS)
+
+
+def test_min_delta_widens_the_bands_for_fast_links():
+    baseline = RttBaseline(alpha=0.5)
+    for _ in range(3):
+        baseline.classify(1.0, **THRESHOLDS)
+    # Twice a 1 ms mean is not slow; mean + min_delta_ms is the bar
+    assert not baseline.classify(5.5, **THRESHOLDS)
+    baseline.mean = 1.0
+    assert baseline.classify(6.5, **THRESHOLDS)
+
+
+def test_slow_samples_only_nudge_the_mean():
+    baseline = warmed_up()
+    baseline.classify(50.0, **THRESHOLDS)
+    assert baseline.mean == pytest.approx(10.0 + 0.05 * 40.0)
+
+    baseline = warmed_up()
+    baseline.classify(12.0, **THRESHOLDS)
+    assert baseline.mean == pytest.approx(11.0)
+
+
+def test_classify_without_learning_leaves_the_baseline_alone():
+    baseline = warmed_up()
+    assert baseline.classify(50.0, **THRESHOLDS, learn=False)
+    assert baseline.mean == pytest.approx(10.0)
+    assert baseline.samples == 3
+    assert not baseline.slow
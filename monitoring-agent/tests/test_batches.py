@@ -0,0 +1,57 @@
+import pytest
+
+from agent import Config, MonitoringAgent
+
+
+@pytest.fixture
+def agent(tmp_path):
+    config = Config(str(tmp_path / 'config.json'), data={
+        'helpdesk_url': 'http://helpdesk.invalid',
+        'api_key': 'test',
+        'upload_batch_size': 3,
+        'upload_min_batch_size': 1
+    })
+    return MonitoringAgent(config)
+
+
+def rows(*entity_ids):
+    return [{'entity_id': entity_id, 'status': 'ONLINE'} for entity_id in entity_ids]
+
+
+def test_batches_get_fresh_ids_and_consecutive_sequences(agent):
+    batches = agent.build_batches(rows('a', 'b', 'c', 'd', 'e', 'f', 'g'))
+    assert [len(b['results']) for b in batches] == [3, 3, 1]
+    assert [b['sequence'] for b in batches] == [1, 2, 3]
+    assert len({b['batch_id'] for b in batches}) == 3
+
+    # The sequence carries on across cycles of the same run
+    later = agent.build_batches(rows('a'))
+    assert later[0]['sequence'] == 4
+    assert later[0]['batch_id'] not in {b['batch_id'] for b in batches}
+
+
+def test_batches_carry_the_run_boot_id(agent, tmp_path):
+    batches = agent.build_batches(rows('a', 'b', 'c', 'd'))
+    assert {b['boot_id'] for b in batches} == {agent.boot_id}
+
+    # A restarted agent starts over at 1 under a new boot id
+    restarted = MonitoringAgent(agent.config).build_batches(rows('a'))
+    assert restarted[0]['sequence'] == 1
+    assert restarted[0]['boot_id'] != agent.boot_id
+
+
+def test_rows_of_one_entity_stay_in_one_batch(agent):
+    batches = agent.build_batches(rows('a', 'b', 'b', 'c', 'c', 'c'))
+    assert [[r['entity_id'] for r in b['results']] for b in batches] == [['a', 'b', 'b'], ['c', 'c', 'c']]
+
+
+def test_group_events_ride_on_the_first_batch(agent):
+    events = [{'group_type': 'MEDIA', 'group_key': 'VSAT', 'status': 'OFFLINE'}]
+    batches = agent.build_batches(rows('a', 'b', 'c', 'd'), events)
+    assert batches[0]['group_events'] == events
+    assert 'group_events' not in batches[1]
+
+    # Group events are sent even when no rows are left
+    only_events = agent.build_batches([], events)
+    assert only_events == [{'results': [], 'group_events': events, 'sequence': 1 + len(batches),
+                            'boot_id': agent.boot_id, 'batch_id': only_events[0]['batch_id']}]
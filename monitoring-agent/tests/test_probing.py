@@ -0,0 +1,83 @@
+import pytest
+
+import probing
+from probing import TokenBucket, RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(probing.time, 'monotonic', clock.monotonic)
+    return clock
+
+
+def send_greedily(limiter: RateLimiter, keys, packets: int, duration: float, clock: FakeClock):
+    """Send pings of `packets` whenever the limiter allows, for `duration` seconds; their start times"""
+    started = clock.now
+    sends = []
+    while clock.now - started < duration:
+        if limiter.try_acquire(keys, packets):
+            sends.append(clock.now - started)
+        else:
+            clock.now += max(limiter.wait_time(keys, packets), 0.001)
+    return sends
+
+
+@pytest.mark.parametrize('limit, ping_count', [(1, 3), (2, 5), (0.5, 3), (10, 3)])
+def test_link_limit_holds_when_below_ping_count(clock, limit, ping_count):
+    limiter = RateLimiter({'branch': limit})
+    keys = [('branch', 'b1')]
+    sends = send_greedily(limiter, keys, ping_count, 60, clock)
+
+    assert len(sends) > 1
+    # Beyond one initial burst (a full bucket, or a single ping), packets never outrun the limit
+    burst = max(limit, 1, ping_count)
+    for i, started in enumerate(sends):
+        assert (i + 1) * ping_count <= limit * started + burst + 1e-6
+
+
+def test_reported_case_one_pps_three_packet_pings(clock):
+    limiter = RateLimiter({'branch': 1})
+    keys = [('branch', 'b1')]
+    assert limiter.try_acquire(keys, 3)
+    assert not limiter.try_acquire(keys, 3)
+    assert limiter.wait_time(keys, 3) == pytest.approx(3.0)
+    clock.now += 2.9
+    assert not limiter.try_acquire(keys, 3)
+    clock.now += 0.1
+    assert limiter.try_acquire(keys, 3)
+
+
+def test_request_within_capacity_is_not_held_back(clock):
+    bucket = TokenBucket(rate=5, capacity=10)
+    for _ in range(10):
+        assert bucket.try_acquire(1)
+    assert not bucket.try_acquire(1)
+    assert bucket.wait_time(1) == pytest.approx(0.2)
+    clock.now += 0.2
+    assert bucket.try_acquire(1)
+
+
+def test_acquire_takes_from_every_bucket_or_none(clock):
+    limiter = RateLimiter({'network_media': {'VSAT': 10}, 'branch': 1})
+    keys = limiter.keys_for({'id': 'b1', 'type': 'BRANCH', 'network_media': 'VSAT'})
+    assert sorted(keys) == [('branch', 'b1'), ('network_media', 'VSAT')]
+    assert limiter.try_acquire(keys, 1)
+    # The branch bucket is empty, so the VSAT bucket must not be charged either
+    assert not limiter.try_acquire(keys, 1)
+    assert limiter.buckets[('network_media', 'VSAT')].tokens == pytest.approx(9)
+
+
+def test_configure_keeps_debt(clock):
+    bucket = TokenBucket(rate=1)
+    assert bucket.try_acquire(4)
+    bucket.configure(rate=2)
+    assert bucket.wait_time(1) == pytest.approx(2.0)
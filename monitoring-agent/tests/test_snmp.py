@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+
+from snmp_collector import (
+    SnmpCollector, SnmpSession, encode_message, decode_message, encode_length, decode_tlv,
+    INTEGER, OCTET_STRING, NULL, OBJECT_IDENTIFIER, IP_ADDRESS, COUNTER32, COUNTER64, END_OF_MIB_VIEW,
+    GET_REQUEST, GET_RESPONSE, GET_BULK_REQUEST, POLLED_COLUMNS,
+    IF_NAME, IF_OPER_STATUS, IF_HIGH_SPEED, IF_HC_IN_OCTETS, IF_HC_OUT_OCTETS, HR_PROCESSOR_LOAD, CISCO_CPU_1MIN
+)
+from snmp_standin import SyntheticRouter, StandinProtocol
+
+
+class Loopback:
+    """Datagram transport handing every packet straight to the other end, no sockets involved"""
+
+    def __init__(self, peer: asyncio.DatagramProtocol):
+        self.peer = peer
+
+    def sendto(self, data: bytes, addr=None):
+        self.peer.datagram_received(data, ('127.0.0.1', 161))
+
+
+def connect(router: SyntheticRouter, community: str = 'public', drop: float = 0.0) -> SnmpSession:
+    standin = StandinProtocol(router, community, drop)
+    session = SnmpSession()
+    session.connection_made(Loopback(standin))
+    standin.connection_made(Loopback(session))
+    return session
+
+
+@pytest.mark.parametrize('tag, value', [
+    (INTEGER, 0),
+    (INTEGER, -129),
+    (INTEGER, 2 ** 31 - 1),
+    (COUNTER32, 2 ** 32 - 1),
+    (COUNTER64, 2 ** 64 - 1),
+    (OCTET_STRING, b'GigabitEthernet0/0'),
+    (OBJECT_IDENTIFIER, (1, 3, 6, 1, 4, 1, 9, 9, 109, 300000)),
+    (IP_ADDRESS, '10.20.30.40'),
+    (NULL, None),
+    (END_OF_MIB_VIEW, None),
+])
+def test_values_survive_a_round_trip(tag, value):
+    data = encode_message(GET_RESPONSE, 42, 'public', [(IF_NAME + (1,), tag, value)])
+    message = decode_message(data)
+    assert message['varbinds'] == [(IF_NAME + (1,), tag, value)]
+
+
+def test_message_fields_survive_a_round_trip():
+    data = encode_message(GET_BULK_REQUEST, 0x7FFFFFFF, 'secret', [(IF_NAME, NULL, None)],
+                          error_status=1, error_index=25)
+    message = decode_message(data)
+    assert message['version'] == 1
+    assert message['community'] == 'secret'
+    assert message['pdu_type'] == GET_BULK_REQUEST
+    assert (message['request_id'], message['error_status'], message['error_index']) == (0x7FFFFFFF, 1, 25)
+
+
+def test_long_form_lengths():
+    assert encode_length(127) == b'\x7f'
+    assert encode_length(128) == b'\x81\x80'
+    assert encode_length(300) == b'\x82\x01\x2c'
+
+    name = b'x' * 1000
+    message = decode_message(encode_message(GET_RESPONSE, 1, 'public', [(IF_NAME + (1,), OCTET_STRING, name)]))
+    assert message['varbinds'][0][2] == name
+
+
+def test_truncated_message_is_rejected():
+    data = encode_message(GET_REQUEST, 7, 'public', [(IF_NAME + (1,), NULL, None)])
+    with pytest.raises(ValueError):
+        decode_message(data[:-3])
+    with pytest.raises(ValueError):
+        decode_tlv(b'\x04', 0)
+
+
+@pytest.mark.parametrize('max_repetitions', [1, 3, 10])
+def test_walk_reads_every_column_of_the_standin(max_repetitions):
+    router = SyntheticRouter(interfaces=4, speed_mbps=100, load=0.5, cpu=20)
+    collector = SnmpCollector(lambda: [], max_repetitions=max_repetitions)
+    table = asyncio.run(collector.walk(connect(router), POLLED_COLUMNS))
+
+    indexes = [(1,), (2,), (3,), (4,)]
+    assert table[IF_NAME] == {(i,): f"Gi0/{i - 1}".encode() for i, in indexes}
+    assert table[IF_OPER_STATUS] == {(1,): 1, (2,): 1, (3,): 1, (4,): 2}
+    assert table[IF_HIGH_SPEED] == {index: 100 for index in indexes}
+    assert sorted(table[IF_HC_IN_OCTETS]) == indexes
+    assert sorted(table[IF_HC_OUT_OCTETS]) == indexes
+    assert list(table[HR_PROCESSOR_LOAD]) == [(1,)]
+    # The stand-in has no Cisco CPU table
+    assert table[CISCO_CPU_1MIN] == {}
+
+
+def test_two_walks_give_utilization_of_up_interfaces():
+    router = SyntheticRouter(interfaces=3, speed_mbps=100, load=0.5, cpu=20)
+    collector = SnmpCollector(lambda: [])
+    session = connect(router)
+
+    first = collector.build_sample('b1', asyncio.run(collector.walk(session, POLLED_COLUMNS)), 0.0)
+    assert first['interfaces'] == [] and first['max_utilization'] is None
+    # Ten seconds of traffic on the router, ten seconds between the collector's readings
+    router.started -= 10
+    sample = collector.build_sample('b1', asyncio.run(collector.walk(session, POLLED_COLUMNS)), 10.0)
+
+    # Interface 3 is down and left out
+    assert [i['if_index'] for i in sample['interfaces']] == [1, 2]
+    for interface in sample['interfaces']:
+        assert 48.0 <= interface['in_utilization'] <= 50.5
+        assert 19.0 <= interface['out_utilization'] <= 20.5
+    assert 15 <= sample['cpu_percent'] <= 25
+
+
+def test_unanswered_requests_time_out():
+    router = SyntheticRouter(interfaces=2, speed_mbps=100, load=0.5, cpu=20)
+    collector = SnmpCollector(lambda: [], timeout_ms=10, retries=1)
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(collector.walk(connect(router, drop=1.0), POLLED_COLUMNS))
+
+
+def test_wrong_community_is_ignored():
+    router = SyntheticRouter(interfaces=2, speed_mbps=100, load=0.5, cpu=20)
+    collector = SnmpCollector(lambda: [], community='private', timeout_ms=10, retries=0)
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(collector.walk(connect(router), POLLED_COLUMNS))
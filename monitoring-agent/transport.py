@@ -0,0 +1,241 @@
+"""
+Upload transport for the Network Monitoring Agent
+Pooled keep-alive HTTP client for talking to the Helpdesk, using HTTP/2 when httpx is installed
+"""
+
+import time
+import socket
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+try:
+    import httpx
+    import h2  # noqa: F401 - httpx needs it for HTTP/2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    httpx = None
+    HTTP2_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+CONNECT_TIMEOUT_SECONDS = 10
+
+
+class TransportError(Exception):
+    """Network-level failure talking to the Helpdesk (no HTTP response)"""
+
+
+def keepalive_socket_options(idle: int = 30, interval: int = 10, probes: int = 3) -> List[Tuple]:
+    """
+    TCP keep-alive options so idle pooled connections survive NAT and firewall
+    timeouts on long links. Platforms without the TCP_KEEP* tunables only get SO_KEEPALIVE.
+    """
+    options = [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    if hasattr(socket, 'TCP_KEEPIDLE'):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle))
+    elif hasattr(socket, 'TCP_KEEPALIVE'):
+        # macOS spells TCP_KEEPIDLE differently
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, idle))
+    if hasattr(socket, 'TCP_KEEPINTVL'):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, interval))
+    if hasattr(socket, 'TCP_KEEPCNT'):
+        options.append((socket.IPPROTO_TCP, socket.TCP_KEEPCNT, probes))
+    return options
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    """requests adapter with an explicit pool size and TCP keep-alive on every pooled socket"""
+
+    def __init__(self, pool_size: int = 10, keepalive: bool = True, **kwargs):
+        self.socket_options = HTTPConnection.default_socket_options + (
+            keepalive_socket_options() if keepalive else []
+        )
+        super().__init__(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = self.socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+
+def mount_keepalive(session: requests.Session, pool_size: int, keepalive: bool = True):
+    """Replace the default adapters of a requests session with pooled keep-alive ones"""
+    adapter = KeepAliveAdapter(pool_size=pool_size, keepalive=keepalive)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+
+class UploadTransport:
+    """
+    Thread-safe HTTP client used for result uploads.
+    With upload_http2 enabled and httpx[http2] installed, all in-flight batches
+    are multiplexed over one HTTP/2 connection; otherwise a requests session
+    with a pool of upload_pool_size keep-alive HTTP/1.1 connections is used,
+    one connection per in-flight batch.
+    """
+
+    def __init__(self, config):
+        self.lock = threading.Lock()
+        self.settings: Optional[tuple] = None
+        self.client = None
+        self.http2 = False
+        self.configure(config)
+
+    @staticmethod
+    def settings_for(config) -> tuple:
+        return (config.upload_pool_size, config.upload_keepalive, config.upload_http2,
+                config.upload_timeout, config.verify_ssl)
+
+    def configure(self, config):
+        """(Re)build the client when connection settings change; headers are passed per request"""
+        settings = self.settings_for(config)
+        if settings == self.settings:
+            return
+        pool_size, keepalive, want_http2, timeout, verify = settings
+
+        if want_http2 and not HTTP2_AVAILABLE:
+            logger.warning("upload_http2 is enabled but httpx[http2] is not installed, using HTTP/1.1")
+
+        if want_http2 and HTTP2_AVAILABLE:
+            client = httpx.Client(
+                http2=True,
+                verify=verify,
+                timeout=httpx.Timeout(timeout, connect=CONNECT_TIMEOUT_SECONDS),
+                transport=httpx.HTTPTransport(
+                    http2=True,
+                    verify=verify,
+                    limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+                    socket_options=keepalive_socket_options() if keepalive else None
+                )
+            )
+            http2 = True
+        else:
+            client = requests.Session()
+            client.verify = verify
+            mount_keepalive(client, pool_size, keepalive)
+            http2 = False
+
+        with self.lock:
+            old = self.client
+            self.client, self.http2, self.settings = client, http2, settings
+        if old is not None:
+            old.close()
+        logger.info(f"Upload transport: {'HTTP/2' if http2 else 'HTTP/1.1'}, pool of {pool_size}, "
+                    f"keep-alive {'on' if keepalive else 'off'}")
+
+    def post(self, url: str, payload: Dict, headers: Dict):
+        """
+        POST a JSON payload and return the response (status_code, text and json()
+        behave the same for both clients). Raises TransportError on network failures.
+        """
+        client = self.client
+        timeout = self.settings[3]
+        try:
+            if self.http2:
+                return client.post(url, json=payload, headers=headers)
+            return client.post(url, json=payload, headers=headers, timeout=(CONNECT_TIMEOUT_SECONDS, timeout))
+        except requests.RequestException as e:
+            raise TransportError(str(e)) from e
+        except Exception as e:
+            if httpx is not None and isinstance(e, httpx.HTTPError):
+                raise TransportError(str(e)) from e
+            raise
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+
+
+class UploadBackpressure:
+    """
+    AIMD control of the upload batch size and send rate from Helpdesk signals.
+    The batch size grows by a fixed step after each fast, accepted batch and is
+    halved on 429/503/413, timeouts or slow responses; it never exceeds the
+    configured upload_batch_size nor the server's advertised X-Max-Batch-Size.
+    Retry-After sets a time before which no batch is sent, and
+    X-Ingest-Credits caps how many batches are put in flight.
+    """
+
+    DEFAULT_RETRY_AFTER = 5
+    MAX_RETRY_AFTER = 300
+
+    def __init__(self, config):
+        self.lock = threading.Lock()
+        self.batch_size = config.upload_batch_size
+        self.server_max: Optional[int] = None
+        self.credits: Optional[int] = None
+        self.not_before = 0.0
+        self.throttled = 0
+        self.configure(config)
+
+    def configure(self, config):
+        self.ceiling = config.upload_batch_size
+        self.floor = min(config.upload_min_batch_size, self.ceiling)
+        self.increase = config.upload_batch_increase
+        self.target_latency = config.upload_target_latency_ms / 1000
+        with self.lock:
+            self.batch_size = min(max(self.floor, self.batch_size), self._limit())
+
+    def delay(self) -> float:
+        """Seconds until the Helpdesk said it is ready for more"""
+        return max(0.0, self.not_before - time.monotonic())
+
+    def pipeline_depth(self, configured: int) -> int:
+        with self.lock:
+            if self.credits is None:
+                return configured
+            return max(1, min(configured, self.credits))
+
+    def _decrease(self):
+        self.batch_size = max(self.floor, self.batch_size // 2)
+
+    def _limit(self) -> int:
+        return min(self.ceiling, self.server_max) if self.server_max else self.ceiling
+
+    @staticmethod
+    def _header_int(response, name: str) -> Optional[int]:
+        try:
+            return int(response.headers.get(name))
+        except (TypeError, ValueError):
+            return None
+
+    def on_response(self, response, elapsed: float):
+        """Adjust from a Helpdesk response and how long it took"""
+        with self.lock:
+            advertised = self._header_int(response, 'X-Max-Batch-Size')
+            if advertised:
+                self.server_max = max(1, advertised)
+            credits = self._header_int(response, 'X-Ingest-Credits')
+            if credits is not None:
+                self.credits = credits
+
+            if response.status_code in (429, 503):
+                self.throttled += 1
+                retry_after = self._header_int(response, 'Retry-After')
+                if retry_after is None:
+                    retry_after = self.DEFAULT_RETRY_AFTER * 2 ** min(self.throttled - 1, 6)
+                self.not_before = time.monotonic() + min(retry_after, self.MAX_RETRY_AFTER)
+                self._decrease()
+            elif response.status_code == 413:
+                self._decrease()
+            elif response.status_code in (200, 202):
+                # 202: accepted into the Helpdesk's ingest queue (upload_async)
+                self.throttled = 0
+                if elapsed > self.target_latency:
+                    self._decrease()
+                else:
+                    self.batch_size += self.increase
+            # The Helpdesk's limit wins over the local floor
+            self.batch_size = min(max(self.floor, self.batch_size), self._limit())
+
+    def on_error(self):
+        """Network failure or timeout: treat like an overloaded Helpdesk"""
+        with self.lock:
+            self.throttled += 1
+            self.not_before = time.monotonic() + min(self.DEFAULT_RETRY_AFTER * 2 ** min(self.throttled - 1, 6),
+                                                     self.MAX_RETRY_AFTER)
+            self._decrease()
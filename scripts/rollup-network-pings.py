@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Compact network ping results into 5-minute and hourly rollups
+Run with: python3 scripts/rollup-network-pings.py
+
+Requires psycopg2 (pip install psycopg2-binary). DATABASE_URL is read from
+the environment or the project's .env file.
+
+Can be scheduled via cron:
+*/15 * * * * cd /path/to/project && python3 scripts/rollup-network-pings.py >> logs/rollup.log 2>&1
+
+Each run
+  1. rolls raw results up into network_ping_rollups a few hours at a time,
+     one transaction per window, recomputing the most recent buckets so
+     results uploaded late (agent spool replays) are still counted
+  2. deletes raw results past --raw-days once they are rolled up, in batches
+  3. deletes rollups past their retention, in batches
+A run that hits --max-seconds stops between windows; the next run carries on
+from the last rolled-up bucket.
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+# Bucket sizes in minutes
+RESOLUTIONS = (5, 60)
+
+# A bucket is rolled up once it has been closed this long
+SETTLE_MINUTES = 10
+
+# Buckets this recent are recomputed on every run to pick up late results
+LATE_MINUTES = 120
+
+# Retention defaults, mirrored by lib/monitoring/ping-rollups.ts
+RAW_RETENTION_DAYS = 7
+FIVE_MINUTE_RETENTION_DAYS = 90
+HOURLY_RETENTION_DAYS = 730
+
+BUCKET_SQL = """date_trunc('hour', "checkedAt")
+    + (floor(extract(minute FROM "checkedAt") / %(minutes)s) * %(minutes)s)::integer * interval '1 minute'"""
+
+ROLLUP_SQL = f"""
+INSERT INTO network_ping_rollups (
+    "entityType", "entityId", "bucketMinutes", "bucketStart", "sampleCount",
+    "onlineCount", "slowCount", "offlineCount", "timeoutCount", "errorCount",
+    "rttCount", "minRtt", "avgRtt", "maxRtt", "p95Rtt", "avgPacketLoss", "computedAt"
+)
+SELECT
+    "entityType",
+    "entityId",
+    %(minutes)s,
+    {BUCKET_SQL} AS bucket,
+    count(*),
+    count(*) FILTER (WHERE "status" = 'ONLINE'),
+    count(*) FILTER (WHERE "status" = 'SLOW'),
+    count(*) FILTER (WHERE "status" = 'OFFLINE'),
+    count(*) FILTER (WHERE "status" = 'TIMEOUT'),
+    count(*) FILTER (WHERE "status" = 'ERROR'),
+    count(*) FILTER (WHERE "responseTimeMs" > 0),
+    min(COALESCE("minRtt", "responseTimeMs")) FILTER (WHERE "responseTimeMs" > 0),
+    avg("responseTimeMs") FILTER (WHERE "responseTimeMs" > 0),
+    max(COALESCE("maxRtt", "responseTimeMs")) FILTER (WHERE "responseTimeMs" > 0),
+    percentile_cont(0.95) WITHIN GROUP (ORDER BY "responseTimeMs") FILTER (WHERE "responseTimeMs" > 0),
+    avg("packetLoss"),
+    now() AT TIME ZONE 'UTC'
+FROM network_ping_results
+WHERE "checkedAt" >= %(start)s AND "checkedAt" < %(end)s
+GROUP BY "entityType", "entityId", bucket
+ON CONFLICT ("entityType", "entityId", "bucketMinutes", "bucketStart") DO UPDATE SET
+    "sampleCount" = EXCLUDED."sampleCount",
+    "onlineCount" = EXCLUDED."onlineCount",
+    "slowCount" = EXCLUDED."slowCount",
+    "offlineCount" = EXCLUDED."offlineCount",
+    "timeoutCount" = EXCLUDED."timeoutCount",
+    "errorCount" = EXCLUDED."errorCount",
+    "rttCount" = EXCLUDED."rttCount",
+    "minRtt" = EXCLUDED."minRtt",
+    "avgRtt" = EXCLUDED."avgRtt",
+    "maxRtt" = EXCLUDED."maxRtt",
+    "p95Rtt" = EXCLUDED."p95Rtt",
+    "avgPacketLoss" = EXCLUDED."avgPacketLoss",
+    "computedAt" = EXCLUDED."computedAt"
+"""
+
+DELETE_RAW_SQL = """
+DELETE FROM network_ping_results
+WHERE id IN (
+    SELECT id FROM network_ping_results WHERE "checkedAt" < %(before)s LIMIT %(limit)s
+)
+"""
+
+DELETE_ROLLUPS_SQL = """
+DELETE FROM network_ping_rollups
+WHERE ctid IN (
+    SELECT ctid FROM network_ping_rollups
+    WHERE "bucketMinutes" = %(minutes)s AND "bucketStart" < %(before)s
+    LIMIT %(limit)s
+)
+"""
+
+
+def log(message: str):
+    print(f"[{datetime.now(timezone.utc).isoformat()}] {message}", flush=True)
+
+
+def utcnow() -> datetime:
+    """Current time as a naive UTC datetime, matching the timestamp columns"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def floor_to(moment: datetime, minutes: int) -> datetime:
+    moment = moment.replace(second=0, microsecond=0)
+    return moment - timedelta(minutes=moment.minute % minutes)
+
+
+def load_database_url() -> str:
+    """DATABASE_URL from the environment, falling back to the project's .env"""
+    url = os.environ.get('DATABASE_URL')
+    if url:
+        return url
+
+    env_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.env')
+    if os.path.exists(env_path):
+        with open(env_path) as f:
+            for line in f:
+                key, sep, value = line.strip().partition('=')
+                if sep and key.strip() == 'DATABASE_URL':
+                    return value.strip().strip('"').strip("'")
+    return ''
+
+
+def connect(url: str):
+    """
+    Connect with a Prisma-style URL; libpq does not know Prisma's `schema`
+    parameter, so it becomes the search_path
+    """
+    parts = urlsplit(url)
+    params = dict(parse_qsl(parts.query))
+    schema = params.pop('schema', None)
+    for prisma_only in ('connection_limit', 'pool_timeout', 'pgbouncer', 'statement_cache_size'):
+        params.pop(prisma_only, None)
+    dsn = urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(params), parts.fragment))
+
+    conn = psycopg2.connect(dsn)
+    if schema:
+        with conn.cursor() as cur:
+            cur.execute('SET search_path TO %s', (schema,))
+        conn.commit()
+    return conn
+
+
+def rollup_start(cur, minutes: int) -> datetime:
+    """First bucket to (re)compute: shortly before the last rolled-up bucket, or the oldest raw result"""
+    cur.execute('SELECT max("bucketStart") FROM network_ping_rollups WHERE "bucketMinutes" = %s', (minutes,))
+    last = cur.fetchone()[0]
+    if last is not None:
+        return floor_to(last + timedelta(minutes=minutes) - timedelta(minutes=LATE_MINUTES), 60)
+
+    cur.execute('SELECT min("checkedAt") FROM network_ping_results')
+    oldest = cur.fetchone()[0]
+    return floor_to(oldest, 60) if oldest is not None else None
+
+
+def rolled_up_until(cur, minutes: int) -> datetime:
+    cur.execute('SELECT max("bucketStart") FROM network_ping_rollups WHERE "bucketMinutes" = %s', (minutes,))
+    last = cur.fetchone()[0]
+    return last + timedelta(minutes=minutes) if last is not None else None
+
+
+def rollup(conn, minutes: int, window_hours: int, deadline: float) -> bool:
+    """Roll raw results up into buckets of `minutes`; False if the time budget ran out"""
+    with conn.cursor() as cur:
+        start = rollup_start(cur, minutes)
+    if start is None:
+        log(f"{minutes}m rollup: no ping results")
+        return True
+
+    end = floor_to(utcnow() - timedelta(minutes=SETTLE_MINUTES), minutes)
+    windows = 0
+    buckets = 0
+    while start < end:
+        if time.monotonic() > deadline:
+            log(f"{minutes}m rollup: time budget spent, continuing from {start.isoformat()} next run")
+            return False
+
+        window_end = min(start + timedelta(hours=window_hours), end)
+        with conn.cursor() as cur:
+            cur.execute(ROLLUP_SQL, {'minutes': minutes, 'start': start, 'end': window_end})
+            buckets += cur.rowcount
+        conn.commit()
+        windows += 1
+        start = window_end
+
+    log(f"{minutes}m rollup: {buckets} buckets written in {windows} windows, up to {end.isoformat()}")
+    return True
+
+
+def delete_in_batches(conn, sql: str, params: dict, batch_size: int, deadline: float) -> int:
+    deleted = 0
+    while time.monotonic() <= deadline:
+        with conn.cursor() as cur:
+            cur.execute(sql, {**params, 'limit': batch_size})
+            count = cur.rowcount
+        conn.commit()
+        deleted += count
+        if count < batch_size:
+            break
+    return deleted
+
+
+def prune(conn, args, deadline: float):
+    now = utcnow()
+
+    # Raw results only go once every resolution has rolled them up, and never
+    # inside the window recomputed for late results
+    with conn.cursor() as cur:
+        covered = [rolled_up_until(cur, minutes) for minutes in RESOLUTIONS]
+    if any(until is None for until in covered):
+        log("Raw results kept: rollups not complete yet")
+    else:
+        before = min([now - timedelta(days=args.raw_days)] +
+                     [until - timedelta(minutes=LATE_MINUTES) for until in covered])
+        deleted = delete_in_batches(conn, DELETE_RAW_SQL, {'before': before}, args.batch_size, deadline)
+        log(f"Deleted {deleted} raw results before {before.isoformat()}")
+
+    for minutes, days in ((5, args.five_minute_days), (60, args.hourly_days)):
+        before = now - timedelta(days=days)
+        deleted = delete_in_batches(conn, DELETE_ROLLUPS_SQL, {'minutes': minutes, 'before': before},
+                                    args.batch_size, deadline)
+        log(f"Deleted {deleted} {minutes}m rollups before {before.isoformat()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compact network ping results into rollups and apply retention')
+    parser.add_argument('--database-url', help='PostgreSQL URL (default: DATABASE_URL)')
+    parser.add_argument('--raw-days', type=int, default=RAW_RETENTION_DAYS,
+                        help='days of raw ping results to keep')
+    parser.add_argument('--five-minute-days', type=int, default=FIVE_MINUTE_RETENTION_DAYS,
+                        help='days of 5-minute rollups to keep')
+    parser.add_argument('--hourly-days', type=int, default=HOURLY_RETENTION_DAYS,
+                        help='days of hourly rollups to keep')
+    parser.add_argument('--window-hours', type=int, default=6,
+                        help='hours of raw results rolled up per transaction')
+    parser.add_argument('--batch-size', type=int, default=10000,
+                        help='rows deleted per transaction')
+    parser.add_argument('--max-seconds', type=float, default=600,
+                        help='stop starting new batches after this long')
+    parser.add_argument('--no-prune', action='store_true', help='roll up only, delete nothing')
+    args = parser.parse_args()
+
+    if psycopg2 is None:
+        log("psycopg2 is required: pip install psycopg2-binary")
+        sys.exit(1)
+
+    url = args.database_url or load_database_url()
+    if not url:
+        log("DATABASE_URL is not set")
+        sys.exit(1)
+
+    deadline = time.monotonic() + args.max_seconds
+    conn = connect(url)
+    try:
+        complete = all([rollup(conn, minutes, args.window_hours, deadline) for minutes in RESOLUTIONS])
+        if not args.no_prune:
+            prune(conn, args, deadline)
+        if not complete:
+            sys.exit(2)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()